@@ -5,19 +5,27 @@ Created on Wed Sep 17 21:39:56 2025
 @author: JIajie Shi
 """
 
-import os, json, math, re
+import os, json, math, re, time, asyncio
+from collections import Counter
 from typing import List, Dict, Any, Optional, Tuple
 from dataclasses import dataclass
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from dotenv import load_dotenv
 from neo4j import GraphDatabase
 import httpx
-from lightrag_client import retrieve_context_with_sources
+from lightrag_client import retrieve_context_with_sources, MAX_CONTEXT_CHARS
+import neo4j_retrieval
+from kb_store import open_store, iter_kb, chunk_block, KB_PATH
+from page_router import PageRouter, Route, tokens, ROUTER_MIN_BM25
+from kg_graph import KGSnapshot, SNAPSHOT_PATH
+import entity_linker
+import tracing
+from ollama_opts import OLLAMA_NUM_CTX, OLLAMA_NUM_PREDICT, OLLAMA_KEEP_ALIVE, ollama_options, keep_alive
 
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response
 
 # ------------------ Config ------------------
 load_dotenv()
@@ -31,13 +39,29 @@ OLLAMA_HOST    = os.getenv("OLLAMA_HOST", "http://localhost:11434")
 # Generation defaults
 DEFAULT_GEN_BACKEND = os.getenv("DEFAULT_GEN_BACKEND", "ollama").lower()  # "ollama" or "openrouter"
 
+# Retrieval: "lightrag" (mix mode) or "neo4j" (vector + full-text RRF, neo4j_retrieval.py)
+DEFAULT_RETRIEVER = os.getenv("DEFAULT_RETRIEVER", "lightrag").lower()
+
 # OpenRouter (optional)
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 OPENROUTER_MODEL   = os.getenv("OPENROUTER_MODEL", "deepseek/deepseek-chat-v3.1:free")
 
 # Ollama generation (local)
 OLLAMA_GEN_MODEL   = os.getenv("OLLAMA_GEN_MODEL", "qwen2.5:7b-instruct-q4_K_M")
-OLLAMA_NUM_CTX     = int(os.getenv("OLLAMA_NUM_CTX", "4096"))
+# num_ctx / num_predict / keep_alive come from ollama_opts.py, shared with LightRAG's calls
+
+# Cascade: draft with a small model, answer with the backend's model only when the draft fails
+# check_draft (no / out-of-range citations, little overlap with the context, "I don't know")
+CASCADE              = os.getenv("CASCADE", "0") == "1"      # default for AskRequest.cascade
+OLLAMA_DRAFT_MODEL   = os.getenv("OLLAMA_DRAFT_MODEL", "qwen2.5:1.5b-instruct")
+CASCADE_MIN_OVERLAP  = float(os.getenv("CASCADE_MIN_OVERLAP", "0.6"))   # share of draft terms found in the context
+
+# KG boost (use_kg): chunks the graph adds are appended to the context within this budget
+KG_CONTEXT_CHARS   = int(os.getenv("KG_CONTEXT_CHARS", "1500"))
+
+# /ask: server-side deadline (0 = none) and how often to check whether the client is still there
+ASK_DEADLINE_S     = float(os.getenv("ASK_DEADLINE_S", "120"))
+DISCONNECT_POLL_S  = float(os.getenv("DISCONNECT_POLL_S", "0.25"))
 
 # ------------------ FastAPI ------------------
 app = FastAPI(title="Vibrant RAG API", version="1.0")
@@ -46,23 +70,145 @@ app.add_middleware(
     allow_origins=["*"], allow_methods=["*"], allow_headers=["*"], allow_credentials=True
 )
 
+# Per-request span traces (tracing.py): patches outbound clients only when TRACE_ENABLED=1
+tracing.install()
+
 # Neo4j driver (one per process)
 driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
 
+# Indexed KB (kb.sqlite from finalize_kb.py) to label sources; None until it is built
+kb_store = open_store()
+
+# Test-page router (page_router.py) over the KB: kb.sqlite, or kb.jsonl while the store is
+# missing / stale (iter_kb falls back); None only when neither exists
+def load_router() -> Optional[PageRouter]:
+    if kb_store is None and not KB_PATH.exists():
+        print("[route] disabled: no kb.sqlite or kb.jsonl yet (run finalize_kb.py); every query searches globally")
+        return None
+    if kb_store is None:
+        print("[route] kb.sqlite missing or stale; routing over kb.jsonl")
+    return PageRouter(iter_kb())
+
+router = load_router()
+
+# CSR snapshot of the KG (kg_graph.py) for use_kg; loaded at startup, swapped by /kg/refresh
+kg_snapshot: Optional[KGSnapshot] = None
+# Aho-Corasick over entity names / aliases (entity_linker.py); same lifecycle as the snapshot
+linker: Optional[entity_linker.EntityLinker] = None
+
+# /ask counters served by /metrics: requests, completed, failed, cancelled work by reason and stage,
+# tokens Ollama had decoded / seconds spent before an abort
+METRICS: Counter = Counter()
+
 # ------------------ Models ------------------
 class AskRequest(BaseModel):
     query: str
     top_k: int = 6
     use_kg: bool = True
     gen_backend: Optional[str] = None  # "ollama" | "openrouter"
+    retriever: Optional[str] = None    # "lightrag" | "neo4j"
     temperature: float = 0.2
+    debug: bool = False                # include retrieval details (linked entities, ...) in the response
+    route: bool = True                 # narrow retrieval to the test page(s) the question names
+    cascade: Optional[bool] = None     # draft with OLLAMA_DRAFT_MODEL first (default: CASCADE)
 
 class AskResponse(BaseModel):
     answer: str
     sources: List[Dict[str, Any]]
+    debug: Optional[Dict[str, Any]] = None
+    trace: Optional[Dict[str, Any]] = None   # span tree, when requested (X-Trace / ?trace=) and enabled
 
 # ------------------ Utils ------------------
 
+# Stable system prefix, then the retrieved context, then the question: Ollama (and OpenRouter's
+# providers) reuse the KV cache of the prefix a prompt shares with an earlier one, so the system
+# prompt is prefilled once, and follow-ups over the same context (routed pages) only the question.
+# Keep anything per-request (dates, ids) out of SYSTEM_PROMPT.
+SYSTEM_PROMPT = (
+    "You are a precise assistant for the Vibrant Wellness test menu. "
+    "Answer ONLY using the provided context. If the answer is not in the context, say you don't know. "
+    "Cite claims using bracketed numbers like [1], [2] that refer to the Sources list below. "
+)
+
+def page_context(hits: List[Dict[str, Any]]) -> str:
+    """
+    Context for routed (BM25-ranked) hits: the best ones that fit MAX_CONTEXT_CHARS, laid out in
+    page order rather than score order, so follow-up questions about the same page produce the
+    same leading blocks and Ollama can reuse their prefill.
+    """
+    kept, used = [], 0
+    for h in hits:
+        n = len(chunk_block(h)) + 2
+        if kept and used + n > MAX_CONTEXT_CHARS:
+            break
+        kept.append(h)
+        used += n
+    kept.sort(key=lambda h: router.seq.get(h["id"], 0))
+    return "\n\n".join(chunk_block(h) for h in kept)[:MAX_CONTEXT_CHARS]
+
+def build_messages(query: str, ctx_text: str, sources_block: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content":
+         f"Context:\n{ctx_text}\n\n"
+         f"Sources:\n{sources_block}\n\n"
+         f"Question:\n{query}\n\n"
+         f"Answer:"},
+    ]
+
+def quoted_rows(url: str, ctx_text: str) -> List[Dict[str, Any]]:
+    """kb rows from `url` whose question appears in the context."""
+    if kb_store is None:
+        return []
+    return [r for r in kb_store.by_url(url) if r.get("question") and r["question"] in ctx_text]
+
+def source_question(url: str, ctx_text: str) -> str:
+    """Question of the kb row from `url` quoted in the context, else the page's title."""
+    if kb_store is None:
+        return ""
+    quoted = quoted_rows(url, ctx_text)
+    if quoted:
+        return quoted[0]["question"]
+    rows = kb_store.by_url(url)
+    return (rows[0].get("heading_path") or [rows[0].get("question", "")])[0] if rows else ""
+
+def kg_boost(hits: List[Dict[str, Any]], urls: List[str], ctx_text: str, entities: List[str] = (),
+             max_urls: int = 6):
+    """
+    Re-rank the retrieved chunks with the KG snapshot and append the chunks it adds.
+    Seeds are the neo4j hits, or for LightRAG the kb rows its context quotes, in source order,
+    plus the entities linked in the question.
+    Retrieved pages keep the first Sources slots (in the new order); added chunks only fill the
+    slots left up to `max_urls`, and are dropped when their page does not fit, so every block in
+    the context has a source number.
+    Returns (ctx_text, urls, hits) with urls / hits in the new order.
+    """
+    if not hits:
+        hits = [r for u in urls for r in quoted_rows(u, ctx_text)]
+    by_id = {h["id"]: h for h in hits}
+    ranked = kg_snapshot.rerank(list(by_id), entities=entities)
+    # pages LightRAG cited without a quoted kb row keep their place after the ranked ones
+    urls = list(dict.fromkeys([by_id[cid]["url"] for cid, _, added in ranked if not added] + urls))
+    extra, budget = [], KG_CONTEXT_CHARS
+    for cid, _, added in ranked:
+        if not added:
+            continue
+        row = kb_store.get(cid) if kb_store is not None else None
+        block = row and chunk_block(row)
+        if not block or len(block) > budget:
+            continue
+        if row["url"] not in urls:
+            if len(urls) >= max_urls:
+                continue
+            urls.append(row["url"])
+        budget -= len(block) + 2
+        by_id[cid] = row
+        extra.append(block)
+    hits = [by_id[cid] for cid, _, _ in ranked if cid in by_id]
+    if extra:
+        ctx_text += "\n\n" + "\n\n".join(extra)
+    return ctx_text, urls, hits
+
 async def generate_openrouter(messages: List[Dict[str, str]], temperature: float) -> str:
     if not OPENROUTER_API_KEY:
         raise RuntimeError("OPENROUTER_API_KEY not set")
@@ -76,7 +222,7 @@ async def generate_openrouter(messages: List[Dict[str, str]], temperature: float
         "model": OPENROUTER_MODEL,
         "messages": messages,
         "temperature": temperature,
-        "max_tokens": 600,
+        "max_tokens": OLLAMA_NUM_PREDICT,
     }
     async with httpx.AsyncClient(timeout=90.0) as client:
         r = await client.post("https://openrouter.ai/api/v1/chat/completions", headers=headers, json=payload)
@@ -84,18 +230,73 @@ async def generate_openrouter(messages: List[Dict[str, str]], temperature: float
         data = r.json()
     return data["choices"][0]["message"]["content"]
 
-async def generate_ollama(messages: List[Dict[str, str]], temperature: float) -> str:
+async def generate_ollama(messages: List[Dict[str, str]], temperature: float,
+                          work: Optional[Dict[str, Any]] = None, model: Optional[str] = None) -> str:
+    """
+    Streamed from Ollama and joined, so cancelling the caller closes the connection mid-answer
+    and Ollama stops decoding. `work["tokens"]` counts the chunks received (one per token).
+    """
     payload = {
-        "model": OLLAMA_GEN_MODEL,
+        "model": model or OLLAMA_GEN_MODEL,
         "messages": messages,
-        "stream": False,
-        "options": {"temperature": temperature, "num_ctx": OLLAMA_NUM_CTX}
+        "stream": True,
+        "options": ollama_options(temperature=temperature),
+        "keep_alive": keep_alive(),
     }
+    parts = []
     async with httpx.AsyncClient(timeout=180.0) as client:
-        r = await client.post(f"{OLLAMA_HOST}/api/chat", json=payload)
-        r.raise_for_status()
-        data = r.json()
-    return data.get("message", {}).get("content", "")
+        async with client.stream("POST", f"{OLLAMA_HOST}/api/chat", json=payload) as r:
+            r.raise_for_status()
+            async for line in r.aiter_lines():
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                if data.get("error"):
+                    raise RuntimeError(f"Ollama: {data['error']}")
+                parts.append(data.get("message", {}).get("content", ""))
+                if work is not None:
+                    work["tokens"] += 1
+                if data.get("done"):
+                    tracing.annotate(**tracing.usage_attrs(data))
+                    break
+    return "".join(parts)
+
+async def generate_tier(tier: str, backend: str, messages: List[Dict[str, str]], temperature: float,
+                        work: Dict[str, Any], model: Optional[str] = None) -> str:
+    """One generation, timed into METRICS as gen_<tier>_calls / gen_<tier>_seconds."""
+    t = time.perf_counter()
+    with tracing.span(f"generate.{tier}", backend=backend, model=model or "",
+                      prompt_chars=sum(len(m["content"]) for m in messages)):
+        answer = (await generate_ollama(messages, temperature, work, model)) if backend == "ollama" \
+                 else (await generate_openrouter(messages, temperature))
+    METRICS[f"gen_{tier}_calls"] += 1
+    METRICS[f"gen_{tier}_seconds"] = round(METRICS[f"gen_{tier}_seconds"] + time.perf_counter() - t, 3)
+    return answer
+
+IDK_RE = re.compile(r"\b(?:i\s+(?:do\s*n[o']?t|cannot|can't)\s+(?:know|find|say)|not\s+(?:mentioned|provided|"
+                    r"(?:found|included|available)\s+in)\b|no\s+information)", re.I)
+CITATION_RE = re.compile(r"\[(\d+)\]")
+
+def check_draft(answer: str, ctx_text: str, n_sources: int) -> Optional[str]:
+    """Why a draft answer should be escalated, or None to accept it. Cheap string checks only."""
+    if not answer.strip():
+        return "empty"
+    if IDK_RE.search(answer):
+        return "dont_know"
+    cited = [int(n) for n in CITATION_RE.findall(answer)]
+    if not cited:
+        return "no_citation"
+    if any(not 1 <= n <= n_sources for n in cited):
+        return "bad_citation"
+    terms = set(tokens(CITATION_RE.sub(" ", answer)))
+    if terms and len(terms & set(tokens(ctx_text))) / len(terms) < CASCADE_MIN_OVERLAP:
+        return "low_overlap"
+    return None
+
+async def wait_disconnect(request: Request):
+    """Returns once the client has gone away."""
+    while not await request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_S)
 
 # ------------------ Routes ------------------
 
@@ -115,7 +316,7 @@ def home():
     .card{background:#12182b; border:1px solid #1f2742; border-radius:14px; padding:16px; box-shadow:0 6px 24px rgba(0,0,0,.15);}
     textarea, input, select, button{width:100%; font:inherit; border-radius:10px; border:1px solid #2e385e; background:#0f1424; color:#e9edf5;}
     textarea{min-height:110px; padding:12px; resize:vertical;}
-    .row{display:grid; grid-template-columns: 1fr 1fr 1fr; gap:12px; margin-top:12px;}
+    .row{display:grid; grid-template-columns: 1fr 1fr 1fr 1fr; gap:12px; margin-top:12px;}
     .row .col{display:flex; gap:8px; align-items:center;}
     label{font-size:13px; opacity:.85;}
     button{padding:12px; cursor:pointer; background:#2c7cf4; border-color:#2c7cf4; margin-top:12px;}
@@ -148,6 +349,13 @@ def home():
             <option value="openrouter">OpenRouter (cloud)</option>
           </select>
         </div>
+        <div class="col">
+          <label for="retriever">Retriever</label>
+          <select id="retriever">
+            <option value="lightrag" selected>LightRAG (mix)</option>
+            <option value="neo4j">Neo4j hybrid</option>
+          </select>
+        </div>
       </div>
 
       <button id="askBtn">Ask</button>
@@ -172,6 +380,7 @@ async function ask() {
   const top_k = parseInt(document.getElementById('topk').value || '6', 10);
   const use_kg = document.getElementById('usekg').checked;
   const gen_backend = document.getElementById('backend').value;
+  const retriever = document.getElementById('retriever').value;
 
   if (!query) { qEl.focus(); return; }
 
@@ -180,7 +389,7 @@ async function ask() {
     const r = await fetch('/ask', {
       method: 'POST',
       headers: {'Content-Type':'application/json'},
-      body: JSON.stringify({ query, top_k, use_kg, gen_backend, temperature: 0.2 })
+      body: JSON.stringify({ query, top_k, use_kg, gen_backend, retriever, temperature: 0.2 })
     });
     if (!r.ok) throw new Error(await r.text());
     const data = await r.json();
@@ -211,6 +420,39 @@ qEl.addEventListener('keydown', (ev) => {
 </html>
     """
 
+@app.on_event("startup")
+async def startup():
+    global kg_snapshot, linker
+    try:
+        kg_snapshot = await asyncio.to_thread(
+            KGSnapshot.load if SNAPSHOT_PATH.exists() else (lambda: KGSnapshot.from_neo4j(driver)))
+        print(f"[kg] snapshot: {kg_snapshot.stats()}")
+    except Exception as e:
+        print(f"[kg] no snapshot ({e}); use_kg is a no-op until POST /kg/refresh")
+    try:
+        linker = await asyncio.to_thread(
+            entity_linker.load if entity_linker.ENTITIES_PATH.exists() else (lambda: entity_linker.rebuild(driver)))
+        print(f"[link] {linker.stats()}")
+    except Exception as e:
+        print(f"[link] no entity linker ({e}); until POST /kg/refresh")
+
+@app.post("/kg/refresh")
+async def kg_refresh():
+    """Rebuild the KG snapshot and entity linker from Neo4j (e.g. after build_kg.py) and swap them in."""
+    global kg_snapshot, linker
+    t = time.perf_counter()
+    snap = await asyncio.to_thread(KGSnapshot.from_neo4j, driver)
+    await asyncio.to_thread(snap.save)
+    new_linker = await asyncio.to_thread(entity_linker.rebuild, driver)
+    kg_snapshot, linker = snap, new_linker
+    return {"ok": True, "stats": snap.stats(), "linker": linker.stats(),
+            "seconds": round(time.perf_counter() - t, 2)}
+
+@app.on_event("shutdown")
+async def shutdown():
+    await neo4j_retrieval.close()
+    driver.close()
+
 @app.get("/health")
 async def health():
     try:
@@ -226,16 +468,131 @@ async def config():
         "neo4j_uri": NEO4J_URI,
         "embed_model": EMBED_MODEL,
         "gen_default": DEFAULT_GEN_BACKEND,
+        "retriever_default": DEFAULT_RETRIEVER,
         "gen_ollama_model": OLLAMA_GEN_MODEL,
         "gen_openrouter_model": OPENROUTER_MODEL,
+        "ollama_num_ctx": OLLAMA_NUM_CTX,
+        "ollama_keep_alive": OLLAMA_KEEP_ALIVE,
+        "cascade_default": CASCADE,
+        "gen_draft_model": OLLAMA_DRAFT_MODEL,
     }
 
+@app.get("/metrics")
+def metrics():
+    out = dict(METRICS)
+    if METRICS["cascade_drafts"]:
+        out["cascade_hit_rate"] = round(METRICS["cascade_accepted"] / METRICS["cascade_drafts"], 3)
+    for tier in ("draft", "large"):
+        if METRICS[f"gen_{tier}_calls"]:
+            out[f"gen_{tier}_mean_ms"] = round(1000 * METRICS[f"gen_{tier}_seconds"] / METRICS[f"gen_{tier}_calls"], 1)
+    return out
+
 @app.post("/ask", response_model=AskResponse)
-async def ask(req: AskRequest):
+async def ask(req: AskRequest, request: Request):
+    """
+    Runs the answer as a task raced against the client disconnecting and ASK_DEADLINE_S;
+    whichever comes first cancels it, which aborts the retrieval / generation call in flight
+    (the Ollama stream is closed, so the model stops decoding).
+    """
+    METRICS["ask_requests"] += 1
+    work = {"stage": "retrieval", "tokens": 0, "t0": time.perf_counter()}
+    # opt-in span tree (TRACE_ENABLED=1 and X-Trace: 1 | profile, or ?trace=1 | profile)
+    mode = tracing.requested(request.headers.get("x-trace") or request.query_params.get("trace"))
+    trace = tracing.Trace("ask", profile=mode == "profile", query=req.query) if mode else tracing.NO_SPAN
+    with trace:
+        task = asyncio.create_task(answer_query(req, work))
+        watcher = asyncio.create_task(wait_disconnect(request))
+        try:
+            done, _ = await asyncio.wait({task, watcher}, timeout=ASK_DEADLINE_S or None,
+                                         return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            watcher.cancel()
+            if not task.done():
+                task.cancel()
+    if task in done:
+        if task.exception() is not None:
+            METRICS["ask_failed"] += 1
+            if mode:
+                trace.root.set(error=type(task.exception()).__name__)
+                trace.save()
+            raise task.exception()
+        METRICS["ask_completed"] += 1
+        resp = task.result()
+        if mode:
+            resp.trace = trace.to_dict()
+            path = trace.save()
+            if path:
+                resp.trace["file"] = path
+        return resp
+    try:
+        await task
+    except (asyncio.CancelledError, Exception):
+        pass
+    reason = "disconnect" if watcher in done else "deadline"
+    if mode:
+        trace.root.set(cancelled=reason)
+        trace.save()
+    METRICS[f"ask_cancelled_{reason}"] += 1
+    METRICS[f"ask_cancelled_in_{work['stage']}"] += 1
+    METRICS["ask_cancelled_tokens"] += work["tokens"]
+    METRICS["ask_cancelled_seconds"] = round(METRICS["ask_cancelled_seconds"] + time.perf_counter() - work["t0"], 3)
+    print(f"[ask] cancelled ({reason}) during {work['stage']} after {work['tokens']} tokens")
+    if reason == "deadline":
+        raise HTTPException(status_code=504, detail=f"No answer within {ASK_DEADLINE_S:g}s")
+    return Response(status_code=499)   # nobody is listening; nginx's "client closed request"
+
+async def answer_query(req: AskRequest, work: Dict[str, Any]) -> AskResponse:
     backend = (req.gen_backend or DEFAULT_GEN_BACKEND).lower()
 
-    # 1) Retrieve contexts with LightRAG (mix mode)
-    ctx_text, urls = await retrieve_context_with_sources(req.query, top_k=req.top_k)
+    retriever = (req.retriever or DEFAULT_RETRIEVER).lower()
+
+    # 0) Route: when the question names a test page, search only that page's chunks
+    with tracing.span("route") as s:
+        route = router.route(req.query) if (router is not None and req.route) else Route()
+        s.set(pages=len(route.pages))
+
+    # 1) Retrieve contexts: LightRAG (mix mode), or one hybrid Cypher query against Neo4j;
+    #    routed queries fall back to the global search when the pages yield nothing
+    hits, scope, scoped_best = [], "global", None
+    with tracing.span(f"retrieve.{retriever}") as s:
+        if retriever == "neo4j":
+            if route.pages:
+                with tracing.span("neo4j.scoped"):
+                    ctx_text, urls, hits = await neo4j_retrieval.retrieve_context_with_sources(
+                        req.query, top_k=req.top_k, urls=route.urls)
+                scope = "pages" if hits else "global"
+            if not hits:
+                with tracing.span("neo4j.global"):
+                    ctx_text, urls, hits = await neo4j_retrieval.retrieve_context_with_sources(
+                        req.query, top_k=req.top_k)
+        else:
+            # LightRAG cannot filter by page: routed queries are ranked in-process over those pages' rows;
+            # a weak best match (the question names the page but asks something it does not cover) goes global
+            if route.pages:
+                with tracing.span("bm25.scoped") as s2:
+                    scored = router.scored_search(req.query, route.urls, req.top_k)
+                    scoped_best = round(scored[0][0], 3) if scored else 0.0
+                    s2.set(best=scoped_best)
+                if scoped_best >= ROUTER_MIN_BM25:
+                    hits = [r for _, r in scored]
+            if hits:
+                scope = "pages"
+                ctx_text = page_context(hits)
+                urls = list(dict.fromkeys(h["url"] for h in hits))
+            else:
+                with tracing.span("lightrag.aquery"):
+                    ctx_text, urls = await retrieve_context_with_sources(req.query, top_k=req.top_k)
+        s.set(scope=scope, hits=len(hits), urls=len(urls), context_chars=len(ctx_text))
+
+    # 1b) KG boost: re-rank through shared entities (and those the question names), add linked chunks
+    with tracing.span("entity_link") as s:
+        mentions = linker.link(req.query) if linker is not None else []
+        entity_ids = list(dict.fromkeys(c for m in mentions for c in m["entities"]))
+        s.set(entities=len(entity_ids))
+    if req.use_kg and kg_snapshot is not None:
+        with tracing.span("kg_boost") as s:
+            ctx_text, urls, hits = kg_boost(hits, urls, ctx_text, entity_ids, max_urls=req.top_k)
+            s.set(context_chars=len(ctx_text))
 
     # Ensure unique, ordered sources (max = top_k)
     seen = set()
@@ -250,25 +607,39 @@ async def ask(req: AskRequest):
     # Build a numbered Sources block so the LLM can cite [1], [2], ...
     sources_block = "\n".join(f"[{i+1}] {u}" for i, u in enumerate(ordered_urls))
 
-    # 2) Build prompt (ASK the model to use [n] citations)
-    messages = [
-        {"role": "system", "content":
-         "You are a precise assistant for the Vibrant Wellness test menu. "
-         "Answer ONLY using the provided context. If the answer is not in the context, say you don't know. "
-         "Cite claims using bracketed numbers like [1], [2] that refer to the Sources list below. "
-        },
-        {"role": "user", "content":
-         f"Question:\n{req.query}\n\n"
-         f"Context:\n{ctx_text}\n\n"
-         f"Sources:\n{sources_block}\n\n"
-         f"Answer:"}
-    ]
+    # 2) Build prompt (ASK the model to use [n] citations); question last for prefix caching
+    messages = build_messages(req.query, ctx_text, sources_block)
 
     # 3) Generate with your chosen backend (Ollama by default)
-    answer = (await generate_ollama(messages, req.temperature)) if backend == "ollama" \
-             else (await generate_openrouter(messages, req.temperature))
+    #    cascade: a small local model drafts; the chosen backend answers only if the draft fails its checks
+    work["stage"] = "generation"
+    tier, escalated = "large", None
+    if req.cascade if req.cascade is not None else CASCADE:
+        try:
+            draft = await generate_tier("draft", "ollama", messages, req.temperature, work, OLLAMA_DRAFT_MODEL)
+            escalated = check_draft(draft, ctx_text, len(ordered_urls))
+        except Exception as e:
+            # draft model not pulled, Ollama unreachable, timeout: the chosen backend still answers
+            print(f"[cascade] draft failed ({e!r}); escalating")
+            escalated = "error"
+        METRICS["cascade_drafts"] += 1
+        if escalated is None:
+            METRICS["cascade_accepted"] += 1
+            answer, tier = draft, "draft"
+        else:
+            METRICS["cascade_escalated"] += 1
+            METRICS[f"cascade_escalated_{escalated}"] += 1
+    if tier == "large":
+        answer = await generate_tier("large", backend, messages, req.temperature, work)
 
     # 4) Return answer + sources (keep numbering consistent with Sources block)
-    srcs = [{"url": u, "question": ""} for u in ordered_urls]
-    return AskResponse(answer=answer.strip(), sources=srcs)
+    # (neo4j hits already carry their chunk's question; the best-ranked one per page is used)
+    hit_question = {}
+    for h in hits:
+        hit_question.setdefault(h["url"], h["question"])
+    srcs = [{"url": u, "question": hit_question.get(u) or source_question(u, ctx_text)} for u in ordered_urls]
+    debug = {"retriever": retriever, "scope": scope, "route": route.pages, "route_best": round(route.best, 3),
+             "scoped_bm25": scoped_best,
+             "entities": entity_ids, "mentions": mentions, "tier": tier, "escalated": escalated} if req.debug else None
+    return AskResponse(answer=answer.strip(), sources=srcs, debug=debug)
 
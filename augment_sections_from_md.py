@@ -5,55 +5,82 @@ Created on Wed Sep 17 18:23:31 2025
 @author: JIajie Shi
 """
 
-import json, pathlib, re
+import json, pathlib
+
+from page_store import iter_markdown
+from md_parse import parse, map_pages, leaf_sections, split_tokens, CHUNK_TOKENS, CHUNK_OVERLAP, CHARS_PER_TOKEN
 
-DATA_DIR = pathlib.Path("data")
-MD_DIR   = DATA_DIR / "md"
-URL_MAP  = DATA_DIR / "url_map.tsv"
 OUT      = pathlib.Path("sections.jsonl")
 
-def norm(s:str)->str: return re.sub(r"\s+"," ",(s or "")).strip()
-
-def load_url_map():
-    m={}
-    if URL_MAP.exists():
-        for ln in URL_MAP.read_text(encoding="utf-8").splitlines():
-            if "\t" in ln:
-                uid,url=ln.split("\t",1); m[uid]=url
-    return m
-
-def extract_sections(md:str):
-    lines = md.splitlines()
-    headers=[]
-    for i,ln in enumerate(lines):
-        m=re.match(r"^(#{1,6})\s+(.*\S)\s*$", ln.strip())
-        if m:
-            level=len(m.group(1)); title=norm(m.group(2))
-            headers.append((i,level,title))
-    items=[]
-    for idx,(i,lvl,title) in enumerate(headers):
-        if lvl>4 or len(title)<3: continue
-        end=len(lines)
-        for j in range(idx+1,len(headers)):
-            if headers[j][1] <= lvl:
-                end = headers[j][0]; break
-        body = norm("\n".join(lines[i+1:end]))
-        if len(body)>=60 and len(title)<=180:
-            items.append({"kind":"section","question":title,"answer":body})
+def is_chunk_header(s)->bool:
+    return s.level<=4 and 3<=len(s.title)<=180
+
+def extract_sections(doc):
+    """
+    Chunks from each section's own text (children are chunks of their own), so no text is
+    repeated in its ancestors. Consecutive small siblings are packed into one chunk under
+    their parent heading; long sections are split. Every chunk stays within CHUNK_TOKENS
+    and carries its heading path, the context the enclosing text used to provide.
+    """
+    max_chars = int(CHUNK_TOKENS*CHARS_PER_TOKEN)
+    items=[]; group=[]; size=0
+
+    def emit(title, path, text):
+        pieces = split_tokens(text, CHUNK_TOKENS, CHUNK_OVERLAP)
+        for n,piece in enumerate(pieces):
+            it={"kind":"section","question":title,"answer":piece,"heading_path":path}
+            if len(pieces)>1: it["part"]=n
+            items.append(it)
+
+    def flush():
+        nonlocal size
+        if len(group)==1:
+            s,path,text = group[0]; emit(s.title, path, text)
+        elif group:
+            path = group[0][1][:-1]
+            emit(path[-1], path, " ".join(f"{s.title}: {text}" for s,_,text in group))
+        group.clear(); size=0
+
+    for s,path,text in leaf_sections(doc, is_chunk_header):
+        if len(text)<60: continue
+        piece = len(s.title)+2+len(text)
+        if group and (path[:-1]!=group[0][1][:-1] or size+1+piece>max_chars):
+            flush()
+        if len(path)>1 and piece<=max_chars:
+            group.append((s,path,text)); size+=piece+1
+        else:
+            emit(s.title, path, text)
+    flush()
     return items
 
+def nested_size(doc):
+    """(items, chars) the previous parent-includes-children sections would have emitted."""
+    n=chars=0
+    for s in doc.sections:
+        if not is_chunk_header(s): continue
+        body = doc.body_text(s)
+        if len(body)>=60: n+=1; chars+=len(body)
+    return n,chars
+
+def page_sections(page):
+    """(uid, url, items, nested size) for one (uid, url, markdown) page; runs in a worker."""
+    uid,url,md = page
+    doc = parse(md)
+    return uid,url,extract_sections(doc),nested_size(doc)
+
 def main():
-    url_map=load_url_map()
-    total=0
+    total=chars=old_n=old_chars=0
     with OUT.open("w",encoding="utf-8") as out:
-        for p in sorted(MD_DIR.glob("*.md")):
-            uid=p.stem; url=url_map.get(uid,"")
-            md=p.read_text(encoding="utf-8",errors="ignore")
-            sections=extract_sections(md)
+        for uid,url,sections,(n,c) in map_pages(page_sections, iter_markdown()):
+            old_n+=n; old_chars+=c
             for it in sections:
                 it.update({"url":url,"doc_id":uid,"section":None,"source_format":"md_section"})
-                out.write(json.dumps(it,ensure_ascii=False)+"\n"); total+=1
+                out.write(json.dumps(it,ensure_ascii=False)+"\n"); total+=1; chars+=len(it["answer"])
     print(f"wrote {total} section items -> {OUT.resolve()}")
+    if old_n:
+        print(f"[report] nested sections: {old_n} items, {old_chars/1e6:.2f}M chars | "
+              f"leaf chunks (<= {CHUNK_TOKENS} tokens, overlap {CHUNK_OVERLAP}): {total} items, {chars/1e6:.2f}M chars | "
+              f"embedding inputs {100*(total/old_n-1):+.0f}%, text to embed / KG-extract {100*(chars/max(old_chars,1)-1):+.0f}%")
 
 if __name__=="__main__":
     main()
\ No newline at end of file
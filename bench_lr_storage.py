@@ -0,0 +1,156 @@
+# bench_lr_storage.py
+# Startup time / memory of LightRAG's JSON KV + NanoVectorDB storages vs lr_disk_storage.py
+# (SQLite KV + memory-mapped vectors) at a given catalog size.
+# - `build` writes a synthetic workdir per backend (random vectors, filler text) through
+#   the storages' own upsert(), so the on-disk formats are the real ones
+# - each probe runs in a fresh subprocess: open every storage (what initialize_storages() does),
+#   then one vector query and a few KV reads; reports seconds and peak RSS (/proc on Linux,
+#   getrusage elsewhere on Unix, psutil's peak working set on Windows)
+#
+# Usage: python bench_lr_storage.py [--chunks 20000] [--entities 40000] [--queries 20]
+
+import os, sys, json, time, random, shutil, asyncio, argparse, subprocess
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import resource                                   # Unix only
+except ImportError:
+    resource = None
+
+from lightrag.kg.shared_storage import initialize_share_data
+from lightrag.kg.json_kv_impl import JsonKVStorage
+from lightrag.kg.nano_vector_db_impl import NanoVectorDBStorage
+from lightrag.utils import EmbeddingFunc
+
+import lr_disk_storage
+
+BENCH_DIR = Path(os.getenv("LR_BENCH_DIR", "./lr_bench"))
+DIM = 768                                             # nomic-embed-text
+
+BACKENDS = {
+    "json": (JsonKVStorage, NanoVectorDBStorage),
+    "disk": (lr_disk_storage.SQLiteKVStorage, lr_disk_storage.MmapVectorStorage),
+}
+KV_NAMESPACES = ["full_docs", "text_chunks", "llm_response_cache"]
+VDB_NAMESPACES = {                                    # namespace -> meta_fields (as in LightRAG.__post_init__)
+    "chunks": {"full_doc_id", "content", "file_path"},
+    "entities": {"entity_name", "source_id", "content", "file_path"},
+    "relationships": {"src_id", "tgt_id", "source_id", "content", "file_path"},
+}
+
+async def fake_embed(texts):
+    rng = np.random.default_rng(abs(hash(texts[0])) % (2**32))
+    return rng.standard_normal((len(texts), DIM)).astype(np.float32)
+
+def open_storages(backend: str, workdir: Path):
+    kv_cls, vdb_cls = BACKENDS[backend]
+    cfg = {"working_dir": str(workdir), "embedding_batch_num": 256,
+           "vector_db_storage_cls_kwargs": {"cosine_better_than_threshold": 0.0}}
+    emb = EmbeddingFunc(embedding_dim=DIM, max_token_size=8192, func=fake_embed)
+    kvs = {ns: kv_cls(namespace=ns, workspace="", global_config=cfg, embedding_func=emb) for ns in KV_NAMESPACES}
+    vdbs = {ns: vdb_cls(namespace=ns, workspace="", global_config=cfg, embedding_func=emb, meta_fields=mf)
+            for ns, mf in VDB_NAMESPACES.items()}
+    return kvs, vdbs
+
+async def build(backend: str, n_chunks: int, n_entities: int):
+    workdir = BENCH_DIR / backend
+    shutil.rmtree(workdir, ignore_errors=True)
+    initialize_share_data()
+    kvs, vdbs = open_storages(backend, workdir)
+    for s in [*kvs.values(), *vdbs.values()]:
+        await s.initialize()
+    rnd = random.Random(7)
+    filler = lambda n: " ".join(rnd.choice(["vitamin", "panel", "blood", "test", "marker", "level", "iron"])
+                                for _ in range(n))
+    t0 = time.perf_counter()
+    for i in range(0, n_chunks, 1000):
+        ids = range(i, min(i + 1000, n_chunks))
+        chunks = {f"chunk-{j}": {"content": filler(180), "full_doc_id": f"doc-{j}", "file_path": "bench",
+                                 "tokens": 180, "chunk_order_index": 0} for j in ids}
+        await kvs["full_docs"].upsert({f"doc-{j}": {"content": chunks[f'chunk-{j}']["content"]} for j in ids})
+        await kvs["text_chunks"].upsert(chunks)
+        await kvs["llm_response_cache"].upsert({f"cache-{j}": {"return": filler(120), "cache_type": "extract"}
+                                                for j in ids})
+        await vdbs["chunks"].upsert(chunks)
+    for i in range(0, n_entities, 1000):
+        ids = range(i, min(i + 1000, n_entities))
+        await vdbs["entities"].upsert({f"ent-{j}": {"entity_name": f"E{j}", "content": filler(40),
+                                                    "source_id": f"chunk-{j % max(n_chunks, 1)}", "file_path": "bench"}
+                                       for j in ids})
+        await vdbs["relationships"].upsert({f"rel-{j}": {"src_id": f"E{j}", "tgt_id": f"E{(j + 1) % n_entities}",
+                                                         "content": filler(30), "source_id": "bench", "file_path": "bench"}
+                                            for j in ids})
+    for s in [*kvs.values(), *vdbs.values()]:
+        await s.index_done_callback()
+        await s.finalize()
+    size = sum(p.stat().st_size for p in workdir.iterdir())
+    print(f"[build] {backend}: {n_chunks} chunks, {n_entities} entities in {time.perf_counter() - t0:.1f}s "
+          f"| {size / 1e6:.1f} MB on disk")
+
+def peak_rss_mb() -> float:
+    # VmHWM starts over at exec; ru_maxrss would carry over the parent's peak from `build`
+    try:
+        with open("/proc/self/status") as f:
+            return next(int(l.split()[1]) for l in f if l.startswith("VmHWM:")) / 1024
+    except (OSError, StopIteration):
+        pass
+    if resource is not None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    import psutil
+    mem = psutil.Process().memory_info()              # Windows: peak working set
+    return getattr(mem, "peak_wset", mem.rss) / 2**20
+
+async def probe(backend: str, n_queries: int):
+    """Runs in its own process; prints one JSON line."""
+    rss0 = peak_rss_mb()
+    initialize_share_data()
+    t0 = time.perf_counter()
+    kvs, vdbs = open_storages(backend, BENCH_DIR / backend)
+    for s in [*kvs.values(), *vdbs.values()]:
+        await s.initialize()
+    t_init = time.perf_counter() - t0
+
+    rng = np.random.default_rng(1)
+    lat = []
+    for q in range(n_queries):
+        t = time.perf_counter()
+        qv = rng.standard_normal(DIM).astype(np.float32)
+        hits = await vdbs["chunks"].query("", top_k=20, query_embedding=qv)
+        await kvs["text_chunks"].get_by_ids([h["id"] for h in hits])
+        await vdbs["entities"].query("", top_k=40, query_embedding=qv)
+        lat.append(time.perf_counter() - t)
+    rss = peak_rss_mb()
+    print(json.dumps({"backend": backend, "init_s": t_init, "first_query_s": lat[0],
+                      "median_query_s": float(np.median(lat)), "startup_s": t_init + lat[0],
+                      "rss_mb": rss - rss0, "peak_rss_mb": rss}))
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark LightRAG JSON vs disk-backed KV/vector storages")
+    ap.add_argument("--chunks", type=int, default=20000)
+    ap.add_argument("--entities", type=int, default=40000)
+    ap.add_argument("--queries", type=int, default=20)
+    ap.add_argument("--skip-build", action="store_true", help="reuse the workdirs from a previous run")
+    ap.add_argument("--probe", choices=list(BACKENDS), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.probe:
+        asyncio.run(probe(args.probe, args.queries))
+        return
+    if not args.skip_build:
+        for b in BACKENDS:
+            asyncio.run(build(b, args.chunks, args.entities))
+
+    results = []
+    for b in BACKENDS:
+        out = subprocess.run([sys.executable, __file__, "--probe", b, "--queries", str(args.queries)],
+                             capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+    print(f"{'backend':8} {'init s':>8} {'1st query s':>12} {'median q ms':>12} {'startup s':>10} {'+RSS MB':>9}")
+    for r in results:
+        print(f"{r['backend']:8} {r['init_s']:8.2f} {r['first_query_s']:12.3f} {1000 * r['median_query_s']:12.1f} "
+              f"{r['startup_s']:10.2f} {r['rss_mb']:9.0f}")
+
+if __name__ == "__main__":
+    main()
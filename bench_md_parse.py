@@ -0,0 +1,151 @@
+# bench_md_parse.py
+# Timing of FAQ + section extraction: the previous per-script parsing (each script re-matching
+# every line and scanning the header list for each section's end) vs md_parse.py, sequential
+# and with the process pool, on a synthetic corpus. FAQ output is checked to be identical;
+# sections are counted only, since they are now leaf chunks rather than nested spans.
+# The pool is timed at any --pages (MD_POOL_MIN_PAGES is lowered for the run), which is how
+# that threshold was picked: compare the x1 and xN rows at your corpus size.
+#
+# Usage: python bench_md_parse.py [--pages 4000] [--headers 300] [--workers N]
+
+import os, re, time, random, argparse
+
+import md_parse
+import extract_qa, augment_sections_from_md
+
+WORDS = ("vitamin panel blood test marker level iron zinc gut food sensitivity profile sample "
+         "result report kit collection fasting antibody").split()
+
+def synth_page(rnd: random.Random, n_headers: int) -> str:
+    out = ["# " + " ".join(rnd.choices(WORDS, k=4)).title()]
+    words = lambda k: " ".join(rnd.choices(WORDS, k=k))
+    for h in range(n_headers):
+        if h == n_headers // 2:
+            out.append(f"## FAQs for {words(3).title()}")
+            for _ in range(rnd.randint(10, 40)):
+                out.append(f"### {rnd.choice(['What', 'How', 'Why', 'When'])} is the {words(4)}?")
+                out += [words(rnd.randint(8, 40)) for _ in range(rnd.randint(1, 3))]
+                if rnd.random() < 0.1:
+                    out.append("[View all FAQs](https://example.com/faqs)")
+            continue
+        out.append("#" * rnd.randint(2, 6) + " " + words(rnd.randint(1, 6)).title())
+        out += [words(rnd.randint(5, 30)) for _ in range(rnd.randint(0, 4))]
+        out.append("")
+    return "\n".join(out)
+
+# ------------------ Previous implementation (reference) ------------------
+def old_norm(s: str) -> str:
+    return re.sub(r"\s+", " ", (s or "")).strip()
+
+def old_find_headers(lines):
+    headers = []
+    for i, ln in enumerate(lines):
+        m = md_parse.HDR_RE.match(ln.strip())
+        if m:
+            headers.append((i, len(m.group(1)), old_norm(m.group(2))))
+    return headers
+
+def old_faq_sections(lines):
+    headers = old_find_headers(lines)
+    for h_idx, (i, lvl, title) in enumerate(headers):
+        if lvl <= 3 and extract_qa.FAQ_TITLE_RE.search(title):
+            end = len(lines)
+            for j in range(h_idx + 1, len(headers)):
+                if headers[j][1] <= lvl:
+                    end = headers[j][0]
+                    break
+            yield i, end, title
+
+def old_qas_from_block(block_lines):
+    items, i = [], 0
+    HDR_RE, IGNORE = md_parse.HDR_RE, extract_qa.IGNORE_LINE_RE
+    while i < len(block_lines):
+        ln = block_lines[i].rstrip()
+        if not ln.strip() or IGNORE.match(ln):
+            i += 1
+            continue
+        m = HDR_RE.match(ln.strip())
+        if m:
+            lvl, title = len(m.group(1)), old_norm(m.group(2))
+            if lvl >= 3 and 5 <= len(title) <= 200 and (title.endswith("?") or extract_qa.QUESTION_RE.search(title)):
+                q, ans = title, []
+                i += 1
+                while i < len(block_lines):
+                    ln2 = block_lines[i].rstrip()
+                    if not ln2.strip():
+                        ans.append(""); i += 1; continue
+                    m2 = HDR_RE.match(ln2.strip())
+                    if m2 and len(m2.group(1)) >= 3:
+                        break
+                    if IGNORE.match(ln2):
+                        i += 1; continue
+                    ans.append(ln2); i += 1
+                a = old_norm("\n".join(ans))
+                if len(a) >= 20:
+                    items.append((q, a))
+                continue
+        i += 1
+    return items
+
+def old_sections(md):
+    lines = md.splitlines()
+    headers = old_find_headers(lines)
+    items = []
+    for idx, (i, lvl, title) in enumerate(headers):
+        if lvl > 4 or len(title) < 3: continue
+        end = len(lines)
+        for j in range(idx + 1, len(headers)):
+            if headers[j][1] <= lvl:
+                end = headers[j][0]; break
+        body = old_norm("\n".join(lines[i+1:end]))
+        if len(body) >= 60 and len(title) <= 180:
+            items.append({"kind": "section", "question": title, "answer": body})
+    return items
+
+def run_old(pages):
+    qas, secs = [], []
+    for uid, url, text in pages:                      # extract_qa.py pass
+        lines = text.splitlines()
+        qas.append([(q, a, t) for s, e, t in old_faq_sections(lines) for q, a in old_qas_from_block(lines[s:e])])
+    for uid, url, text in pages:                      # augment_sections_from_md.py pass
+        secs.append(old_sections(text))
+    return qas, secs
+
+def run_new(pages, workers):
+    qas = [found for _, _, found in md_parse.map_pages(extract_qa.page_qas, pages, workers)]
+    secs = [items for _, _, items, _ in md_parse.map_pages(augment_sections_from_md.page_sections, pages, workers)]
+    return qas, secs
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark markdown FAQ/section extraction")
+    ap.add_argument("--pages", type=int, default=4000)
+    ap.add_argument("--headers", type=int, default=300, help="headers per page")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = ap.parse_args()
+    md_parse.POOL_MIN_PAGES = 2 * md_parse.CHUNK_PAGES    # time the pool itself, whatever the corpus size
+
+    rnd = random.Random(3)
+    t = time.perf_counter()
+    pages = [(f"p{i:06d}", f"https://example.com/tests/p{i}", synth_page(rnd, args.headers))
+             for i in range(args.pages)]
+    mb = sum(len(p[2]) for p in pages) / 1e6
+    print(f"[corpus] {args.pages} pages x {args.headers} headers, {mb:.1f} M chars "
+          f"(generated in {time.perf_counter() - t:.1f}s)")
+
+    runs = [("previous", lambda: run_old(pages)),
+            ("md_parse x1", lambda: run_new(pages, 1))]
+    if args.workers > 1:
+        runs.append((f"md_parse x{args.workers}", lambda: run_new(pages, args.workers)))
+    baseline = ref = None
+    for name, fn in runs:
+        t = time.perf_counter()
+        out = fn()
+        dt = time.perf_counter() - t
+        baseline = baseline or dt
+        ref = ref or out
+        same = "identical QAs" if out[0] == ref[0] else "DIFFERENT QAs"
+        print(f"[{name:14}] {dt:7.2f}s  {args.pages / dt:8.0f} pages/s  {baseline / dt:5.1f}x  "
+              f"({sum(map(len, out[0]))} QAs, {sum(map(len, out[1]))} sections, {same})")
+
+if __name__ == "__main__":
+    main()
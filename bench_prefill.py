@@ -0,0 +1,117 @@
+# bench_prefill.py
+# Prefill time and model reloads for the answer prompts, old layout vs the cache-friendly one.
+# Needs Ollama with OLLAMA_GEN_MODEL; contexts come from the KB (page_router.scoped_search over
+# each question's own page), so Neo4j / LightRAG are not involved.
+# - FAQ questions are asked in bursts of --per-page about the same page, like a user following up
+# - each burst opens with a short call standing in for LightRAG's keyword extraction (the first
+#   question goes to global search; follow-ups are routed to the page), which shares the model:
+#   "before" sends it with num_ctx 32768 (lightrag_client's old setting) and the answer with
+#   4096, the question ahead of a context in BM25 order and no keep_alive; "after" uses
+#   app.page_context / app.build_messages and ollama_opts for both calls
+# - per answer, Ollama reports prompt_eval_count (tokens actually prefilled: the cached prefix is
+#   skipped), prompt_eval_duration and load_duration; a load over --reload-ms counts as a reload
+# - --idle S sleeps between bursts, to see keep_alive matter (Ollama unloads after 5 min by default)
+#
+# Usage: python bench_prefill.py [--pages 8] [--per-page 3] [--only before|after]
+
+import time, random, asyncio, argparse
+from collections import defaultdict
+
+import httpx
+import numpy as np
+
+import app
+from kb_store import iter_kb, chunk_block
+from lightrag_client import MAX_CONTEXT_CHARS
+from ollama_opts import ollama_options, keep_alive
+
+OLD_NUM_CTX, OLD_LIGHTRAG_NUM_CTX = 4096, 32768
+
+def old_context(hits) -> str:
+    """Routed context before app.page_context: blocks in BM25 order."""
+    return "\n\n".join(chunk_block(h) for h in hits)[:MAX_CONTEXT_CHARS]
+
+def old_messages(query: str, ctx_text: str, sources_block: str):
+    """The /ask prompt before the prefix-cache layout: question first."""
+    return [
+        {"role": "system", "content": app.SYSTEM_PROMPT},
+        {"role": "user", "content":
+         f"Question:\n{query}\n\nContext:\n{ctx_text}\n\nSources:\n{sources_block}\n\nAnswer:"},
+    ]
+
+def layouts(num_predict: int):
+    """name -> (context builder, messages builder, answer request extras, keyword-call request extras)."""
+    return {
+        "before": (old_context, old_messages,
+                   {"options": {"temperature": 0.2, "num_ctx": OLD_NUM_CTX, "num_predict": num_predict}},
+                   {"options": {"num_ctx": OLD_LIGHTRAG_NUM_CTX}}),
+        "after": (app.page_context, app.build_messages,
+                  {"options": ollama_options(temperature=0.2, num_predict=num_predict), "keep_alive": keep_alive()},
+                  {"options": ollama_options(), "keep_alive": keep_alive()}),
+    }
+
+def sample_bursts(pages: int, per_page: int):
+    by_url = defaultdict(list)
+    for r in iter_kb("qa"):
+        by_url[r["url"]].append(r)
+    urls = [u for u, rows in by_url.items() if len(rows) >= per_page]
+    rng = random.Random(7)
+    return [(u, rng.sample(by_url[u], per_page)) for u in rng.sample(urls, min(pages, len(urls)))]
+
+def prompt_for(context, build, row, top_k: int):
+    hits = app.router.scoped_search(row["question"], [row["url"]], top_k) or [row]
+    urls = list(dict.fromkeys(h["url"] for h in hits))
+    return build(row["question"], context(hits), "\n".join(f"[{i+1}] {u}" for i, u in enumerate(urls)))
+
+async def chat(client: httpx.AsyncClient, messages, extra) -> dict:
+    r = await client.post(f"{app.OLLAMA_HOST}/api/chat",
+                          json={"model": app.OLLAMA_GEN_MODEL, "messages": messages, "stream": False, **extra})
+    r.raise_for_status()
+    return r.json()
+
+async def run(name: str, bursts, args):
+    context, build, answer_extra, keyword_extra = layouts(args.num_predict)[name]
+    tokens, prefill_ms, reloads, n = [], [], 0, 0
+    t0 = time.perf_counter()
+    async with httpx.AsyncClient(timeout=300.0) as client:
+        for i, (_, rows) in enumerate(bursts):
+            if i and args.idle:
+                await asyncio.sleep(args.idle)
+            for j, row in enumerate(rows):
+                calls = []
+                if j == 0:
+                    calls.append(await chat(client, [{"role": "user", "content":
+                                                      f"List the keywords of this question as JSON: {row['question']}"}],
+                                            {**keyword_extra, "options": {**keyword_extra["options"], "num_predict": 32}}))
+                out = await chat(client, prompt_for(context, build, row, args.top_k), answer_extra)
+                for d in calls + [out]:
+                    reloads += d.get("load_duration", 0) / 1e6 > args.reload_ms
+                tokens.append(out.get("prompt_eval_count", 0))
+                prefill_ms.append(out.get("prompt_eval_duration", 0) / 1e6)
+                n += 1
+    wall = time.perf_counter() - t0
+    tokens, prefill_ms = np.array(tokens), np.array(prefill_ms)
+    print(f"{name:7} {n:5} {tokens.mean():10.0f} {np.percentile(prefill_ms, 50):9.0f} {prefill_ms.mean():9.0f} "
+          f"{reloads:8} {wall:8.1f}")
+
+async def main():
+    ap = argparse.ArgumentParser(description="Prefill time / model reloads: old prompt layout vs prefix-cache layout")
+    ap.add_argument("--pages", type=int, default=8)
+    ap.add_argument("--per-page", type=int, default=3, help="questions asked back to back about one page")
+    ap.add_argument("--top-k", type=int, default=6)
+    ap.add_argument("--num-predict", type=int, default=64, help="answer length cap (keeps the run short)")
+    ap.add_argument("--reload-ms", type=float, default=500.0)
+    ap.add_argument("--idle", type=float, default=0.0, help="seconds between bursts")
+    ap.add_argument("--only", choices=["before", "after"])
+    args = ap.parse_args()
+
+    if app.router is None:
+        raise SystemExit("No KB store. Run Phase 2 finalization first.")
+    bursts = sample_bursts(args.pages, args.per_page)
+    print(f"[bench] {len(bursts)} pages x {args.per_page} questions, model {app.OLLAMA_GEN_MODEL}")
+    print(f"{'layout':7} {'asks':>5} {'prefill tok':>10} {'p50 ms':>9} {'mean ms':>9} {'reloads':>8} {'wall s':>8}")
+    for name in [args.only] if args.only else ["before", "after"]:
+        await run(name, bursts, args)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+# bench_retrieval.py
+# Retrieval latency of LightRAG's mix mode vs the single-query Neo4j hybrid (neo4j_retrieval.py),
+# on FAQ questions sampled from the KB. Needs Ollama (embeddings; LightRAG's keyword extraction)
+# and Neo4j populated by embed_and_load.py / ingest_lightrag.py.
+# - one warm-up query per retriever, then the same questions through each, --concurrency at a time
+# - reports p50 / p95 / mean latency, throughput, and how often the question's own page is
+#   among the returned sources
+#
+# Usage: python bench_retrieval.py [--queries 50] [--top-k 6] [--concurrency 1]
+
+import time, random, asyncio, argparse
+
+import numpy as np
+
+import lightrag_client, neo4j_retrieval
+from kb_store import iter_kb
+
+async def lightrag_retrieve(q: str, top_k: int):
+    _, urls = await lightrag_client.retrieve_context_with_sources(q, top_k=top_k)
+    return urls
+
+async def neo4j_retrieve(q: str, top_k: int):
+    _, urls, _ = await neo4j_retrieval.retrieve_context_with_sources(q, top_k=top_k)
+    return urls
+
+RETRIEVERS = {"lightrag": lightrag_retrieve, "neo4j": neo4j_retrieve}
+
+async def run(name: str, sample, top_k: int, concurrency: int):
+    fn = RETRIEVERS[name]
+    await fn(sample[0]["question"], top_k)                 # warm-up: storages, pools, models loaded
+    sem = asyncio.Semaphore(concurrency)
+    lat, hits = [], 0
+
+    async def one(row):
+        nonlocal hits
+        async with sem:
+            t = time.perf_counter()
+            urls = await fn(row["question"], top_k)
+            lat.append(time.perf_counter() - t)
+            hits += row["url"] in urls
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(r) for r in sample))
+    wall = time.perf_counter() - t0
+    ms = 1000 * np.array(lat)
+    print(f"{name:9} {np.percentile(ms, 50):9.0f} {np.percentile(ms, 95):9.0f} {ms.mean():9.0f} "
+          f"{len(sample) / wall:8.2f} {100 * hits / len(sample):9.0f}%")
+
+async def main():
+    ap = argparse.ArgumentParser(description="Compare LightRAG mix vs Neo4j hybrid retrieval latency")
+    ap.add_argument("--queries", type=int, default=50)
+    ap.add_argument("--top-k", type=int, default=6)
+    ap.add_argument("--concurrency", type=int, default=1)
+    ap.add_argument("--only", choices=list(RETRIEVERS), help="run a single retriever")
+    args = ap.parse_args()
+
+    rows = list(iter_kb("qa"))
+    if not rows:
+        raise SystemExit("No QA rows in the KB. Run Phase 2 finalization first.")
+    sample = random.Random(5).sample(rows, min(args.queries, len(rows)))
+    print(f"[bench] {len(sample)} FAQ questions, top_k={args.top_k}, concurrency={args.concurrency}")
+    print(f"{'retriever':9} {'p50 ms':>9} {'p95 ms':>9} {'mean ms':>9} {'q/s':>8} {'own page':>10}")
+    try:
+        for name in [args.only] if args.only else RETRIEVERS:
+            await run(name, sample, args.top_k, args.concurrency)
+    finally:
+        await neo4j_retrieval.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,17 +1,31 @@
 # build_kg.py
 # Phase 3b: Build a Knowledge Graph from kb.jsonl using a local Ollama model (or OpenRouter).
-# - Batches multiple chunks per LLM call
-# - Caches results per chunk
-# - Writes Entities/Relations/MENTIONS into Neo4j
-# - Prints clear progress (processed / total, upserted rows)
-
-import os, json, pathlib, re, time, hashlib, random
+# - Packs chunks into LLM calls by estimated token budget (prompt + MAX_TRIPLES output reserve)
+# - Requests schema-constrained JSON and validates every item against the same schema
+# - Splits and retries bundles whose JSON comes back incomplete or invalid
+# - Keeps several bundles in flight (asyncio worker pool, shared rate limiter)
+# - Caches results per chunk in one SQLite file keyed by (text hash, model, prompt hash, MAX_TRIPLES)
+#   once the chunk's rows are in Neo4j, so a failed write is redone on the next run
+# - Writes Entities/Relations/MENTIONS into Neo4j from a single batching writer task
+#   (pre-aggregated per batch, one UNWIND per kind in a managed transaction)
+# - Resolves alias entities onto canonical ones (entity_resolution.py, `resolve-entities`), in the
+#   alias table applied to every write and in the Entity nodes already in Neo4j
+# - `export-csv` emits neo4j-admin import CSVs from the cache for offline full rebuilds
+# - Prints clear progress (processed / total, bundles/s, ETA, upserted rows)
+
+import os, json, pathlib, re, time, hashlib, random, asyncio, argparse, sqlite3, csv
 from typing import Dict, List, Any
 
 import httpx
 from dotenv import load_dotenv
+from jsonschema import Draft202012Validator
 from neo4j import GraphDatabase
 
+from entity_resolution import collect_entities, resolve, apply_aliases
+from kb_store import iter_kb
+from ollama_opts import OLLAMA_NUM_CTX, ollama_options, keep_alive   # shared with the API / LightRAG
+from rate_limit import TokenBucket
+
 # ------------------ Config ------------------
 load_dotenv()
 
@@ -21,13 +35,13 @@ KG_BACKEND      = os.getenv("KG_BACKEND", "ollama").lower()
 # Ollama
 OLLAMA_HOST     = os.getenv("OLLAMA_HOST", "http://localhost:11434")
 OLLAMA_KG_MODEL = os.getenv("OLLAMA_KG_MODEL", "qwen2.5:7b-instruct-q4_K_M")
-OLLAMA_NUM_CTX  = int(os.getenv("OLLAMA_NUM_CTX", "4096"))
 
 # OpenRouter (only if you switch KG_BACKEND=openrouter)
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 OPENROUTER_MODEL   = os.getenv("OPENROUTER_MODEL", "deepseek/deepseek-chat-v3.1:free")
 OPENROUTER_URL     = "https://openrouter.ai/api/v1/chat/completions"
-RATE_LIMIT_S       = float(os.getenv("KG_RATE_LIMIT_S", "3.5"))
+RATE_LIMIT_S       = float(os.getenv("KG_RATE_LIMIT_S", "3.5"))   # seconds per call (token-bucket refill)
+RATE_BURST         = int(os.getenv("KG_RATE_BURST", "1"))          # calls allowed back-to-back
 MAX_WAIT_429       = float(os.getenv("KG_MAX_WAIT_ON_429", "90"))
 
 # Neo4j
@@ -42,9 +56,15 @@ BATCH_UPSERT   = int(os.getenv("KG_BATCH_UPSERT", "50"))
 MAX_TRIPLES    = int(os.getenv("KG_MAX_TRIPLES", "8"))
 DRY_LIMIT      = os.getenv("KG_DRY_LIMIT")                # e.g. "120"
 PROCESS_KIND   = os.getenv("KG_PROCESS_KIND", "qa")       # "qa" or "all"
-BUNDLE_SIZE    = int(os.getenv("KG_BUNDLE_SIZE", "6"))    # items per LLM call
+KG_STATS_PATH  = pathlib.Path(os.getenv("KG_STATS_PATH", "kg_model_stats.json"))  # per-model parse stats
+BUNDLE_SIZE    = int(os.getenv("KG_BUNDLE_SIZE", "6"))    # max items per LLM call
+CONTEXT_TOKENS = int(os.getenv("KG_CONTEXT_TOKENS", str(OLLAMA_NUM_CTX)))  # model context window
+CHARS_PER_TOKEN   = float(os.getenv("KG_CHARS_PER_TOKEN", "3.5"))  # rough estimate, errs long
+TOKENS_PER_TRIPLE = int(os.getenv("KG_TOKENS_PER_TRIPLE", "45"))   # triple + its entities as JSON
+CONCURRENCY    = int(os.getenv("KG_CONCURRENCY", "2"))    # bundles in flight (match OLLAMA_NUM_PARALLEL)
 
-CACHE_DIR = pathlib.Path("kg_cache"); CACHE_DIR.mkdir(exist_ok=True)
+CACHE_DB  = pathlib.Path(os.getenv("KG_CACHE_DB", "kg_cache.sqlite"))
+LEGACY_CACHE_DIR = pathlib.Path("kg_cache")                 # old one-JSON-per-chunk layout
 
 PROMPT_SYS = (
     "You are an information extraction assistant for clinical laboratory test pages. "
@@ -55,7 +75,7 @@ PROMPT_SYS = (
 PROMPT_USER_TEMPLATE_MULTI = """For EACH item below, extract entities and subject–predicate–object triples.
 
 Rules:
-- Return ONLY valid JSON: a list of objects, one per input, each with keys:
+- Return ONLY valid JSON: an object {{"items": [...]}} with one object per input, each with keys:
   "id", "entities", "triples".
 - "entities": list of objects {{"name": str, "type": str, "aliases": [str]?}}
   Suggested types: Test, Analyte, Biomarker, Condition, Symptom, SampleType, Method,
@@ -70,6 +90,53 @@ Input items (array; each has 'id' and 'text'):
 {payload_json}
 """
 
+# JSON schema sent to the model (Ollama `format`, OpenRouter `response_format`) and
+# used to validate what comes back. Top level is an object because OpenAI-style
+# strict schemas do not accept a bare array.
+ITEM_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "id": {"type": "string"},
+        "entities": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "type": {"type": "string"},
+                    "aliases": {"type": "array", "items": {"type": "string"}},
+                },
+                "required": ["name", "type", "aliases"],
+                "additionalProperties": False,
+            },
+        },
+        "triples": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "subj": {"type": "string"},
+                    "predicate": {"type": "string"},
+                    "obj": {"type": "string"},
+                },
+                "required": ["subj", "predicate", "obj"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["id", "entities", "triples"],
+    "additionalProperties": False,
+}
+EXTRACTION_SCHEMA = {
+    "type": "object",
+    "properties": {"items": {"type": "array", "items": ITEM_SCHEMA}},
+    "required": ["items"],
+    "additionalProperties": False,
+}
+ENVELOPE_VALIDATOR = Draft202012Validator(
+    {**EXTRACTION_SCHEMA, "properties": {"items": {"type": "array"}}})
+ITEM_VALIDATOR = Draft202012Validator(ITEM_SCHEMA)
+
 # ------------------ Helpers ------------------
 def require_env():
     if not KB_PATH.exists():
@@ -84,17 +151,18 @@ def canonical_name(name: str) -> str:
     s = re.sub(r"\s+", " ", s).strip()
     return s
 
-def load_kb() -> List[Dict[str, Any]]:
+def load_kb(all_items: bool = False) -> List[Dict[str, Any]]:
+    """kb.jsonl rows with `_text`; filtered by KG_PROCESS_KIND / KG_DRY_LIMIT unless all_items."""
     items = []
-    with KB_PATH.open("r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line: continue
-            d = json.loads(line)
-            if not all(k in d for k in ("id","question","answer","url","kind")):
-                continue
-            d["_text"] = d["question"].strip() + "\n\n" + d["answer"].strip()
-            items.append(d)
+    # only QA rows are read (kind index) when that is all that will be processed
+    kind = "qa" if not all_items and PROCESS_KIND.lower() == "qa" else None
+    for d in iter_kb(kind):
+        if not all(k in d for k in ("id","question","answer","url","kind")):
+            continue
+        d["_text"] = d["question"].strip() + "\n\n" + d["answer"].strip()
+        items.append(d)
+    if all_items:
+        return items
     # Prefer QA first (high-signal), or only QA if requested
     if PROCESS_KIND.lower() == "qa":
         items = [x for x in items if x.get("kind") == "qa"]
@@ -104,17 +172,170 @@ def load_kb() -> List[Dict[str, Any]]:
         items = items[:int(DRY_LIMIT)]
     return items
 
-def cache_path_for_id(chunk_id: str) -> pathlib.Path:
-    return CACHE_DIR / f"{chunk_id}.json"
+def est_tokens(text: str) -> int:
+    return int(len(text) / CHARS_PER_TOKEN) + 1
 
-def have_cache(chunk_id: str) -> bool:
-    return cache_path_for_id(chunk_id).exists()
+def item_payload(it: Dict[str, Any]) -> Dict[str, str]:
+    return {"id": it["id"], "text": it["_text"]}
 
-def write_cache(chunk_id: str, data: Dict[str, Any]) -> None:
-    cache_path_for_id(chunk_id).write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+def completion_reserve(n_items: int) -> int:
+    # per item: {"id", "entities": [...], "triples": [...]} with up to MAX_TRIPLES triples
+    return n_items * (30 + MAX_TRIPLES * TOKENS_PER_TRIPLE)
 
-def read_cache(chunk_id: str) -> Dict[str, Any]:
-    return json.loads(cache_path_for_id(chunk_id).read_text(encoding="utf-8"))
+PROMPT_OVERHEAD = est_tokens(PROMPT_SYS + PROMPT_USER_TEMPLATE_MULTI) + 32  # chat template framing
+
+def pack_bundles(items: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """
+    Greedy, order-preserving packing: add items while prompt + completion reserve
+    fits CONTEXT_TOKENS (and at most BUNDLE_SIZE items). Oversized items go alone.
+    """
+    bundles, cur, cur_tokens = [], [], PROMPT_OVERHEAD
+    for it in items:
+        t = est_tokens(json.dumps(item_payload(it), ensure_ascii=False))
+        fits = cur_tokens + t + completion_reserve(len(cur) + 1) <= CONTEXT_TOKENS
+        if cur and (not fits or len(cur) >= BUNDLE_SIZE):
+            bundles.append(cur)
+            cur, cur_tokens = [], PROMPT_OVERHEAD
+        cur.append(it)
+        cur_tokens += t
+    if cur:
+        bundles.append(cur)
+    oversized = sum(1 for b in bundles if len(b) == 1 and
+                    PROMPT_OVERHEAD + est_tokens(json.dumps(item_payload(b[0]), ensure_ascii=False))
+                    + completion_reserve(1) > CONTEXT_TOKENS)
+    if oversized:
+        print(f"[warn] {oversized} item(s) exceed the {CONTEXT_TOKENS}-token window on their own")
+    return bundles
+
+def sha1(s: str) -> str:
+    return hashlib.sha1(s.encode("utf-8")).hexdigest()
+
+def current_model() -> str:
+    return f"ollama:{OLLAMA_KG_MODEL}" if KG_BACKEND == "ollama" else f"openrouter:{OPENROUTER_MODEL}"
+
+# Anything that changes what the model is asked for invalidates cached extractions.
+PROMPT_HASH = sha1(PROMPT_SYS + PROMPT_USER_TEMPLATE_MULTI + json.dumps(EXTRACTION_SCHEMA, sort_keys=True))
+
+def cache_key(it: Dict[str, Any]):
+    return (sha1(it["_text"]), current_model(), PROMPT_HASH, MAX_TRIPLES)
+
+class ExtractionCache:
+    """
+    Normalized extractions in a single SQLite file. Keyed by content and by the
+    extraction config, so edited text or a new model/prompt misses the cache.
+    """
+    def __init__(self, path: pathlib.Path = CACHE_DB):
+        self.path = path
+        self.conn = sqlite3.connect(str(path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS extractions (
+            text_hash   TEXT NOT NULL,
+            model       TEXT NOT NULL,
+            prompt_hash TEXT NOT NULL,
+            max_triples INTEGER NOT NULL,
+            chunk_id    TEXT,
+            data        TEXT NOT NULL,
+            created_at  REAL NOT NULL,
+            PRIMARY KEY (text_hash, model, prompt_hash, max_triples)
+        ) WITHOUT ROWID
+        """)
+        self.conn.commit()
+
+    def get_many(self, keys) -> Dict[tuple, Dict[str, Any]]:
+        """Bulk lookup: one query per config, text hashes in chunks of 500."""
+        out: Dict[tuple, Dict[str, Any]] = {}
+        by_cfg: Dict[tuple, List[str]] = {}
+        for k in keys:
+            by_cfg.setdefault(k[1:], []).append(k[0])
+        for cfg, hashes in by_cfg.items():
+            for i in range(0, len(hashes), 500):
+                part = hashes[i:i+500]
+                q = ("SELECT text_hash, data FROM extractions WHERE model=? AND prompt_hash=? "
+                     f"AND max_triples=? AND text_hash IN ({','.join('?' * len(part))})")
+                for th, data in self.conn.execute(q, (*cfg, *part)):
+                    out[(th, *cfg)] = json.loads(data)
+        return out
+
+    def put_many(self, rows) -> None:
+        """rows = [(key, chunk_id, data), ...] written in one transaction."""
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO extractions VALUES (?,?,?,?,?,?,?)",
+                [(*k, cid, json.dumps(d, ensure_ascii=False), now) for k, cid, d in rows])
+
+    def all_for(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """[{chunk_id, entities, triples}] for every item cached under the current config."""
+        cached = self.get_many([cache_key(it) for it in items])
+        return [{"chunk_id": it["id"], **cached[cache_key(it)]} for it in items if cache_key(it) in cached]
+
+    def load_aliases(self) -> Dict[str, str]:
+        self.conn.execute("CREATE TABLE IF NOT EXISTS entity_aliases (canon TEXT PRIMARY KEY, canonical TEXT NOT NULL)")
+        return dict(self.conn.execute("SELECT canon, canonical FROM entity_aliases"))
+
+    def save_aliases(self, mapping: Dict[str, str]) -> Dict[str, str]:
+        """
+        Merge new {canon: canonical} decisions into the table; earlier ones for entities not in
+        this run stay. Chains (a -> b, b -> c) are collapsed so every alias names a current head.
+        Returns the whole table.
+        """
+        table = {**self.load_aliases(), **mapping}
+
+        def head(c: str) -> str:
+            seen = {c}
+            while c in table and table[c] not in seen:
+                c = table[c]
+                seen.add(c)
+            return c
+
+        resolved = {c: head(c) for c in table}
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO entity_aliases VALUES (?,?) ON CONFLICT(canon) DO UPDATE SET canonical = excluded.canonical",
+                [(c, h) for c, h in resolved.items() if c != h])
+            self.conn.executemany("DELETE FROM entity_aliases WHERE canon = ?",
+                                  [(c,) for c, h in resolved.items() if c == h])
+        return {c: h for c, h in resolved.items() if c != h}
+
+    def count(self) -> int:
+        return self.conn.execute("SELECT count(*) FROM extractions").fetchone()[0]
+
+    def migrate_legacy(self, items: List[Dict[str, Any]], legacy_dir: pathlib.Path = LEGACY_CACHE_DIR) -> int:
+        """
+        Import kg_cache/<chunk_id>.json files for chunks still in kb.jsonl. Old files carry
+        no model/prompt info, so they are adopted under the current config.
+        """
+        rows = []
+        for it in items:
+            p = legacy_dir / f"{it['id']}.json"
+            if p.exists():
+                rows.append((cache_key(it), it["id"], json.loads(p.read_text(encoding="utf-8"))))
+        self.put_many(rows)
+        return len(rows)
+
+    def compact(self, items: List[Dict[str, Any]], current_config_only: bool = False) -> int:
+        """
+        Drop entries whose text is not among `items` (and optionally other configs), then VACUUM.
+        Pass every kb row (load_kb(all_items=True)): anything left out loses its extraction.
+        """
+        with self.conn:
+            self.conn.execute("CREATE TEMP TABLE live (text_hash TEXT PRIMARY KEY)")
+            self.conn.executemany("INSERT OR IGNORE INTO live VALUES (?)", [(sha1(it["_text"]),) for it in items])
+            cur = self.conn.execute("DELETE FROM extractions WHERE text_hash NOT IN (SELECT text_hash FROM live)")
+            removed = cur.rowcount
+            if current_config_only:
+                cur = self.conn.execute(
+                    "DELETE FROM extractions WHERE NOT (model=? AND prompt_hash=? AND max_triples=?)",
+                    (current_model(), PROMPT_HASH, MAX_TRIPLES))
+                removed += cur.rowcount
+            self.conn.execute("DROP TABLE live")
+        self.conn.execute("VACUUM")
+        return removed
+
+    def close(self):
+        self.conn.close()
 
 def normalize_extraction(ex: Dict[str, Any]) -> Dict[str, Any]:
     ents = []
@@ -144,29 +365,64 @@ def normalize_extraction(ex: Dict[str, Any]) -> Dict[str, Any]:
         })
     return {"entities": ents, "triples": triples}
 
-def parse_json_forgiving(text: str):
-    # Try direct JSON; then fenced; then first [] block
+def parse_extraction(text: str):
+    """
+    Strict parse of a schema-constrained response. Raises ValueError when the
+    output is not JSON or not an {"items": [...]} envelope (the call failed);
+    otherwise returns (valid_items, n_invalid) with each item checked against ITEM_SCHEMA.
+    """
     try:
-        return json.loads(text)
-    except Exception:
-        pass
-    # strip code fences
-    m = re.search(r"```(?:json)?\s*(\[.*?\])\s*```", text, flags=re.S|re.I)
-    if m:
-        try:
-            return json.loads(m.group(1))
-        except Exception:
-            pass
-    # first bracketed JSON array
-    m = re.search(r"\[.*\]", text, flags=re.S)
-    if m:
-        return json.loads(m.group(0))
-    return []
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"invalid JSON: {e.msg} at char {e.pos}")
+    err = next(ENVELOPE_VALIDATOR.iter_errors(data), None)
+    if err is not None:
+        raise ValueError(f"schema: {err.message}")
+    valid = [it for it in data["items"] if ITEM_VALIDATOR.is_valid(it)]
+    return valid, len(data["items"]) - len(valid)
+
+class ModelStats:
+    """Per-model call/parse counters, merged into KG_STATS_PATH so runs can be compared."""
+    FIELDS = ("calls", "failed_calls", "items_ok", "items_invalid", "seconds")
+
+    def __init__(self):
+        self.by_model: Dict[str, Dict[str, float]] = {}
+
+    def add(self, model: str, **counts):
+        m = self.by_model.setdefault(model, dict.fromkeys(self.FIELDS, 0))
+        for k, v in counts.items():
+            m[k] += v
+
+    @staticmethod
+    def summary(m: Dict[str, float]) -> str:
+        fail = m["failed_calls"] / m["calls"] if m["calls"] else 0.0
+        ips = m["items_ok"] / m["seconds"] if m["seconds"] else 0.0
+        return (f"calls={m['calls']} | parse failures={fail:.1%}"
+                f" | invalid items={m['items_invalid']} | {ips:.2f} valid items per LLM-second")
+
+    def save(self):
+        saved = json.loads(KG_STATS_PATH.read_text(encoding="utf-8")) if KG_STATS_PATH.exists() else {}
+        for model, m in self.by_model.items():
+            tot = saved.setdefault(model, dict.fromkeys(self.FIELDS, 0))
+            for k in self.FIELDS:
+                tot[k] = tot.get(k, 0) + m[k]
+            print(f"[model] {model}: this run {self.summary(m)}")
+            print(f"[model] {model}: all runs {self.summary(tot)}")
+        KG_STATS_PATH.write_text(json.dumps(saved, indent=2), encoding="utf-8")
+
+MODEL_STATS = ModelStats()
+
+def make_limiter() -> TokenBucket:
+    # Local Ollama is bounded by CONCURRENCY alone; OpenRouter keeps the old ≥3.5 s spacing.
+    if KG_BACKEND == "ollama":
+        return TokenBucket(0)
+    return TokenBucket(1.0 / max(RATE_LIMIT_S, 3.5), RATE_BURST)
 
 # ------------------ LLM calls ------------------
-def ollama_call_multi(items: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+async def ollama_call_multi(client: httpx.AsyncClient, limiter: TokenBucket,
+                            items: List[Dict[str, str]]) -> str:
     """
-    Local LLM via Ollama /api/chat. items = [{id, text}, ...]
+    Local LLM via Ollama /api/chat. items = [{id, text}, ...]; returns the raw JSON text.
     """
     url = f"{OLLAMA_HOST}/api/chat"
     user_prompt = PROMPT_USER_TEMPLATE_MULTI.format(
@@ -180,15 +436,17 @@ def ollama_call_multi(items: List[Dict[str, str]]) -> List[Dict[str, Any]]:
             {"role": "user", "content": user_prompt},
         ],
         "stream": False,
-        "options": {"num_ctx": OLLAMA_NUM_CTX}
+        "format": EXTRACTION_SCHEMA,
+        "options": ollama_options(num_predict=completion_reserve(len(items))),
+        "keep_alive": keep_alive(),
     }
-    with httpx.Client(timeout=240.0) as client:
-        r = client.post(url, json=payload)
-        r.raise_for_status()
-        content = r.json().get("message", {}).get("content", "")
-        return parse_json_forgiving(content)
+    await limiter.acquire()
+    r = await client.post(url, json=payload, timeout=240.0)
+    r.raise_for_status()
+    return r.json().get("message", {}).get("content", "")
 
-def openrouter_call_multi(items: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+async def openrouter_call_multi(client: httpx.AsyncClient, limiter: TokenBucket,
+                                items: List[Dict[str, str]]) -> str:
     headers = {
         "Authorization": f"Bearer {OPENROUTER_API_KEY}",
         "Content-Type": "application/json",
@@ -202,7 +460,11 @@ def openrouter_call_multi(items: List[Dict[str, str]]) -> List[Dict[str, Any]]:
     body = {
         "model": OPENROUTER_MODEL,
         "temperature": 0.1,
-        "max_tokens": 1400,
+        "max_tokens": completion_reserve(len(items)),
+        "response_format": {
+            "type": "json_schema",
+            "json_schema": {"name": "kg_extraction", "strict": True, "schema": EXTRACTION_SCHEMA},
+        },
         "messages": [
             {"role": "system", "content": PROMPT_SYS},
             {"role": "user", "content": prompt_user},
@@ -210,52 +472,61 @@ def openrouter_call_multi(items: List[Dict[str, str]]) -> List[Dict[str, Any]]:
     }
 
     backoff = 2.0
-    with httpx.Client(timeout=120.0) as client:
-        while True:
-            r = client.post(OPENROUTER_URL, headers=headers, json=body)
-            if r.status_code == 200:
-                content = r.json()["choices"][0]["message"]["content"]
-                data = parse_json_forgiving(content)
-                time.sleep(max(RATE_LIMIT_S, 3.5))
-                return data
-
-            if r.status_code == 429:
-                retry_after = r.headers.get("Retry-After")
-                reset_ms = r.headers.get("X-RateLimit-Reset")
-                wait = None
-                if reset_ms:
-                    try:
-                        wait = max(0.0, (int(reset_ms) / 1000.0) - time.time())
-                    except Exception:
-                        wait = None
-                if wait is None and retry_after:
-                    try:
-                        wait = float(retry_after)
-                    except Exception:
-                        wait = None
-                if wait is None:
-                    wait = backoff + random.uniform(0,0.5)
-                    backoff = min(backoff * 2, 60.0)
-                if wait > float(os.getenv("KG_MAX_WAIT_ON_429", "90")):
-                    raise RuntimeError(f"429 rate-limited; suggested wait {wait:.1f}s exceeds limit.")
-                print(f"[429] rate-limited; sleeping {wait:.1f}s…")
-                time.sleep(wait)
-                continue
-
-            if r.status_code in (502,503,504,408):
-                print(f"[{r.status_code}] transient; retrying in {backoff:.1f}s…")
-                time.sleep(backoff + random.uniform(0,0.5))
+    while True:
+        await limiter.acquire()
+        r = await client.post(OPENROUTER_URL, headers=headers, json=body, timeout=120.0)
+        if r.status_code == 200:
+            return r.json()["choices"][0]["message"]["content"]
+
+        if r.status_code == 429:
+            retry_after = r.headers.get("Retry-After")
+            reset_ms = r.headers.get("X-RateLimit-Reset")
+            wait = None
+            if reset_ms:
+                try:
+                    wait = max(0.0, (int(reset_ms) / 1000.0) - time.time())
+                except Exception:
+                    wait = None
+            if wait is None and retry_after:
+                try:
+                    wait = float(retry_after)
+                except Exception:
+                    wait = None
+            if wait is None:
+                wait = backoff + random.uniform(0,0.5)
                 backoff = min(backoff * 2, 60.0)
-                continue
+            if wait > MAX_WAIT_429:
+                raise RuntimeError(f"429 rate-limited; suggested wait {wait:.1f}s exceeds limit.")
+            print(f"[429] rate-limited; sleeping {wait:.1f}s…")
+            await asyncio.sleep(wait)
+            continue
+
+        if r.status_code in (502,503,504,408):
+            print(f"[{r.status_code}] transient; retrying in {backoff:.1f}s…")
+            await asyncio.sleep(backoff + random.uniform(0,0.5))
+            backoff = min(backoff * 2, 60.0)
+            continue
 
-            try:
-                print("[openrouter error]", r.status_code, r.text[:400])
-            except Exception:
-                pass
-            r.raise_for_status()
+        try:
+            print("[openrouter error]", r.status_code, r.text[:400])
+        except Exception:
+            pass
+        r.raise_for_status()
 
-def extract_multi(items: List[Dict[str, str]]) -> List[Dict[str, Any]]:
-    return ollama_call_multi(items) if KG_BACKEND == "ollama" else openrouter_call_multi(items)
+async def extract_multi(client: httpx.AsyncClient, limiter: TokenBucket,
+                        items: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+    call, model = ((ollama_call_multi, OLLAMA_KG_MODEL) if KG_BACKEND == "ollama"
+                   else (openrouter_call_multi, OPENROUTER_MODEL))
+    t = time.perf_counter()
+    content = await call(client, limiter, items)
+    try:
+        valid, n_invalid = parse_extraction(content)
+    except ValueError:
+        MODEL_STATS.add(model, calls=1, failed_calls=1, seconds=time.perf_counter() - t)
+        raise
+    MODEL_STATS.add(model, calls=1, items_ok=len(valid), items_invalid=n_invalid,
+                    seconds=time.perf_counter() - t)
+    return valid
 
 # ------------------ Neo4j ------------------
 def ensure_kg_indexes(driver):
@@ -267,104 +538,444 @@ def ensure_kg_indexes(driver):
         """)
         s.run("CREATE INDEX idx_entity_types IF NOT EXISTS FOR (e:Entity) ON (e.types)")
 
-def upsert_kg(driver, rows: List[Dict[str, Any]]):
-    cypher = """
-    UNWIND $rows AS row
-    // Upsert entities
-    UNWIND row.entities AS e
-    MERGE (ent:Entity {canon: e.canon})
-      ON CREATE SET ent.name = e.name, ent.types = e.types, ent.aliases = e.aliases
-      ON MATCH  SET ent.name = coalesce(ent.name, e.name)
-    WITH row
-    MATCH (c:Chunk {id: row.chunk_id})
-    WITH row, c
-    // Mentions
-    UNWIND row.entities AS e2
-    MATCH (ent2:Entity {canon: e2.canon})
-    MERGE (c)-[:MENTIONS]->(ent2)
-    WITH row
-    // Relations with provenance
-    UNWIND row.triples AS t
-    MATCH (s:Entity {canon: t.subj_canon})
-    MATCH (o:Entity {canon: t.obj_canon})
-    MERGE (s)-[r:REL {predicate: t.predicate}]->(o)
-    SET r.support_count = coalesce(r.support_count, 0) + 1,
-        r.source_chunks = CASE
-          WHEN r.source_chunks IS NULL THEN [row.chunk_id]
-          WHEN NOT row.chunk_id IN r.source_chunks THEN r.source_chunks + row.chunk_id
-          ELSE r.source_chunks
-        END
+def aggregate_rows(rows: List[Dict[str, Any]]):
     """
+    Collapse a batch of {chunk_id, entities, triples} rows into one list per kind:
+    entities (types/aliases unioned), (chunk, entity) mentions, and relations with
+    the set of chunks that assert them. Repeated rows collapse, so replays are idempotent.
+    """
+    ents: Dict[str, Dict[str, Any]] = {}
+    mentions = set()
+    rels: Dict[tuple, set] = {}
+    for row in rows:
+        cid = row["chunk_id"]
+        for e in row["entities"]:
+            cur = ents.setdefault(e["canon"], {"canon": e["canon"], "name": e["name"], "types": [], "aliases": []})
+            cur["types"] += [t for t in e["types"] if t not in cur["types"]]
+            cur["aliases"] += [a for a in e["aliases"] if a not in cur["aliases"]]
+            mentions.add((cid, e["canon"]))
+        for t in row["triples"]:
+            if t["subj_canon"] and t["obj_canon"]:
+                rels.setdefault((t["subj_canon"], t["predicate"], t["obj_canon"]), set()).add(cid)
+    return (list(ents.values()),
+            [{"chunk_id": c, "canon": e} for c, e in sorted(mentions)],
+            [{"subj": s_, "predicate": p_, "obj": o_, "chunks": sorted(cids)}
+             for (s_, p_, o_), cids in rels.items()])
+
+CYPHER_ENTITIES = """
+UNWIND $ents AS e
+MERGE (ent:Entity {canon: e.canon})
+  ON CREATE SET ent.name = e.name, ent.types = e.types, ent.aliases = e.aliases
+  ON MATCH  SET ent.name    = coalesce(ent.name, e.name),
+                ent.types   = coalesce(ent.types, []) + [x IN e.types WHERE NOT x IN coalesce(ent.types, [])],
+                ent.aliases = coalesce(ent.aliases, []) + [x IN e.aliases WHERE NOT x IN coalesce(ent.aliases, [])]
+"""
+
+CYPHER_MENTIONS = """
+UNWIND $mentions AS m
+MATCH (c:Chunk {id: m.chunk_id})
+MATCH (ent:Entity {canon: m.canon})
+MERGE (c)-[:MENTIONS]->(ent)
+"""
+
+# Provenance is a Chunk-[:ASSERTS {predicate, obj}]->subject relationship per supporting
+# chunk; support_count is recomputed from those, so replaying a chunk never double-counts.
+CYPHER_RELATIONS = """
+UNWIND $rels AS r
+MATCH (s:Entity {canon: r.subj})
+MATCH (o:Entity {canon: r.obj})
+MERGE (s)-[rel:REL {predicate: r.predicate}]->(o)
+WITH s, rel, r
+CALL {
+  WITH s, r
+  UNWIND r.chunks AS cid
+  MATCH (c:Chunk {id: cid})
+  MERGE (c)-[:ASSERTS {predicate: r.predicate, obj: r.obj}]->(s)
+}
+SET rel.support_count = size([(c:Chunk)-[a:ASSERTS]->(s)
+                              WHERE a.predicate = r.predicate AND a.obj = r.obj | c])
+"""
+
+def upsert_kg(driver, rows: List[Dict[str, Any]]):
+    ents, mentions, rels = aggregate_rows(rows)
+
+    def work(tx):
+        tx.run(CYPHER_ENTITIES, ents=ents).consume()
+        tx.run(CYPHER_MENTIONS, mentions=mentions).consume()
+        tx.run(CYPHER_RELATIONS, rels=rels).consume()
+
     with driver.session() as sess:
-        sess.run(cypher, rows=rows)
+        sess.execute_write(work)
+
+def export_import_csv(items: List[Dict[str, Any]], cache: ExtractionCache, out_dir: pathlib.Path):
+    """
+    Offline full rebuild: write neo4j-admin import CSVs (pages, chunks, entities and all
+    relationships) from kb.jsonl + cached extractions. Embeddings are added afterwards by
+    embed_and_load.py, which MERGEs onto the same Chunk ids.
+    """
+    from embed_and_load import slug_from_url
+
+    aliases = cache.load_aliases()
+    rows = [{"chunk_id": r["chunk_id"], **apply_aliases(r, aliases)} for r in cache.all_for(items)]
+    ents, mentions, rels = aggregate_rows(rows)
+    canons = {e["canon"] for e in ents}
+    rels = [r for r in rels if r["subj"] in canons and r["obj"] in canons]
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    def write(name: str, header: List[str], data):
+        with (out_dir / name).open("w", encoding="utf-8", newline="") as f:
+            w = csv.writer(f)
+            w.writerow(header)
+            w.writerows(data)
+
+    arr = lambda xs: ";".join(x.replace(";", ",") for x in xs)
+    page_urls = lambda it: it.get("urls") or [it["url"]]     # deduplicated chunks carry every page they were on
+    urls = sorted({u for it in items for u in page_urls(it)})
+    write("pages.csv", ["url:ID(Page)", "slug", ":LABEL"], ((u, slug_from_url(u), "Page") for u in urls))
+    write("chunks.csv", ["id:ID(Chunk)", "kind", "question", "answer", "url", "urls:string[]", "section",
+                         "source_format", ":LABEL"],
+          ((it["id"], it["kind"], it["question"], it["answer"], it["url"], arr(page_urls(it)),
+            it.get("section") or "", it.get("source_format") or "", "Chunk") for it in items))
+    write("entities.csv", ["canon:ID(Entity)", "name", "types:string[]", "aliases:string[]", ":LABEL"],
+          ((e["canon"], e["name"], arr(e["types"]), arr(e["aliases"]), "Entity") for e in ents))
+    write("from_page.csv", [":START_ID(Chunk)", ":END_ID(Page)", ":TYPE"],
+          ((it["id"], u, "FROM_PAGE") for it in items for u in page_urls(it)))
+    write("mentions.csv", [":START_ID(Chunk)", ":END_ID(Entity)", ":TYPE"],
+          ((m["chunk_id"], m["canon"], "MENTIONS") for m in mentions))
+    write("rels.csv", [":START_ID(Entity)", ":END_ID(Entity)", ":TYPE", "predicate", "support_count:int"],
+          ((r["subj"], r["obj"], "REL", r["predicate"], len(r["chunks"])) for r in rels))
+    write("asserts.csv", [":START_ID(Chunk)", ":END_ID(Entity)", ":TYPE", "predicate", "obj"],
+          ((cid, r["subj"], "ASSERTS", r["predicate"], r["obj"]) for r in rels for cid in r["chunks"]))
+
+    print(f"[export] {len(rows)} cached chunks -> {len(ents)} entities, {len(mentions)} mentions, {len(rels)} relations")
+    print(f"[export] wrote CSVs to {out_dir.resolve()}; with the database stopped run:")
+    print("  neo4j-admin database import full neo4j --overwrite-destination --skip-duplicate-nodes=true"
+          f" --nodes={out_dir}/pages.csv --nodes={out_dir}/chunks.csv --nodes={out_dir}/entities.csv"
+          f" --relationships={out_dir}/from_page.csv --relationships={out_dir}/mentions.csv"
+          f" --relationships={out_dir}/rels.csv --relationships={out_dir}/asserts.csv")
+    print("  then re-run embed_and_load.py and build_kg.py once to recreate indexes/constraints and embeddings.")
+
+# Folds one alias Entity into its head: MENTIONS, ASSERTS and REL edges move over (self-loops
+# dropped), names / types are unioned, support_count is recomputed from ASSERTS, the alias goes.
+CYPHER_MERGE_ALIASES = """
+UNWIND $pairs AS p
+MATCH (a:Entity {canon: p.alias})
+MERGE (h:Entity {canon: p.head})
+  ON CREATE SET h.name = a.name, h.types = [], h.aliases = []
+SET h.types   = coalesce(h.types, []) + [x IN coalesce(a.types, []) WHERE NOT x IN coalesce(h.types, [])],
+    h.aliases = coalesce(h.aliases, []) + [x IN coalesce(a.aliases, []) + a.name
+                                           WHERE x <> h.name AND NOT x IN coalesce(h.aliases, [])]
+WITH a, h
+CALL {
+  WITH a, h
+  MATCH (c:Chunk)-[m:MENTIONS]->(a)
+  MERGE (c)-[:MENTIONS]->(h)
+  DELETE m
+}
+CALL {
+  WITH a, h
+  MATCH (c:Chunk)-[x:ASSERTS]->(a)
+  MERGE (c)-[:ASSERTS {predicate: x.predicate, obj: x.obj}]->(h)
+  DELETE x
+}
+CALL {
+  WITH a, h
+  MATCH (c:Chunk)-[x:ASSERTS {obj: a.canon}]->(s)
+  MERGE (c)-[:ASSERTS {predicate: x.predicate, obj: h.canon}]->(s)
+  DELETE x
+}
+CALL {
+  WITH h
+  MATCH (:Chunk)-[x:ASSERTS {obj: h.canon}]->(h)
+  DELETE x
+}
+CALL {
+  WITH a, h
+  MATCH (a)-[r:REL]->(o) WHERE o <> h
+  MERGE (h)-[:REL {predicate: r.predicate}]->(o)
+  DELETE r
+}
+CALL {
+  WITH a, h
+  MATCH (s)-[r:REL]->(a) WHERE s <> h
+  MERGE (s)-[:REL {predicate: r.predicate}]->(h)
+  DELETE r
+}
+DETACH DELETE a
+WITH DISTINCT h
+CALL {
+  WITH h
+  MATCH (h)-[rel:REL]-()
+  WITH rel, startNode(rel) AS s, endNode(rel) AS o
+  SET rel.support_count = size([(c:Chunk)-[x:ASSERTS]->(s)
+                                WHERE x.predicate = rel.predicate AND x.obj = o.canon | c])
+}
+RETURN count(h) AS heads
+"""
+
+def merge_aliases_in_graph(driver, aliases: Dict[str, str], batch: int = 500) -> int:
+    """Apply the alias table to Entity nodes already in Neo4j; returns how many alias nodes existed."""
+    pairs = [{"alias": a, "head": h} for a, h in aliases.items()]
+    present = 0
+    with driver.session() as s:
+        for i in range(0, len(pairs), batch):
+            part = pairs[i:i + batch]
+            present += s.run("UNWIND $pairs AS p MATCH (a:Entity {canon: p.alias}) RETURN count(a) AS n",
+                             pairs=part).single()["n"]
+            s.execute_write(lambda tx: tx.run(CYPHER_MERGE_ALIASES, pairs=part).consume())
+    return present
+
+def resolve_entities(items: List[Dict[str, Any]], cache: ExtractionCache, driver):
+    """
+    Cluster aliases across all cached extractions, merge them into the alias table, report
+    the shrink, and fold alias Entity nodes already written to Neo4j into their heads.
+    """
+    rows = cache.all_for(items)
+    known = cache.load_aliases()
+    t0 = time.perf_counter()
+    mapping = resolve(collect_entities(rows), known, canonical_name)
+    table = cache.save_aliases(mapping)
+    ents0, _, rels0 = aggregate_rows(rows)
+    ents1, _, rels1 = aggregate_rows([{"chunk_id": r["chunk_id"], **apply_aliases(r, table)} for r in rows])
+    print(f"[resolve] {time.perf_counter() - t0:.1f}s | cached extractions: Entity nodes {len(ents0)} -> {len(ents1)}"
+          f" | REL edges {len(rels0)} -> {len(rels1)} | alias table: {len(table)} rows in {CACHE_DB}")
+    t0 = time.perf_counter()
+    merged = merge_aliases_in_graph(driver, table)
+    print(f"[resolve] Neo4j: merged {merged} alias Entity nodes into their heads in {time.perf_counter() - t0:.1f}s")
+
+def refresh_query_indexes(driver):
+    """Rebuild what the API reads at startup: entity-linker names and the CSR KG snapshot."""
+    import entity_linker, kg_graph                    # entity_linker imports this module
+    linker = entity_linker.rebuild(driver)
+    print(f"[link] {linker.stats()} -> {entity_linker.ENTITIES_PATH}")
+    snap = kg_graph.KGSnapshot.from_neo4j(driver)
+    snap.save()
+    print(f"[kg] snapshot {snap.stats()} -> {kg_graph.SNAPSHOT_PATH} (POST /kg/refresh to reload a running API)")
 
 # ------------------ Main ------------------
+async def kg_writer(driver, queue: "asyncio.Queue", stats: Dict[str, int], cache: ExtractionCache):
+    """
+    Single consumer: batches rows from the workers into BATCH_UPSERT-sized Neo4j writes.
+    Each row carries its cache entry (`cache`), committed only once the row is in Neo4j, so a
+    failed write leaves those items uncached and the next run extracts and writes them again.
+    """
+    batch_rows: List[Dict[str, Any]] = []
+    while True:
+        row = await queue.get()
+        if row is not None:
+            batch_rows.append(row)
+        if batch_rows and (row is None or len(batch_rows) >= BATCH_UPSERT):
+            await asyncio.to_thread(upsert_kg, driver, batch_rows)
+            cache.put_many([r["cache"] for r in batch_rows])
+            stats["upserted"] += len(batch_rows)
+            print(f"[neo4j] upserted rows: {stats['upserted']}" + (" (final)" if row is None else ""))
+            batch_rows = []
+        if row is None:
+            return
+
+async def run(todo: List[Dict[str, Any]], total: int, already: int, driver,
+              cache: ExtractionCache, aliases: Dict[str, str]) -> Dict[str, int]:
+    bundles = pack_bundles(todo)
+    print(f"[bundles] {len(todo)} items -> {len(bundles)} bundles"
+          f" (ctx={CONTEXT_TOKENS} tokens, ≤{BUNDLE_SIZE} items each)")
+    pending: "asyncio.Queue" = asyncio.Queue()
+    for b in bundles:
+        pending.put_nowait(b)
+    rows: "asyncio.Queue" = asyncio.Queue()
+    stats = {"processed": already, "upserted": 0, "bundles": 0, "splits": 0, "failed": 0}
+    failed = asyncio.Event()
+    limiter = make_limiter()
+    t0 = time.perf_counter()
+
+    def accept(it: Dict[str, Any], r: Dict[str, Any]):
+        cid = it["id"]
+        norm = normalize_extraction(r)
+        entry = (cache_key(it), cid, norm)              # cache stays pre-resolution
+        norm = apply_aliases(norm, aliases)
+        stats["processed"] += 1
+        if norm["entities"] or norm["triples"]:
+            rows.put_nowait({"chunk_id": cid,
+                             "entities": norm["entities"],
+                             "triples":  norm["triples"],
+                             "cache":    entry})          # cached by kg_writer once upserted
+        else:
+            cache.put_many([entry])                     # nothing to write to Neo4j
+
+    def split(bundle: List[Dict[str, Any]], why: str):
+        if len(bundle) == 1:
+            return False
+        mid = len(bundle) // 2
+        pending.put_nowait(bundle[:mid])
+        pending.put_nowait(bundle[mid:])
+        stats["splits"] += 1
+        print(f"[split] {why}; retrying {len(bundle)} items as {mid}+{len(bundle) - mid}")
+        return True
+
+    async def handle(client: httpx.AsyncClient, bundle: List[Dict[str, Any]]):
+        payload = [item_payload(it) for it in bundle]
+        try:
+            results = await extract_multi(client, limiter, payload)  # [{id, entities, triples}, ...]
+        except (httpx.ConnectError, httpx.ConnectTimeout, RuntimeError) as e:
+            # backend unreachable / rate limit exhausted: splitting will not help
+            print(f"[warn] extraction failed for bundle starting {bundle[0]['id']}: {e!r}")
+            failed.set()
+            return
+        except httpx.HTTPStatusError as e:
+            code = e.response.status_code
+            if code == 429:                               # Ollama's queue is full: same bundle, later
+                print(f"[429] backend busy; re-queueing bundle starting {bundle[0]['id']}")
+                await asyncio.sleep(5)
+                pending.put_nowait(bundle)
+                return
+            # model not found, auth, server error: every bundle would fail the same way
+            print(f"[warn] HTTP {code} from the backend for bundle starting {bundle[0]['id']}: "
+                  f"{e.response.text[:200]}")
+            failed.set()
+            return
+        except (httpx.TimeoutException, httpx.TransportError) as e:
+            # read timeout / connection dropped mid-answer: a smaller bundle finishes sooner
+            if not split(bundle, f"{type(e).__name__}"):
+                stats["failed"] += 1
+                print(f"[warn] giving up on {bundle[0]['id']}: {e!r}")
+            return
+        except Exception as e:
+            if not split(bundle, f"invalid output ({e})"):
+                stats["failed"] += 1
+                print(f"[warn] giving up on {bundle[0]['id']}: {e}")
+            return
+
+        # map results by id; keep what came back, split and retry the rest
+        res_by_id = {r["id"]: r for r in results}
+        missing = [it for it in bundle if it["id"] not in res_by_id]
+        for it in bundle:
+            if it["id"] in res_by_id:
+                accept(it, res_by_id[it["id"]])
+        if len(bundle) == 1 and missing:
+            accept(missing[0], {"entities": [], "triples": []})   # retried alone, nothing extracted
+        elif len(missing) < len(bundle) and missing:
+            pending.put_nowait(missing)                           # partial answer: retry the remainder
+            print(f"[retry] {len(missing)}/{len(bundle)} items missing from output")
+        elif missing:
+            split(missing, "no items in output")
+
+        stats["bundles"] += 1
+        elapsed = time.perf_counter() - t0
+        rate = stats["bundles"] / elapsed if elapsed > 0 else 0.0
+        done_new = stats["processed"] - already
+        item_rate = done_new / elapsed if elapsed > 0 else 0.0
+        eta = (total - stats["processed"]) / item_rate if item_rate > 0 else float("inf")
+        pct = stats["processed"] / total * 100
+        print(f"[progress] processed {stats['processed']}/{total} ({pct:.1f}%)"
+              f" | {rate:.2f} bundles/s | ETA {eta/60:.1f} min | queued {rows.qsize()}")
+
+    async def worker(client: httpx.AsyncClient):
+        while True:
+            bundle = await pending.get()
+            try:
+                if not failed.is_set():
+                    await handle(client, bundle)
+            except Exception as e:
+                # keep the worker alive: pending.join() only returns once every bundle is done
+                stats["failed"] += len(bundle)
+                print(f"[warn] bundle starting {bundle[0]['id']} failed: {e!r}")
+            finally:
+                pending.task_done()
+
+    def writer_done(task: asyncio.Task):
+        # Neo4j write failed: stop extracting now instead of finding out at the end of the run
+        if not task.cancelled() and task.exception() is not None:
+            print(f"[error] Neo4j writer failed: {task.exception()!r}; stopping extraction")
+            failed.set()
+
+    writer = asyncio.create_task(kg_writer(driver, rows, stats, cache))
+    writer.add_done_callback(writer_done)
+    limits = httpx.Limits(max_connections=CONCURRENCY, max_keepalive_connections=CONCURRENCY)
+    async with httpx.AsyncClient(limits=limits) as client:
+        workers = [asyncio.create_task(worker(client)) for _ in range(max(1, CONCURRENCY))]
+        # split halves are re-queued, so wait on the queue, not the workers (or on the writer dying)
+        joined = asyncio.create_task(pending.join())
+        await asyncio.wait({joined, writer}, return_when=asyncio.FIRST_COMPLETED)
+        for t in [joined, *workers]:
+            t.cancel()
+        await asyncio.gather(joined, *workers, return_exceptions=True)
+    if not writer.done():
+        rows.put_nowait(None)
+    await writer                      # re-raises the writer's error; its rows were never cached
+    if stats["splits"] or stats["failed"]:
+        print(f"[bundles] splits={stats['splits']} | unrecoverable items={stats['failed']}")
+    MODEL_STATS.save()
+    return stats
+
 def main():
+    ap = argparse.ArgumentParser(description="Build the KG from kb.jsonl")
+    ap.add_argument("command", nargs="?", default="run",
+                    choices=["run", "migrate-cache", "compact-cache", "export-csv", "resolve-entities"])
+    ap.add_argument("--out", default="kg_import", help="export-csv: output directory")
+    ap.add_argument("--current-config-only", action="store_true",
+                    help="compact-cache: also drop entries from other models/prompts/MAX_TRIPLES")
+    args = ap.parse_args()
+
     require_env()
     items_all = load_kb()
     total = len(items_all)
+    cache = ExtractionCache()
+
+    # cache maintenance covers every kb row, not the KG_PROCESS_KIND / KG_DRY_LIMIT subset
+    if args.command == "migrate-cache":
+        n = cache.migrate_legacy(load_kb(all_items=True))
+        print(f"[cache] migrated {n} entries from {LEGACY_CACHE_DIR.resolve()} -> {CACHE_DB.resolve()}")
+        cache.close()
+        return
+    if args.command == "compact-cache":
+        before = cache.count()
+        removed = cache.compact(load_kb(all_items=True), current_config_only=args.current_config_only)
+        print(f"[cache] removed {removed}/{before} entries; {CACHE_DB.stat().st_size/1e6:.1f} MB after VACUUM")
+        cache.close()
+        return
+
+    if args.command == "resolve-entities":
+        driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+        try:
+            resolve_entities(load_kb(all_items=True), cache, driver)
+            refresh_query_indexes(driver)
+        finally:
+            driver.close()
+            cache.close()
+        return
+    if args.command == "export-csv":
+        export_import_csv(load_kb(all_items=True), cache, pathlib.Path(args.out))
+        cache.close()
+        return
+
     if total == 0:
         print("No items to process.")
         return
 
     print(f"[KG] backend={KG_BACKEND}"
           f" | model={(OLLAMA_KG_MODEL if KG_BACKEND=='ollama' else OPENROUTER_MODEL)}"
-          f" | total={total} | bundle={BUNDLE_SIZE} | triples≤{MAX_TRIPLES}")
+          f" | total={total} | bundle≤{BUNDLE_SIZE} | ctx={CONTEXT_TOKENS} | in-flight={CONCURRENCY} | triples≤{MAX_TRIPLES}")
 
     driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
     ensure_kg_indexes(driver)
 
-    # Skip items already cached
-    todo = [it for it in items_all if not have_cache(it["id"])]
+    # Skip items already cached for this text + model + prompt
+    cached = cache.get_many([cache_key(it) for it in items_all])
+    todo = [it for it in items_all if cache_key(it) not in cached]
     already = total - len(todo)
     if already:
         print(f"[cache] {already}/{total} items already cached; will process {len(todo)} new")
+    if not cached and LEGACY_CACHE_DIR.is_dir() and any(LEGACY_CACHE_DIR.glob("*.json")):
+        print(f"[cache] legacy {LEGACY_CACHE_DIR}/ found; run `python build_kg.py migrate-cache` to reuse it")
 
-    processed = already
-    upserted_rows_total = 0
-    batch_rows: List[Dict[str, Any]] = []
-
-    i = 0
-    while i < len(todo):
-        bundle = todo[i:i+BUNDLE_SIZE]
-        payload = [{"id": it["id"], "text": it["_text"]} for it in bundle]
-
-        try:
-            results = extract_multi(payload)  # [{id, entities, triples}, ...]
-        except Exception as e:
-            print(f"[warn] extraction failed for bundle starting {bundle[0]['id']}: {e}")
-            break
-
-        # map results by id
-        res_by_id = {r.get("id"): r for r in (results or []) if r and r.get("id")}
-        for it in bundle:
-            cid = it["id"]
-            r = res_by_id.get(cid, {"entities": [], "triples": []})
-            norm = normalize_extraction(r)
-            write_cache(cid, norm)
-            processed += 1
-            if norm["entities"] or norm["triples"]:
-                batch_rows.append({"chunk_id": cid,
-                                   "entities": norm["entities"],
-                                   "triples":  norm["triples"]})
-        pct = processed / total * 100
-        print(f"[progress] processed {processed}/{total} ({pct:.1f}%), queued {len(batch_rows)}")
-
-        if len(batch_rows) >= BATCH_UPSERT:
-            upsert_kg(driver, batch_rows)
-            upserted_rows_total += len(batch_rows)
-            print(f"[neo4j] upserted rows: {upserted_rows_total} (≤ processed {processed})")
-            batch_rows = []
-
-        i += BUNDLE_SIZE
-
-    if batch_rows:
-        upsert_kg(driver, batch_rows)
-        upserted_rows_total += len(batch_rows)
-        print(f"[neo4j] upserted rows: {upserted_rows_total} (final)")
+    aliases = cache.load_aliases()
+    if aliases:
+        print(f"[resolve] applying {len(aliases)} entity aliases")
+    stats = asyncio.run(run(todo, total, already, driver, cache, aliases))
+    refresh_query_indexes(driver)
 
     driver.close()
-    print(f"[done] Processed {processed}/{total}. Upserted rows: {upserted_rows_total}. Cache: {CACHE_DIR.resolve()}")
+    cache.close()
+    print(f"[done] Processed {stats['processed']}/{total}. Upserted rows: {stats['upserted']}. Cache: {CACHE_DB.resolve()}")
 
 if __name__ == "__main__":
     main()
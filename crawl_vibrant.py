@@ -6,13 +6,28 @@ Created on Wed Sep 17 17:45:46 2025
 """
 
 # crawl_vibrant.py
+# Breadth-first crawl of the /tests section with CRAWL_CONCURRENCY browser pages in flight.
+# Requests to each host go through a token bucket paced by robots.txt Crawl-delay
+# (or CRAWL_RATE when robots.txt sets none).
+# Incremental: data/crawl_state.json keeps ETag / Last-Modified / content hashes per URL.
+# Known pages get a cheap conditional GET first and are only re-rendered when it shows a
+# change; new pages (and CRAWL_FORCE=1) go straight to the render, whose response headers
+# supply the validators. data/changeset.json lists the added / modified / removed uids for
+# downstream stages.
+# Pages go to the compressed page store (page_store.py), not loose files.
 import asyncio
 import hashlib
+import json
+import os
 import pathlib
 import re
+import time
+from collections import deque
 from inspect import signature
 from urllib.parse import urlparse, urljoin, urldefrag
+from urllib.robotparser import RobotFileParser
 
+import httpx
 from bs4 import BeautifulSoup
 from crawl4ai import (
     AsyncWebCrawler,
@@ -21,12 +36,22 @@ from crawl4ai import (
     DefaultMarkdownGenerator,
 )
 
+from page_store import PageStore
+from rate_limit import TokenBucket
+
 # ---------- Paths ----------
 DATA_DIR = pathlib.Path("data")
-RAW_DIR = DATA_DIR / "raw_html"
-MD_DIR = DATA_DIR / "md"
-RAW_DIR.mkdir(parents=True, exist_ok=True)
-MD_DIR.mkdir(parents=True, exist_ok=True)
+DATA_DIR.mkdir(parents=True, exist_ok=True)
+STATE_PATH = DATA_DIR / "crawl_state.json"      # url -> validators, hashes, links of the last fetch
+CHANGESET_PATH = DATA_DIR / "changeset.json"
+
+# ---------- Crawl settings ----------
+CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", "4"))     # pages rendered at once
+CRAWL_RATE  = float(os.getenv("CRAWL_RATE", "2"))          # req/s per host if robots.txt has no Crawl-delay
+CRAWL_BURST = int(os.getenv("CRAWL_BURST", "2"))
+USER_AGENT  = os.getenv("CRAWL_USER_AGENT", "*")           # robots.txt group to obey
+FORCE_RENDER = os.getenv("CRAWL_FORCE", "0") == "1"     # re-render every page regardless of state
+PROGRESS_EVERY = 25
 
 # ---------- Helpers ----------
 def sha1(s: str) -> str:
@@ -86,6 +111,126 @@ def is_allowed(u: str, base_host: str) -> bool:
     except Exception:
         return False
 
+def result_links(res) -> set:
+    """hrefs from res.links (list, or crawl4ai's {"internal": [{"href": ...}], ...}) and <a> tags."""
+    links = set()
+    raw = res.links or []
+    if isinstance(raw, dict):
+        raw = [l for group in raw.values() for l in group]
+    for l in raw:
+        href = l.get("href") if isinstance(l, dict) else l
+        if href:
+            links.add(href)
+    if res.html:
+        soup = BeautifulSoup(res.html, "lxml")
+        for a in soup.find_all("a", href=True):
+            links.add(a["href"])
+    return links
+
+class HostPolicy:
+    """Per-host robots.txt rules and token bucket, fetched once per host on first use."""
+    def __init__(self, client: httpx.AsyncClient):
+        self.client = client
+        self.hosts = {}
+        self._lock = asyncio.Lock()
+
+    async def _load(self, origin: str):
+        # same outcomes as RobotFileParser.read(), without its blocking urlopen
+        rp = RobotFileParser()
+        rp.modified()
+        try:
+            r = await self.client.get(f"{origin}/robots.txt")
+            if r.status_code in (401, 403):
+                rp.disallow_all = True
+            elif 400 <= r.status_code < 500:
+                rp.allow_all = True
+            else:
+                rp.parse(r.text.splitlines())
+        except httpx.HTTPError as e:
+            print(f"[robots] {origin}: {e}; assuming allow-all")
+            rp.allow_all = True
+        delay = rp.crawl_delay(USER_AGENT)
+        rate = rp.request_rate(USER_AGENT)
+        if delay:
+            bucket = TokenBucket(1.0 / float(delay), 1)            # Crawl-delay means no bursts
+        elif rate:
+            bucket = TokenBucket(rate.requests / rate.seconds, 1)
+        else:
+            bucket = TokenBucket(CRAWL_RATE, CRAWL_BURST)
+        print(f"[robots] {origin}: crawl-delay={delay} -> {bucket.rate:.2f} req/s")
+        return rp, bucket
+
+    async def get(self, url: str):
+        p = urlparse(url)
+        origin = f"{p.scheme}://{p.netloc}"
+        async with self._lock:
+            if origin not in self.hosts:
+                self.hosts[origin] = await self._load(origin)
+        return self.hosts[origin]
+
+    async def can_fetch(self, url: str) -> bool:
+        rp, _ = await self.get(url)
+        return rp.can_fetch(USER_AGENT, url)
+
+    async def wait(self, url: str):
+        _, bucket = await self.get(url)
+        await bucket.acquire()
+
+# ---------- Change detection ----------
+def content_hash(text: str) -> str:
+    return hashlib.sha1((text or "").encode("utf-8")).hexdigest()
+
+def normalize_html(html: str) -> str:
+    """Visible text only: scripts, styles, comments, tags (nonces, build ids) and spacing don't count."""
+    html = re.sub(r"(?is)<(script|style|noscript|template)\b.*?</\1>", " ", html or "")
+    html = re.sub(r"(?s)<!--.*?-->", " ", html)
+    html = re.sub(r"(?s)<[^>]+>", " ", html)
+    return re.sub(r"\s+", " ", html).strip()
+
+def load_state() -> dict:
+    if STATE_PATH.exists():
+        return json.loads(STATE_PATH.read_text(encoding="utf-8"))
+    return {}
+
+def save_json(path: pathlib.Path, obj):
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(json.dumps(obj, ensure_ascii=False, indent=1), encoding="utf-8")
+    tmp.replace(path)
+
+async def conditional_check(client: httpx.AsyncClient, url: str, prev: dict | None):
+    """
+    Cheap plain-HTTP probe before a browser render.
+    Returns (verdict, validators): verdict is "gone" (404/410), "unchanged" (304, or the same
+    normalized body) or "changed"; validators = {etag, last_modified, raw_hash} to store.
+    """
+    headers = {}
+    if prev and prev.get("etag"):
+        headers["If-None-Match"] = prev["etag"]
+    if prev and prev.get("last_modified"):
+        headers["If-Modified-Since"] = prev["last_modified"]
+    r = await client.get(url, headers=headers)
+    if r.status_code in (404, 410):
+        return "gone", {}
+    if r.status_code == 304 and prev:
+        return "unchanged", {k: prev.get(k) for k in ("etag", "last_modified", "raw_hash")}
+    validators = {
+        "etag": r.headers.get("etag"),
+        "last_modified": r.headers.get("last-modified"),
+        "raw_hash": content_hash(normalize_html(r.text)) if r.status_code == 200 else None,
+    }
+    if prev and validators["raw_hash"] and validators["raw_hash"] == prev.get("raw_hash"):
+        return "unchanged", validators
+    return "changed", validators
+
+def render_validators(res) -> dict:
+    """
+    Validators from the browser render's own response, for pages rendered without a probe.
+    raw_hash stays None: the rendered DOM never matches a plain GET body, so the next probe
+    decides on ETag / Last-Modified, or re-renders once and stores the GET body's hash.
+    """
+    headers = {k.lower(): v for k, v in (getattr(res, "response_headers", None) or {}).items()}
+    return {"etag": headers.get("etag"), "last_modified": headers.get("last-modified"), "raw_hash": None}
+
 def make_run_cfg(**kwargs):
     """
     Build CrawlerRunConfig with only kwargs supported by your installed crawl4ai.
@@ -106,81 +251,171 @@ async def crawl_one(crawler: AsyncWebCrawler, url: str):
         remove_overlay_elements=True,
         screenshot=False,
         respect_robots_txt=True,
-        delay=1.0,
     )
     res = await crawler.arun(url=url, config=run_cfg)
     return res  # has .html, .markdown, .links
 
-async def crawl_site(seeds, max_pages=600, max_depth=3):
+def save_page(store: PageStore, url: str, uid: str, res) -> str:
+    """Store raw HTML + cleaned Markdown; returns the Markdown's content hash."""
+    md_text = soft_clean_md(res.markdown or "")
+    store.put(url, uid, res.html or "", md_text)
+    return content_hash(re.sub(r"\s+", " ", md_text).strip())
+
+async def crawl_site(seeds, max_pages=600, max_depth=3, concurrency=CONCURRENCY):
     if not seeds:
         raise SystemExit("Put Vibrant seed URLs into seeds.txt (one per line).")
 
     base_host = base_host_from_url(seeds[0])
     visited = set()
     enqueued = set()
-    queue = []
+    frontier = deque()          # FIFO of (url, depth): pages come out in breadth-first order
+    claimed = 0                 # pages taken off the frontier, counted against max_pages
 
     # prime the queue with canonicalized seeds
     for s in seeds:
         cu = canonicalize(s, base=s)
-        queue.append((cu, 0))
+        frontier.append((cu, 0))
         enqueued.add(cu)
 
     browser_cfg = BrowserConfig(headless=True)
     saved = []
+    store = PageStore()
+    state = load_state()
+    new_state = {}
+    errors = set()              # fetch failed: keep the previous state, never report as removed
+    changes = {"added": [], "modified": [], "removed": [], "unchanged": []}
+    in_flight = 0
+    wake = asyncio.Condition()  # signalled when links are enqueued or a page finishes
+    t0 = time.perf_counter()
 
-    async with AsyncWebCrawler(config=browser_cfg) as crawler:
-        print("[INIT].... → Crawl4AI ready")
-        while queue and len(visited) < max_pages:
-            url, depth = queue.pop(0)
-            if url in visited or depth > max_depth:
-                continue
-            if not is_allowed(url, base_host):
-                continue
+    def report(final=False):
+        dt = time.perf_counter() - t0
+        tag = "done" if final else "rate"
+        print(f"[{tag}] {len(visited)} pages in {dt:.1f}s ({len(visited) / dt if dt else 0:.2f} pages/s)"
+              f" | frontier {len(frontier)} | in flight {in_flight}")
 
+    async def next_url():
+        nonlocal claimed, in_flight
+        async with wake:
+            while True:
+                while frontier:
+                    url, depth = frontier.popleft()
+                    if url in visited or depth > max_depth or not is_allowed(url, base_host):
+                        continue
+                    if claimed >= max_pages:
+                        frontier.clear()
+                        break
+                    claimed += 1
+                    in_flight += 1
+                    return url, depth
+                if in_flight == 0:
+                    wake.notify_all()   # nothing queued and nothing that could add more
+                    return None
+                await wake.wait()
+
+    async def worker(crawler, policy):
+        nonlocal in_flight
+        while True:
+            item = await next_url()
+            if item is None:
+                return
+            url, depth = item
+            new_links = []
             try:
-                print(f"[crawl] depth={depth} {url}")
-                res = await crawl_one(crawler, url)
-                got = bool(res and (res.markdown or res.html))
-                num_links = len(res.links or []) if res else 0
-                print(f"  -> got: {got}  links(listed): {num_links}")
-
-                if not res:
-                    visited.add(url)
+                if not await policy.can_fetch(url):
+                    print(f"[robots] disallowed: {url}")
                     continue
-
                 uid = sha1(url)
-                # save HTML
-                (RAW_DIR / f"{uid}.html").write_text(res.html or "", encoding="utf-8")
-                # save cleaned Markdown
-                md_text = soft_clean_md(res.markdown or "")
-                (MD_DIR / f"{uid}.md").write_text(md_text, encoding="utf-8")
-                saved.append((uid, url))
-
-                # discover links from both res.links and HTML anchors
-                links = set(res.links or [])
-                if res.html:
-                    soup = BeautifulSoup(res.html, "lxml")
-                    for a in soup.find_all("a", href=True):
-                        links.add(a["href"])
-
-                for lnk in links:
-                    lnk = canonicalize(lnk, base=url)
-                    if is_allowed(lnk, base_host) and (lnk not in visited) and (lnk not in enqueued):
-                        queue.append((lnk, depth + 1))
-                        enqueued.add(lnk)
+                prev = state.get(url)
+                if FORCE_RENDER or not prev or not store.has(uid):
+                    verdict, validators = "changed", None    # rendered anyway: a probe would be a wasted request
+                else:
+                    await policy.wait(url)
+                    verdict, validators = await conditional_check(policy.client, url, prev)
+                if verdict == "gone":
+                    print(f"[gone] {url}")
+                    continue            # never lands in new_state -> reported as removed
+                if verdict == "unchanged" and store.has(uid):
+                    print(f"[same] depth={depth} {url}")
+                    new_state[url] = {**prev, **validators, "checked_at": time.time()}
+                    changes["unchanged"].append(uid)
+                    saved.append((uid, url))
+                    links = prev.get("links", [])
+                else:
+                    await policy.wait(url)
+                    print(f"[crawl] depth={depth} {url}")
+                    res = await crawl_one(crawler, url)
+                    # discover links from both res.links and HTML anchors
+                    links = sorted(result_links(res)) if res else []
+                    got = bool(res and (res.markdown or res.html))
+                    print(f"  -> got: {got}  links(listed): {len(links)}")
+                    if not res:
+                        errors.add(url)
+                        continue
+                    if validators is None:
+                        if getattr(res, "status_code", None) in (404, 410):
+                            print(f"[gone] {url}")
+                            continue    # never lands in new_state -> reported as removed
+                        validators = render_validators(res)
 
-                visited.add(url)
+                    md_hash = save_page(store, url, uid, res)
+                    saved.append((uid, url))
+                    kind = ("added" if not prev else
+                            "unchanged" if md_hash == prev.get("md_hash") else "modified")
+                    changes[kind].append(uid)
+                    now = time.time()
+                    new_state[url] = {"uid": uid, **validators, "md_hash": md_hash, "links": links,
+                                      "checked_at": now,
+                                      "changed_at": now if kind != "unchanged" else prev.get("changed_at", now)}
 
+                if depth < max_depth:
+                    for lnk in links:
+                        lnk = canonicalize(lnk, base=url)
+                        if is_allowed(lnk, base_host) and (lnk not in visited) and (lnk not in enqueued):
+                            new_links.append((lnk, depth + 1))
+                            enqueued.add(lnk)
             except Exception as e:
+                errors.add(url)
                 print(f"[warn] {url} -> {e}")
+            finally:
+                visited.add(url)
+                async with wake:
+                    in_flight -= 1
+                    frontier.extend(new_links)
+                    wake.notify_all()
+                if len(visited) % PROGRESS_EVERY == 0:
+                    report()
+
+    async with AsyncWebCrawler(config=browser_cfg) as crawler, \
+            httpx.AsyncClient(timeout=15.0, follow_redirects=True) as client:
+        print(f"[INIT].... → Crawl4AI ready ({concurrency} concurrent pages)")
+        policy = HostPolicy(client)
+        await asyncio.gather(*(worker(crawler, policy) for _ in range(concurrency)))
+    report(final=True)
+
+    # Known URLs not reached this run were removed - unless max_pages cut the crawl short.
+    removed = [u for u in state if u not in new_state and u not in errors and
+               (u in visited or claimed < max_pages)]
+    for u in removed:
+        store.remove(u)
+        changes["removed"].append(state[u].get("uid") or sha1(u))
+    # keep entries that failed or that a truncated crawl never reached; they are checked next time
+    for u, st in state.items():
+        if u not in new_state and u not in removed:
+            new_state[u] = st
+            saved.append((st.get("uid") or sha1(u), u))
+    save_json(STATE_PATH, new_state)
+    save_json(CHANGESET_PATH, {"crawled_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                               **{k: sorted(v) for k, v in changes.items() if k != "unchanged"},
+                               "unchanged": len(changes["unchanged"])})
+    print(f"[changes] added={len(changes['added'])} modified={len(changes['modified'])} "
+          f"removed={len(changes['removed'])} unchanged={len(changes['unchanged'])} -> {CHANGESET_PATH}")
 
-    # write URL map for citations
+    # url_map.tsv is now a derived copy of the store index, kept for citations / older tools
     URL_MAP = DATA_DIR / "url_map.tsv"
-    with URL_MAP.open("w", encoding="utf-8") as f:
-        for uid, u in saved:
-            f.write(f"{uid}\t{u}\n")
-    print(f"[done] Saved {len(saved)} pages")
+    store.export_url_map(URL_MAP)
+    store.close()
+    print(f"[done] {len(saved)} current pages in {store.root}")
     print(f"[done] Wrote URL map -> {URL_MAP.resolve()}")
 
 # ---------- Entrypoint ----------
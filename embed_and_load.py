@@ -13,6 +13,8 @@ from dotenv import load_dotenv
 from neo4j import GraphDatabase
 import httpx
 
+from kb_store import iter_kb
+
 # ---- config ----
 load_dotenv()
 NEO4J_URI = os.getenv("NEO4J_URI", "neo4j://localhost:7687")
@@ -86,9 +88,16 @@ def upsert_batch(driver, rows: List[Dict], embeddings: List[List[float]]):
             c.url      = row.url,
             c.section  = row.section,
             c.source_format = row.source_format,
+            c.urls     = row.urls,
             c.vec_dim  = $vec_dim,
             c.embedding = row.embedding
         MERGE (c)-[:FROM_PAGE]->(p)
+        WITH c, row
+        // near-duplicate rows collapsed by finalize_kb.py also belong to their other pages
+        UNWIND row.pages AS pg
+        MERGE (p2:Page {url: pg.url})
+          ON CREATE SET p2.slug = pg.slug
+        MERGE (c)-[:FROM_PAGE]->(p2)
         """, rows=payload, vec_dim=EMBED_DIM)
 
     # Package rows with embeddings for Cypher
@@ -100,6 +109,8 @@ def upsert_batch(driver, rows: List[Dict], embeddings: List[List[float]]):
             "question": r["question"],
             "answer": r["answer"],
             "url": r["url"],
+            "urls": r.get("urls") or [r["url"]],
+            "pages": [{"url": u, "slug": slug_from_url(u)} for u in r.get("urls") or [r["url"]]],
             "slug": r.get("slug"),
             "section": r.get("section"),
             "source_format": r.get("source_format"),
@@ -129,18 +140,14 @@ def main():
 
     # Load KB
     items = []
-    with KB_PATH.open("r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line: continue
-            d = json.loads(line)
-            # ensure required fields
-            if not all(k in d for k in ("id","question","answer","url","kind")):
-                continue
-            # final text to embed: question + answer (grounded & rich)
-            d["_embed_text"] = d["question"].strip() + "\n\n" + d["answer"].strip()
-            d["slug"] = slug_from_url(d["url"])
-            items.append(d)
+    for d in iter_kb():
+        # ensure required fields
+        if not all(k in d for k in ("id","question","answer","url","kind")):
+            continue
+        # final text to embed: question + answer (grounded & rich)
+        d["_embed_text"] = d["question"].strip() + "\n\n" + d["answer"].strip()
+        d["slug"] = slug_from_url(d["url"])
+        items.append(d)
 
     if not items:
         raise SystemExit("No items in kb.jsonl")
@@ -0,0 +1,150 @@
+# entity_linker.py
+# Query-side entity linking: which KG Entity nodes does a question mention?
+# - an Aho-Corasick automaton over every Entity.name, alias and canon, normalized with
+#   build_kg.canonical_name, finds all of them in one pass over the (normalized) question;
+#   no full-text Cypher or LLM keyword call per query
+# - matches must sit on word boundaries; overlapping ones resolve leftmost-longest, so
+#   "food sensitivity profile 2" wins over "food sensitivity"
+# - the surface forms are saved to KG_ENTITIES (JSON) by `build` (run at the end of
+#   build_kg.py) and the automaton is rebuilt from them when the API starts
+#
+# Usage: python entity_linker.py build | link "<question>"
+
+import os, sys, json, time, pathlib, argparse
+from collections import deque
+from typing import Dict, List, Tuple
+
+from dotenv import load_dotenv
+
+from build_kg import canonical_name
+
+load_dotenv()
+
+NEO4J_URI      = os.getenv("NEO4J_URI", "neo4j://localhost:7687")
+NEO4J_USER     = os.getenv("NEO4J_USER", "neo4j")
+NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "neo4j_password")
+
+ENTITIES_PATH = pathlib.Path(os.getenv("KG_ENTITIES", "kg_entities.json"))
+MIN_CHARS     = int(os.getenv("KG_LINK_MIN_CHARS", "3"))   # shorter surface forms are too ambiguous
+
+Q_ENTITIES = "MATCH (e:Entity) RETURN e.canon AS canon, e.name AS name, coalesce(e.aliases, []) AS aliases"
+
+class EntityLinker:
+    def __init__(self, surfaces: Dict[str, List[str]]):
+        """surfaces: entity canon -> names / aliases (raw; normalized here)."""
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[List[int]] = [[]]              # pattern ids ending at each state
+        self.patterns: List[Tuple[str, List[str]]] = []   # (normalized form, entity canons)
+        index: Dict[str, int] = {}
+        for canon, names in surfaces.items():
+            for s in {canonical_name(n) for n in [canon, *names]}:
+                if len(s) < MIN_CHARS:
+                    continue
+                if s not in index:
+                    index[s] = len(self.patterns)
+                    self.patterns.append((s, []))
+                    self._add(s, index[s])
+                if canon not in self.patterns[index[s]][1]:
+                    self.patterns[index[s]][1].append(canon)
+        self._link()
+        self.n_entities = len(surfaces)
+
+    def _add(self, s: str, pid: int):
+        state = 0
+        for ch in s:
+            nxt = self.goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[state][ch] = nxt
+                self.goto.append({}); self.fail.append(0); self.out.append([])
+            state = nxt
+        self.out[state].append(pid)
+
+    def _link(self):
+        """Failure links by BFS; each state's output also gets its failure state's outputs."""
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+                queue.append(nxt)
+
+    def find(self, text: str) -> List[Tuple[int, int, int]]:
+        """(start, end, pattern id) of every word-bounded match in normalized `text`."""
+        hits, state, goto, fail = [], 0, self.goto, self.fail
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for pid in self.out[state]:
+                start = i + 1 - len(self.patterns[pid][0])
+                if (start == 0 or not text[start - 1].isalnum()) and (i + 1 == len(text) or not text[i + 1].isalnum()):
+                    hits.append((start, i + 1, pid))
+        return hits
+
+    def link(self, query: str) -> List[Dict[str, object]]:
+        """[{"entities": [canon, ...], "text": matched form, "start", "end"}] leftmost-longest, in order."""
+        text = canonical_name(query)
+        out, covered = [], -1
+        for start, end, pid in sorted(self.find(text), key=lambda h: (h[0], -(h[1] - h[0]))):
+            if start < covered:
+                continue
+            out.append({"entities": list(self.patterns[pid][1]), "text": self.patterns[pid][0],
+                        "start": start, "end": end})
+            covered = end
+        return out
+
+    def entity_ids(self, query: str) -> List[str]:
+        return list(dict.fromkeys(c for m in self.link(query) for c in m["entities"]))
+
+    def stats(self) -> str:
+        return f"{self.n_entities} entities, {len(self.patterns)} surface forms, {len(self.goto)} states"
+
+# ------------------ build / load ------------------
+def fetch_surfaces(driver) -> Dict[str, List[str]]:
+    with driver.session() as s:
+        return {r["canon"]: [n for n in [r["name"], *r["aliases"]] if n] for r in s.run(Q_ENTITIES)}
+
+def rebuild(driver, path: pathlib.Path = ENTITIES_PATH) -> EntityLinker:
+    """Re-read entity names from Neo4j, save them, return the new linker (build_kg.py / API)."""
+    surfaces = fetch_surfaces(driver)
+    tmp = pathlib.Path(path).with_suffix(".tmp")
+    tmp.write_text(json.dumps(surfaces, ensure_ascii=False), encoding="utf-8")
+    tmp.replace(path)
+    return EntityLinker(surfaces)
+
+def load(path: pathlib.Path = ENTITIES_PATH) -> EntityLinker:
+    return EntityLinker(json.loads(pathlib.Path(path).read_text(encoding="utf-8")))
+
+# ------------------ CLI ------------------
+def main():
+    ap = argparse.ArgumentParser(description="Aho-Corasick entity linking for queries")
+    ap.add_argument("command", choices=["build", "link"])
+    ap.add_argument("query", nargs="?")
+    args = ap.parse_args()
+    if args.command == "build":
+        from neo4j import GraphDatabase
+        driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+        t = time.perf_counter()
+        try:
+            linker = rebuild(driver)
+        finally:
+            driver.close()
+        print(f"[link] {linker.stats()} -> {ENTITIES_PATH.resolve()} in {time.perf_counter() - t:.1f}s")
+        return
+    if not ENTITIES_PATH.exists():
+        sys.exit(f"No {ENTITIES_PATH}; run `python entity_linker.py build` (or build_kg.py) first.")
+    linker = load()
+    t = time.perf_counter()
+    found = linker.link(args.query or "")
+    print(f"[link] {len(found)} mention(s) in {(time.perf_counter() - t) * 1e6:.0f} us")
+    for m in found:
+        print(f"  {m['text']!r} -> {', '.join(m['entities'])}")
+
+if __name__ == "__main__":
+    main()
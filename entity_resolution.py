@@ -0,0 +1,227 @@
+# entity_resolution.py
+# Cluster alias entities ("Vitamin D", "vit D", "25-OH Vitamin D") into one canonical Entity
+# before they reach Neo4j. Used by build_kg.py (`resolve-entities`, and on every write).
+# - Blocking on each entity's rarest tokens / character 4-grams keeps comparisons near-linear
+# - Candidate pairs are scored with fuzzy string / abbreviation matching,
+#   confirmed by Ollama embedding similarity when the strings alone are not conclusive
+# - Union-find turns accepted pairs into clusters; the most-mentioned surface wins
+
+import os, re, math
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+from typing import Dict, List, Any, Iterable, Tuple
+
+import httpx
+
+OLLAMA_HOST  = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+EMBED_MODEL  = os.getenv("EMBED_MODEL", "nomic-embed-text")
+
+USE_EMBED      = os.getenv("KG_ER_EMBED", "1") == "1"          # confirm borderline pairs by embedding
+MAX_BLOCK      = int(os.getenv("KG_ER_MAX_BLOCK", "40"))       # skip blocking keys shared by more entities
+KEYS_PER_ENTITY = int(os.getenv("KG_ER_KEYS", "4"))             # compare only through each entity's rarest keys
+FUZZY_ACCEPT   = float(os.getenv("KG_ER_FUZZY", "0.92"))        # string similarity that merges on its own
+FUZZY_CANDIDATE = float(os.getenv("KG_ER_CANDIDATE", "0.5"))    # below this, never ask the embedder
+EMBED_ACCEPT   = float(os.getenv("KG_ER_EMBED_SIM", "0.9"))     # cosine needed to confirm a candidate
+
+STOP = {"the", "and", "for", "test", "tests", "of", "in", "with", "to", "a", "an", "by", "or"}
+
+# ------------------ Union-find ------------------
+class UnionFind:
+    def __init__(self):
+        self.parent: Dict[str, str] = {}
+
+    def find(self, x: str) -> str:
+        self.parent.setdefault(x, x)
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[x] != root:                     # path compression
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, a: str, b: str):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[rb] = ra
+
+    def groups(self) -> Dict[str, List[str]]:
+        out = defaultdict(list)
+        for x in list(self.parent):
+            out[self.find(x)].append(x)
+        return out
+
+# ------------------ Similarity ------------------
+def tokens(canon: str) -> List[str]:
+    return [t for t in re.split(r"[\s\-/&+]+", canon) if t]
+
+def numbers(toks: Iterable[str]) -> frozenset:
+    return frozenset(t for t in toks if any(ch.isdigit() for ch in t))
+
+def blocking_keys(canon: str) -> set:
+    toks = tokens(canon)
+    keys = {"t:" + t for t in toks if len(t) >= 3 and t not in STOP}
+    squashed = "".join(toks)
+    keys |= {"g:" + squashed[i:i+4] for i in range(max(0, len(squashed) - 3))}
+    keys.add("p:" + " ".join(t[:3] for t in toks))       # "vit d" ~ "vitamin d"
+    return keys
+
+def abbreviation_match(a: List[str], b: List[str]) -> float:
+    """
+    Share of tokens in the longer name covered by a token of the shorter one, where
+    covering means equal or prefix ("vit" ~ "vitamin"). 1.0 for "vit d" vs "vitamin d".
+    """
+    short, long_ = (a, b) if len(a) <= len(b) else (b, a)
+    if not short:
+        return 0.0
+    used, matched = set(), 0
+    for s in short:
+        hit = next((i for i, l in enumerate(long_) if i not in used and (l == s or
+                    (len(s) >= 2 and l.startswith(s)) or (len(l) >= 2 and s.startswith(l)))), None)
+        if hit is None:
+            return 0.0                                    # every short token must be explained
+        used.add(hit); matched += 1
+    return matched / len(long_)
+
+def string_score(a: str, b: str) -> Tuple[float, bool]:
+    """(similarity, conclusive): conclusive means the strings alone may merge the pair."""
+    ta, tb = tokens(a), tokens(b)
+    na, nb = numbers(ta), numbers(tb)
+    if na and nb and na != nb:
+        return 0.0, True                                  # "profile 1" vs "profile 2"
+    abbr = abbreviation_match(ta, tb)
+    sm = SequenceMatcher(None, "".join(ta), "".join(tb))
+    # cheap upper bounds first; ratio() is the expensive part
+    ok = sm.real_quick_ratio() >= FUZZY_CANDIDATE and sm.quick_ratio() >= FUZZY_CANDIDATE
+    fuzzy = sm.ratio() if ok else 0.0
+    if abbr == 0.0:
+        return fuzzy, True                                # "vitamin d" vs "vitamin e": spelling only
+    # a number on one side only ("25-oh vitamin d") needs the embedder to agree
+    return max(abbr, fuzzy), not (na ^ nb)
+
+def types_compatible(t1: List[str], t2: List[str]) -> bool:
+    s1 = {t.lower() for t in t1 if t}; s2 = {t.lower() for t in t2 if t}
+    return not s1 or not s2 or bool(s1 & s2)
+
+def cosine(u: List[float], v: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(u, v))
+    nu = math.sqrt(sum(x * x for x in u)); nv = math.sqrt(sum(y * y for y in v))
+    return dot / (nu * nv) if nu and nv else 0.0
+
+def embed_names(names: List[str], batch: int = 64) -> Dict[str, List[float]]:
+    out: Dict[str, List[float]] = {}
+    with httpx.Client(timeout=60.0) as client:
+        for i in range(0, len(names), batch):
+            part = names[i:i+batch]
+            r = client.post(f"{OLLAMA_HOST}/api/embed", json={"model": EMBED_MODEL, "input": part})
+            r.raise_for_status()
+            out.update(zip(part, r.json()["embeddings"]))
+    return out
+
+# ------------------ Resolution ------------------
+def collect_entities(extractions: Iterable[Dict[str, Any]]):
+    """Per canon: display name, types, aliases and mention count across normalized extractions."""
+    info: Dict[str, Dict[str, Any]] = {}
+    for ex in extractions:
+        for e in ex["entities"]:
+            cur = info.setdefault(e["canon"], {"names": Counter(), "types": set(), "aliases": set(), "mentions": 0})
+            cur["names"][e["name"]] += 1
+            cur["types"].update(e["types"])
+            cur["aliases"].update(e["aliases"])
+            cur["mentions"] += 1
+    return info
+
+def resolve(info: Dict[str, Dict[str, Any]], known: Dict[str, str], canonical_name) -> Dict[str, str]:
+    """
+    Return {canon: canonical canon} for every entity whose cluster has more than one member.
+    `known` is the persisted alias table, re-applied first so earlier decisions stick.
+    """
+    uf = UnionFind()
+    for c in info:
+        uf.find(c)
+    for c, target in known.items():
+        if c in info or target in info:
+            uf.union(target, c)
+
+    # 1) aliases the extractor itself reported ("Vitamin D", aliases: ["vit D"])
+    for c, d in info.items():
+        for a in d["aliases"]:
+            ac = canonical_name(a)
+            if ac in info and ac != c and types_compatible(d["types"], info[ac]["types"]):
+                uf.union(c, ac)
+
+    # 2) blocking -> candidate pairs. Each entity is compared only through its
+    #    KEYS_PER_ENTITY rarest keys of size <= MAX_BLOCK, so work is O(n * keys * block).
+    keys_of = {c: blocking_keys(c) for c in info}
+    blocks = defaultdict(list)
+    for c, ks in keys_of.items():
+        for k in ks:
+            blocks[k].append(c)
+    pairs = set()
+    for c, ks in keys_of.items():
+        usable = sorted((len(blocks[k]), k) for k in ks if 1 < len(blocks[k]) <= MAX_BLOCK)
+        for _, k in usable[:KEYS_PER_ENTITY]:
+            for other in blocks[k]:
+                if other != c:
+                    pairs.add((c, other) if c < other else (other, c))
+
+    # 3) score; embed only the borderline pairs
+    borderline = []
+    for a, b in pairs:
+        if uf.find(a) == uf.find(b) or not types_compatible(info[a]["types"], info[b]["types"]):
+            continue
+        score, conclusive = string_score(a, b)
+        if conclusive:
+            if score >= FUZZY_ACCEPT:
+                uf.union(a, b)
+        elif score >= FUZZY_CANDIDATE:
+            borderline.append((a, b))
+
+    if borderline and USE_EMBED:
+        names = sorted({x for p in borderline for x in p})
+        try:
+            vecs = embed_names(names)
+        except Exception as e:
+            print(f"[resolve] embedding unavailable ({e}); skipping {len(borderline)} borderline pairs")
+            vecs = {}
+        for a, b in borderline:
+            if a in vecs and b in vecs and cosine(vecs[a], vecs[b]) >= EMBED_ACCEPT:
+                uf.union(a, b)
+
+    mapping: Dict[str, str] = {}
+    for members in uf.groups().values():
+        present = [m for m in members if m in info]
+        if len(members) < 2 or not present:
+            continue
+        # most-mentioned surface wins; then fewest tokens, then the spelled-out form
+        head = min(present, key=lambda m: (-info[m]["mentions"], len(tokens(m)), -len(m), m))
+        for m in members:
+            if m != head:
+                mapping[m] = head
+    print(f"[resolve] {len(info)} entities | {len(pairs)} candidate pairs | "
+          f"{len(borderline)} embedding checks | {len(mapping)} merged into {len(set(mapping.values()))}")
+    return mapping
+
+def apply_aliases(ex: Dict[str, Any], mapping: Dict[str, str]) -> Dict[str, Any]:
+    """Rewrite one normalized extraction onto canonical entities (merging duplicates, dropping self-loops)."""
+    if not mapping:
+        return ex
+    ents: Dict[str, Dict[str, Any]] = {}
+    for e in ex["entities"]:
+        c = mapping.get(e["canon"], e["canon"])
+        cur = ents.get(c)
+        if cur is None:
+            cur = ents[c] = {"name": e["name"], "canon": c, "types": [], "aliases": []}
+        elif e["canon"] == c and cur["name"] != e["name"]:
+            # the canonical entity's own surface form is the display name
+            cur["aliases"].append(cur["name"]); cur["name"] = e["name"]
+        cur["types"] += [t for t in e["types"] if t not in cur["types"]]
+        for a in e["aliases"] + ([e["name"]] if c != e["canon"] else []):
+            if a not in cur["aliases"] and a != cur["name"]:
+                cur["aliases"].append(a)
+    triples = []
+    for t in ex["triples"]:
+        s = mapping.get(t["subj_canon"], t["subj_canon"])
+        o = mapping.get(t["obj_canon"], t["obj_canon"])
+        if s != o:
+            triples.append({**t, "subj_canon": s, "obj_canon": o})
+    return {"entities": list(ents.values()), "triples": triples}
@@ -5,7 +5,11 @@ Created on Wed Sep 17 18:24:41 2025
 @author: JIajie Shi
 """
 
-import json, hashlib, pathlib, re
+import json, hashlib, pathlib, re, os, math
+
+from md_parse import split_tokens, CHUNK_TOKENS, CHUNK_OVERLAP
+import near_dup
+from kb_store import KBStore, STORE_PATH
 
 FAQ = pathlib.Path("qa.jsonl")
 SECT = pathlib.Path("sections.jsonl")
@@ -19,35 +23,85 @@ def load_jsonl(p: pathlib.Path):
     if not p.exists(): return []
     return [json.loads(x) for x in p.read_text(encoding="utf-8").splitlines() if x.strip()]
 
+def collapse_near_dups(rows):
+    """
+    Merge rows whose question + answer are near-identical (Jaccard >= NEARDUP_THRESHOLD, same
+    kind) into the first one; it keeps its id and gains `urls` / `doc_ids` of every copy.
+    """
+    canon = near_dup.cluster([f"{r['question']}\n{r['answer']}" for r in rows], [r["kind"] for r in rows])
+    kept = []
+    for i, r in enumerate(rows):
+        c = rows[canon[i]]
+        if canon[i] == i:
+            r["urls"], r["doc_ids"], r["duplicates"] = [r["url"]], [r["doc_id"]], 0
+            kept.append(r)
+            continue
+        c["duplicates"] += 1
+        if r["url"] not in c["urls"]: c["urls"].append(r["url"])
+        if r["doc_id"] not in c["doc_ids"]: c["doc_ids"].append(r["doc_id"])
+    return kept
+
+def report_savings(before, after):
+    # embed_and_load.py / LightRAG embed one vector per row; LightRAG runs one extraction
+    # call per row (rows fit its chunk size); build_kg.py packs up to KG_BUNDLE_SIZE per call
+    if near_dup.THRESHOLD <= 0:
+        print("[near-dup] disabled (NEARDUP_THRESHOLD <= 0)")
+        return
+    n = len(before) - len(after)
+    kind = os.getenv("KG_PROCESS_KIND", "qa")
+    bundle = int(os.getenv("KG_BUNDLE_SIZE", "6"))
+    kg = lambda rows: math.ceil(sum(1 for r in rows if kind == "all" or r["kind"] == kind) / bundle)
+    merged = sum(1 for r in after if r["duplicates"])
+    print(f"[near-dup] collapsed {n} of {len(before)} rows into {merged} canonical rows "
+          f"(Jaccard >= {near_dup.THRESHOLD}); saves {n} embedding calls, "
+          f"{n} LightRAG extraction calls, ~{kg(before) - kg(after)} build_kg calls")
+
 def main():
     items = load_jsonl(FAQ) + load_jsonl(SECT)
     seen = set()
     cleaned = []
+    n_split = 0
+    occurrences = {}   # (url, question) -> chunks so far; numbers chunks sharing a heading
     for it in items:
         q = norm(it.get("question","")); a = norm(it.get("answer",""))
         url = it.get("url",""); kind = it.get("kind","section")
+        path = it.get("heading_path") or []
         if not q or not a: continue
+        # sections carry their heading path: embedding / KG / LightRAG all see "Page > Section > Sub"
+        if len(path) > 1: q = norm(" > ".join(path))
         # exact-dupe guard
         key = (q.lower(), a.lower())
         if key in seen: continue
         seen.add(key)
-        # clip overlong answers (keeps prompts tight)
-        if len(a) > 2000: a = a[:2000] + " ..."
-        _id = sha1(f"{url}::{q}")
-        cleaned.append({
-            "id": _id,
-            "kind": kind,
-            "question": q,
-            "answer": a,
-            "url": url,
-            "doc_id": it.get("doc_id"),
-            "section": it.get("section"),
-            "source_format": it.get("source_format")
-        })
+        # token-bound overlong answers (sections arrive chunked; long FAQ answers split here)
+        pieces = split_tokens(a, CHUNK_TOKENS, CHUNK_OVERLAP)
+        n_split += len(pieces) > 1
+        for piece in pieces:
+            part = occurrences.get((url, q), 0)
+            occurrences[(url, q)] = part + 1
+            _id = sha1(f"{url}::{q}" + (f"::{part}" if part else ""))
+            cleaned.append({
+                "id": _id,
+                "kind": kind,
+                "question": q,
+                "answer": piece,
+                "url": url,
+                "doc_id": it.get("doc_id"),
+                "section": it.get("section"),
+                "source_format": it.get("source_format"),
+                "heading_path": path or None,
+                "part": part
+            })
+    before = list(cleaned)
+    cleaned = collapse_near_dups(cleaned)
+    report_savings(before, cleaned)
     with OUT.open("w",encoding="utf-8") as f:
         for it in cleaned:
             f.write(json.dumps(it,ensure_ascii=False)+"\n")
-    print(f"final kb: {len(cleaned)} items -> {OUT.resolve()}")
+    # indexed copy for id / url / doc_id lookups (written after kb.jsonl, so it reads as current)
+    KBStore.build(cleaned).close()
+    print(f"final kb: {len(cleaned)} items -> {OUT.resolve()} ({n_split} answers over {CHUNK_TOKENS} tokens split)")
+    print(f"kb store: {STORE_PATH.resolve()}")
 
 if __name__=="__main__":
     main()
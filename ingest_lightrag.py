@@ -1,65 +1,150 @@
 # ingest_lightrag.py
-import os, json, asyncio, hashlib, logging
+# Incremental: a manifest of qa_/sec_<sha1> ids -> content hashes in LR_WORKDIR decides what to
+# insert (new), delete (gone from kb.jsonl) and leave alone (unchanged) on each run.
+# Rows of every kind are streamed from kb.jsonl and inserted in LR_BATCH_SIZE batches; the
+# manifest is saved after each batch, so an interrupted run resumes where it stopped.
+# ainsert() does not raise when a document fails extraction (LightRAG marks it FAILED in its doc
+# status), so only ids whose status is PROCESSED enter the manifest; the rest are retried next run.
+import os, json, asyncio, hashlib, logging, time
 from pathlib import Path
 from dotenv import load_dotenv, find_dotenv
 
 from lightrag import LightRAG
+from lightrag.base import DocStatus
 from lightrag.kg.shared_storage import initialize_pipeline_status
 from lightrag.llm.ollama import ollama_model_complete, ollama_embed
 from lightrag.utils import EmbeddingFunc
 
+from lightrag_client import load_tuning, storage_kwargs, TUNING_FILE, STORAGE
+from ollama_opts import ollama_options, keep_alive
+
 load_dotenv(find_dotenv(usecwd=True), override=True)
 
 WORKDIR     = os.getenv("LR_WORKDIR", "./lr_storage")
-QA_FILE     = os.getenv("QA_FILE", "./qa.jsonl")   # your Phase-2 FAQ file
+KB_FILE     = os.getenv("KB_FILE", "./kb.jsonl")   # Phase-2 combined corpus (FAQs + sections)
+KINDS       = {k.strip() for k in os.getenv("LR_KINDS", "qa,section").split(",") if k.strip()}
+BATCH_SIZE  = int(os.getenv("LR_BATCH_SIZE", "50"))
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
 EMBED_MODEL = os.getenv("EMBED_MODEL", "nomic-embed-text")
 GEN_MODEL   = os.getenv("OLLAMA_GEN_MODEL", "qwen2.5:7b-instruct-q4_K_M")
 
+MANIFEST    = Path(WORKDIR) / "ingest_manifest.json"
+
 Path(WORKDIR).mkdir(parents=True, exist_ok=True)
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 
-def load_qas(path):
-    items = []
+# Wall-clock seconds spent inside LLM calls (entity/relation extraction), summed over calls.
+LLM_SECONDS = [0.0]
+
+async def timed_llm(*args, **kwargs):
+    t = time.perf_counter()
+    try:
+        return await ollama_model_complete(*args, **kwargs)
+    finally:
+        LLM_SECONDS[0] += time.perf_counter() - t
+
+def render(rec):
+    """(doc_id, text) for one kb.jsonl row; None if it has no usable text."""
+    kind = rec.get("kind") or "section"
+    url = rec.get("url", "")
+    q = (rec.get("question") or "").strip()
+    a = (rec.get("answer")  or "").strip()
+    if not q or not a:
+        return None
+
+    # Keep URL in the text so we can extract Sources later
+    if kind == "qa":
+        text = f"### FAQ\nQ: {q}\nA: {a}\nSource: {url}"
+    else:
+        text = f"### {q}\n{a}\nSource: {url}"
+
+    # Guaranteed-unique, stable ID (dedup exact same QA across runs)
+    raw = f"{url}\nQ:{q}\nA:{a}"
+    uid = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+    prefix = "qa" if kind == "qa" else "sec"
+    return f"{prefix}_{uid}", text
+
+def iter_docs(path):
+    """Stream (doc_id, text) from kb.jsonl, filtered by LR_KINDS, first occurrence of each id only."""
     seen_ids = set()
     with open(path, "r", encoding="utf-8") as f:
         for line in f:
+            if not line.strip():
+                continue
             rec = json.loads(line)
-            if rec.get("kind") != "qa":
+            if KINDS and rec.get("kind") not in KINDS:
                 continue
-            url = rec.get("url", "")
-            q = (rec.get("question") or "").strip()
-            a = (rec.get("answer")  or "").strip()
-
-            # Keep URL in the text so we can extract Sources later
-            text = f"### FAQ\nQ: {q}\nA: {a}\nSource: {url}"
-
-            # Guaranteed-unique, stable ID (dedup exact same QA across runs)
-            raw = f"{url}\nQ:{q}\nA:{a}"
-            uid = hashlib.sha1(raw.encode("utf-8")).hexdigest()
-            _id = f"qa_{uid}"
-            if _id in seen_ids:
+            doc = render(rec)
+            if doc is None or doc[0] in seen_ids:
                 continue
-            seen_ids.add(_id)
-            items.append((_id, text))
-    return items
+            seen_ids.add(doc[0])
+            yield doc
+
+def batched(it, n):
+    batch = []
+    for x in it:
+        batch.append(x)
+        if len(batch) >= n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def load_manifest() -> dict:
+    if MANIFEST.exists():
+        return json.loads(MANIFEST.read_text(encoding="utf-8"))
+    return {}
+
+def save_manifest(manifest: dict) -> None:
+    tmp = MANIFEST.with_suffix(".tmp")
+    tmp.write_text(json.dumps(manifest, indent=0, sort_keys=True), encoding="utf-8")
+    tmp.replace(MANIFEST)                       # atomic: never leave a half-written manifest
+
+def plan(path, manifest):
+    """
+    One streaming pass over ids/hashes only (texts are not kept):
+    returns (pending ids, ids to delete, unchanged count, total).
+    """
+    current = {_id: content_hash(text) for _id, text in iter_docs(path)}
+    to_delete = [i for i in manifest if i not in current or manifest[i] != current[i]]
+    pending = {i for i, h in current.items() if manifest.get(i) != h}
+    return pending, to_delete, len(current) - len(pending), len(current)
+
+async def doc_statuses(rag, ids) -> dict:
+    """id -> LightRAG doc status for the ids it knows (get_by_ids skips unknown ids, so one at a time)."""
+    out = {}
+    for i in ids:
+        d = await rag.doc_status.get_by_id(i)
+        if d:
+            out[i] = d.get("status")
+    return out
 
 async def main():
     print("Neo4j (LightRAG):", os.getenv("NEO4J_URI"), os.getenv("NEO4J_USERNAME"),
           "PWD set?", bool(os.getenv("NEO4J_PASSWORD")))
 
-    qa = load_qas(QA_FILE)
-    logging.info("Loaded %d QA items from %s", len(qa), QA_FILE)
-    if not qa:
-        raise SystemExit("No QA items found in qa.jsonl")
+    manifest = load_manifest()
+    pending, to_delete, unchanged, total = plan(KB_FILE, manifest)
+    logging.info("Scanned %d docs (kinds=%s) from %s", total, ",".join(sorted(KINDS)), KB_FILE)
+    if not total:
+        raise SystemExit(f"No items found in {KB_FILE}")
+    logging.info("Manifest: %d known | %d to insert | %d to delete | %d unchanged",
+                 len(manifest), len(pending), len(to_delete), unchanged)
+
+    knobs = load_tuning()
+    logging.info("Concurrency knobs (%s): %s | storage=%s", TUNING_FILE, knobs, STORAGE)
 
     # LightRAG with Neo4j KG + Ollama embeddings/generation
     rag = LightRAG(
         working_dir=WORKDIR,
         graph_storage="Neo4JStorage",                 # KG lives in Neo4j
-        llm_model_func=ollama_model_complete,         # used internally if needed
+        llm_model_func=timed_llm,                     # ollama_model_complete, timed per batch
         llm_model_name=GEN_MODEL,
-        llm_model_kwargs={"host": OLLAMA_HOST, "options": {"num_ctx": 8192}},
+        llm_model_kwargs={"host": OLLAMA_HOST, "options": ollama_options(num_predict=-1),  # extraction runs long
+                          "keep_alive": keep_alive()},
         embedding_func=EmbeddingFunc(
             embedding_dim=768,                        # nomic-embed-text dim
             max_token_size=8192,
@@ -67,19 +152,56 @@ async def main():
                 texts, embed_model=EMBED_MODEL, host=OLLAMA_HOST
             ),
         ),
-        embedding_batch_num=16,          # NEW
-        embedding_func_max_async=4,      # NEW
-        llm_model_max_async=2,           # NEW
+        **storage_kwargs(),              # LR_STORAGE=disk -> SQLite KV + mmap vectors
+        **knobs,                         # embedding_batch_num / embedding_func_max_async / llm_model_max_async
         #llm_model_max_token_size=8192,
     )
 
     await rag.initialize_storages()
     await initialize_pipeline_status()
 
-    ids, texts = zip(*qa)
-    logging.info("Inserting %d QAs into LightRAG…", len(texts))
-    # If you prefer auto-ids, use: await rag.ainsert(list(texts))
-    await rag.ainsert(list(texts), ids=list(ids))
+    t0 = time.perf_counter()
+    for doc_id in to_delete:                    # removed docs (or re-rendered text) leave the index
+        await rag.adelete_by_doc_id(doc_id)
+        manifest.pop(doc_id, None)
+    if to_delete:
+        save_manifest(manifest)
+    t_del = time.perf_counter() - t0
+
+    t1 = time.perf_counter()
+    done, failed = 0, []
+    todo = (d for d in iter_docs(KB_FILE) if d[0] in pending)
+    for n, batch in enumerate(batched(todo, BATCH_SIZE), 1):
+        ids, texts = zip(*batch)
+        llm0, tb = LLM_SECONDS[0], time.perf_counter()
+        for i, st in (await doc_statuses(rag, ids)).items():
+            if st != DocStatus.PROCESSED:        # left over from a failed run: re-enqueue with the current text
+                await rag.adelete_by_doc_id(i)
+        # If you prefer auto-ids, use: await rag.ainsert(list(texts))
+        await rag.ainsert(list(texts), ids=list(ids))
+        ok = {i for i, st in (await doc_statuses(rag, ids)).items() if st == DocStatus.PROCESSED}
+        manifest.update({i: content_hash(t) for i, t in batch if i in ok})
+        save_manifest(manifest)                 # checkpoint: a crash after this resumes at the next batch
+        done += len(ok)
+        failed.extend(i for i in ids if i not in ok)
+        if len(ok) < len(ids):
+            logging.warning("Batch %d: %d docs not processed (retried next run): %s",
+                            n, len(ids) - len(ok), ", ".join(i for i in ids if i not in ok)[:300])
+        dt = time.perf_counter() - tb
+        logging.info("Batch %d: %d docs in %.1fs (%.2f docs/s) | LLM extraction %.1fs | %d/%d inserted",
+                     n, len(batch), dt, len(batch) / dt if dt else 0.0,
+                     LLM_SECONDS[0] - llm0, done, len(pending))
+    t_ins = time.perf_counter() - t1
+
+    deleted = set(to_delete)
+    inserted = pending.difference(failed)
+    added = sum(1 for i in inserted if i not in deleted)
+    changed = len(inserted) - added
+    logging.info("Summary: added=%d removed=%d changed=%d unchanged=%d failed=%d | delete %.1fs, insert %.1fs"
+                 " (%.2f docs/s, LLM %.1fs)",
+                 added, len(deleted - pending), changed, unchanged, len(failed), t_del, t_ins,
+                 done / t_ins if t_ins else 0.0, LLM_SECONDS[0])
+    await rag.finalize_storages()
     logging.info("Done. LightRAG workdir: %s", WORKDIR)
 
 if __name__ == "__main__":
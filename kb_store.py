@@ -0,0 +1,137 @@
+# kb_store.py
+# Indexed copy of kb.jsonl (kb.sqlite), written by finalize_kb.py next to the JSONL.
+# - get(id), by_url(url), by_doc_id(doc_id) are single index lookups; by_url / by_doc_id
+#   also find near-duplicate rows that were merged into another page's row (`urls` / `doc_ids`)
+# - iter_rows(kind) streams rows in kb.jsonl order, using the kind index to skip the others
+# - iter_kb() streams from the store when it is at least as new as kb.jsonl, else the JSONL
+#
+# Usage: python kb_store.py build | get <id> | url <url>
+
+import os, sys, json, sqlite3, pathlib, argparse
+from typing import Dict, Iterable, Iterator, List, Optional
+
+KB_PATH    = pathlib.Path("kb.jsonl")
+STORE_PATH = pathlib.Path(os.getenv("KB_STORE", "kb.sqlite"))
+
+class KBStore:
+    def __init__(self, path: pathlib.Path = STORE_PATH):
+        self.path = pathlib.Path(path)
+        # the API reads it from its event-loop thread and from threadpool handlers
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+
+    @classmethod
+    def build(cls, rows: Iterable[Dict], path: pathlib.Path = STORE_PATH) -> "KBStore":
+        """Write a fresh store (to a temp file, swapped in when complete) from kb rows."""
+        path = pathlib.Path(path)
+        tmp = path.with_suffix(".tmp")
+        tmp.unlink(missing_ok=True)
+        conn = sqlite3.connect(tmp)
+        conn.executescript("""
+        CREATE TABLE kb (
+            seq INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, kind TEXT,
+            url TEXT, doc_id TEXT, question TEXT, data TEXT NOT NULL);
+        CREATE TABLE kb_url (url TEXT NOT NULL, seq INTEGER NOT NULL);
+        CREATE TABLE kb_doc (doc_id TEXT NOT NULL, seq INTEGER NOT NULL);
+        """)
+        with conn:
+            for seq, r in enumerate(rows):
+                conn.execute("INSERT INTO kb VALUES (?,?,?,?,?,?,?)",
+                             (seq, r["id"], r.get("kind"), r.get("url"), r.get("doc_id"), r.get("question"),
+                              json.dumps(r, ensure_ascii=False)))
+                conn.executemany("INSERT INTO kb_url VALUES (?,?)",
+                                 [(u, seq) for u in dict.fromkeys(r.get("urls") or [r.get("url")]) if u])
+                conn.executemany("INSERT INTO kb_doc VALUES (?,?)",
+                                 [(d, seq) for d in dict.fromkeys(r.get("doc_ids") or [r.get("doc_id")]) if d])
+        # indexes after the bulk insert: one sort each instead of per-row B-tree updates
+        conn.executescript("""
+        CREATE INDEX kb_kind ON kb(kind, seq);
+        CREATE INDEX kb_url_idx ON kb_url(url, seq);
+        CREATE INDEX kb_doc_idx ON kb_doc(doc_id, seq);
+        """)
+        conn.close()
+        tmp.replace(path)
+        return cls(path)
+
+    def _rows(self, sql: str, args=()) -> List[Dict]:
+        return [json.loads(d) for (d,) in self.conn.execute(sql, args)]
+
+    def get(self, id: str) -> Optional[Dict]:
+        r = self.conn.execute("SELECT data FROM kb WHERE id=?", (id,)).fetchone()
+        return json.loads(r[0]) if r else None
+
+    def by_url(self, url: str) -> List[Dict]:
+        return self._rows("SELECT kb.data FROM kb_url JOIN kb USING (seq) WHERE kb_url.url=? ORDER BY seq", (url,))
+
+    def by_doc_id(self, doc_id: str) -> List[Dict]:
+        return self._rows("SELECT kb.data FROM kb_doc JOIN kb USING (seq) WHERE kb_doc.doc_id=? ORDER BY seq",
+                          (doc_id,))
+
+    def iter_rows(self, kind: Optional[str] = None) -> Iterator[Dict]:
+        sql, args = ("SELECT data FROM kb ORDER BY seq", ()) if kind is None else \
+                    ("SELECT data FROM kb WHERE kind=? ORDER BY seq", (kind,))
+        for (d,) in self.conn.execute(sql, args):
+            yield json.loads(d)
+
+    def count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM kb").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+def chunk_block(r: Dict) -> str:
+    """A kb row as it appears in a prompt context (ingest_lightrag.render's section layout)."""
+    return f"### {r['question']}\n{r['answer']}\nSource: {r['url']}"
+
+# ------------------ Readers ------------------
+def store_current(path: pathlib.Path = STORE_PATH, kb_path: pathlib.Path = KB_PATH) -> bool:
+    """The store exists and was written after kb.jsonl (not left stale by a hand edit)."""
+    path = pathlib.Path(path)
+    return path.exists() and (not kb_path.exists() or path.stat().st_mtime >= kb_path.stat().st_mtime)
+
+def open_store(path: pathlib.Path = STORE_PATH) -> Optional[KBStore]:
+    return KBStore(path) if store_current(path) else None
+
+def iter_jsonl(kb_path: pathlib.Path = KB_PATH) -> Iterator[Dict]:
+    with pathlib.Path(kb_path).open("r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def iter_kb(kind: Optional[str] = None, kb_path: pathlib.Path = KB_PATH) -> Iterator[Dict]:
+    """
+    kb rows in file order (optionally one kind): from the store if current, else kb.jsonl.
+    The store mirrors KB_PATH only, so any other `kb_path` is always read as JSONL.
+    """
+    same_kb = pathlib.Path(kb_path).resolve() == KB_PATH.resolve()
+    store = open_store() if same_kb else None
+    if store is None:
+        yield from (r for r in iter_jsonl(kb_path) if kind is None or r.get("kind") == kind)
+        return
+    try:
+        yield from store.iter_rows(kind)
+    finally:
+        store.close()
+
+# ------------------ CLI ------------------
+def main():
+    ap = argparse.ArgumentParser(description="Indexed KB store (kb.sqlite)")
+    ap.add_argument("command", choices=["build", "get", "url"])
+    ap.add_argument("key", nargs="?", help="chunk id for `get`, page url for `url`")
+    args = ap.parse_args()
+    if args.command == "build":
+        if not KB_PATH.exists():
+            sys.exit("kb.jsonl not found. Run Phase 2 finalization first.")
+        store = KBStore.build(iter_jsonl())
+        print(f"[done] {store.count()} rows -> {STORE_PATH.resolve()}")
+        store.close()
+        return
+    store = open_store()
+    if store is None:
+        sys.exit(f"No current {STORE_PATH}; run `python kb_store.py build` or finalize_kb.py.")
+    rows = [store.get(args.key)] if args.command == "get" else store.by_url(args.key)
+    for r in filter(None, rows):
+        print(json.dumps(r, ensure_ascii=False))
+    store.close()
+
+if __name__ == "__main__":
+    main()
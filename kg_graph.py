@@ -0,0 +1,218 @@
+# kg_graph.py
+# In-memory snapshot of the KG build_kg.py writes to Neo4j, for the /ask "use_kg" boost.
+# - chunk->entity (MENTIONS), entity->chunk and entity<->entity (REL, summed support_count)
+#   adjacency as CSR arrays (offsets + flat neighbour ids, int32), saved to KG_SNAPSHOT (.npz)
+#   so the API starts without a graph query; `snapshot` (or the API's POST /kg/refresh) rebuilds it
+# - rerank(): seeds = retrieved chunk ids in rank order; their entities (1 hop), optionally the
+#   REL neighbours of those (2 hops, weighted by support_count), then every chunk mentioning
+#   them is scored with numpy gathers -- no Cypher traversal per query
+# - entities mentioned by many chunks are damped (1 / log(2 + degree)) and ignored past
+#   KG_MAX_DEGREE, so hubs ("Vibrant Wellness") neither dominate nor fan out to every chunk
+#
+# Usage: python kg_graph.py snapshot | stats | query <chunk_id> [<chunk_id> ...]
+
+import os, sys, time, pathlib, argparse
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+NEO4J_URI      = os.getenv("NEO4J_URI", "neo4j://localhost:7687")
+NEO4J_USER     = os.getenv("NEO4J_USER", "neo4j")
+NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "neo4j_password")
+
+SNAPSHOT_PATH  = pathlib.Path(os.getenv("KG_SNAPSHOT", "kg_snapshot.npz"))
+KG_HOPS        = int(os.getenv("KG_HOPS", "1"))             # 1: shared entities; 2: also REL neighbours
+KG_HOP2_DECAY  = float(os.getenv("KG_HOP2_DECAY", "0.5"))   # weight of a 2-hop entity vs a direct one
+KG_WEIGHT      = float(os.getenv("KG_WEIGHT", "0.5"))       # max KG score, as a fraction of the top rank's
+KG_EXPAND_K    = int(os.getenv("KG_EXPAND_K", "3"))         # chunks the KG may add beyond the retrieved ones
+KG_MAX_DEGREE  = int(os.getenv("KG_MAX_DEGREE", "200"))     # entities in more chunks than this are ignored
+RRF_K          = int(os.getenv("RRF_K", "60"))
+
+Q_MENTIONS = "MATCH (c:Chunk)-[:MENTIONS]->(e:Entity) RETURN c.id AS chunk, e.canon AS entity"
+Q_RELS = ("MATCH (s:Entity)-[r:REL]->(o:Entity) WHERE s <> o "
+          "RETURN s.canon AS src, o.canon AS dst, coalesce(r.support_count, 1) AS support")
+
+def csr(src: np.ndarray, dst: np.ndarray, n: int, weight: Optional[np.ndarray] = None):
+    """(offsets, neighbours[, weights]) for edges src -> dst over n source nodes."""
+    order = np.argsort(src, kind="stable")
+    ptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=ptr[1:])
+    out = (ptr, dst[order].astype(np.int32))
+    return out + ((weight[order].astype(np.float32),) if weight is not None else ())
+
+def gather(ptr: np.ndarray, nodes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(positions into the neighbour array, index into `nodes` each position came from)."""
+    starts, lens = ptr[nodes], ptr[nodes + 1] - ptr[nodes]
+    owner = np.repeat(np.arange(len(nodes)), lens)
+    return np.repeat(starts - np.cumsum(lens) + lens, lens) + np.arange(lens.sum()), owner
+
+class KGSnapshot:
+    def __init__(self, chunk_ids: np.ndarray, entity_ids: np.ndarray, arrays: Dict[str, np.ndarray],
+                 built_at: float):
+        self.chunk_ids, self.entity_ids = chunk_ids, entity_ids
+        self.chunk_index = {c: i for i, c in enumerate(chunk_ids.tolist())}
+        self.entity_index = {e: i for i, e in enumerate(entity_ids.tolist())}
+        self.a = arrays
+        self.built_at = built_at
+        # damping per entity: mentioned by many chunks -> weak evidence of relatedness
+        degree = np.diff(arrays["ec_ptr"])
+        self.idf = np.where(degree > KG_MAX_DEGREE, 0.0, 1.0 / np.log(2.0 + degree)).astype(np.float32)
+
+    # ------------------ build / load ------------------
+    @classmethod
+    def from_edges(cls, mentions: Sequence[Tuple[str, str]], rels: Sequence[Tuple[str, str, int]]) -> "KGSnapshot":
+        chunk_ids = sorted({c for c, _ in mentions})
+        entity_ids = sorted({e for _, e in mentions} | {s for s, _, _ in rels} | {o for _, o, _ in rels})
+        ci = {c: i for i, c in enumerate(chunk_ids)}
+        ei = {e: i for i, e in enumerate(entity_ids)}
+        mc = np.array([ci[c] for c, _ in mentions], dtype=np.int64)
+        me = np.array([ei[e] for _, e in mentions], dtype=np.int64)
+        # REL is directed and may hold several predicates per pair: undirected, supports summed
+        rs = np.array([ei[s] for s, _, _ in rels] + [ei[o] for _, o, _ in rels], dtype=np.int64)
+        ro = np.array([ei[o] for _, o, _ in rels] + [ei[s] for s, _, _ in rels], dtype=np.int64)
+        rw = np.array([w for _, _, w in rels] * 2, dtype=np.float64)
+        n_c, n_e = len(chunk_ids), len(entity_ids)
+        if len(rs):
+            pair = rs * n_e + ro
+            pair, inv = np.unique(pair, return_inverse=True)
+            rw = np.bincount(inv, weights=rw)
+            rs, ro = pair // n_e, pair % n_e
+        arrays = {}
+        arrays["ce_ptr"], arrays["ce_idx"] = csr(mc, me, n_c)
+        arrays["ec_ptr"], arrays["ec_idx"] = csr(me, mc, n_e)
+        arrays["ee_ptr"], arrays["ee_idx"], arrays["ee_w"] = csr(rs, ro, n_e, rw)
+        return cls(np.array(chunk_ids, dtype=object), np.array(entity_ids, dtype=object), arrays, time.time())
+
+    @classmethod
+    def from_neo4j(cls, driver) -> "KGSnapshot":
+        with driver.session() as s:
+            mentions = [(r["chunk"], r["entity"]) for r in s.run(Q_MENTIONS)]
+            rels = [(r["src"], r["dst"], int(r["support"])) for r in s.run(Q_RELS)]
+        return cls.from_edges(mentions, rels)
+
+    def save(self, path: pathlib.Path = SNAPSHOT_PATH):
+        tmp = pathlib.Path(path).with_suffix(".tmp.npz")
+        np.savez(tmp, chunk_ids=self.chunk_ids.astype(str), entity_ids=self.entity_ids.astype(str),
+                 built_at=np.array(self.built_at), **self.a)
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: pathlib.Path = SNAPSHOT_PATH) -> "KGSnapshot":
+        with np.load(path) as z:
+            arrays = {k: z[k] for k in z.files if k not in ("chunk_ids", "entity_ids", "built_at")}
+            return cls(z["chunk_ids"].astype(object), z["entity_ids"].astype(object), arrays, float(z["built_at"]))
+
+    def stats(self) -> str:
+        return (f"{len(self.chunk_ids)} chunks, {len(self.entity_ids)} entities, "
+                f"{len(self.a['ce_idx'])} mentions, {len(self.a['ee_idx']) // 2} entity pairs")
+
+    # ------------------ query ------------------
+    def entity_weights(self, seeds: np.ndarray, seed_w: np.ndarray, hops: int,
+                       query_ents: np.ndarray = np.zeros(0, dtype=np.int64)) -> np.ndarray:
+        a, n_e = self.a, len(self.entity_ids)
+        pos, owner = gather(a["ce_ptr"], seeds)
+        ew = np.bincount(a["ce_idx"][pos], weights=seed_w[owner], minlength=n_e).astype(np.float64, copy=False)
+        ew[query_ents] += 1.0                                            # named in the question: as a top seed
+        if hops >= 2:
+            ents = np.flatnonzero(ew)
+            pos, owner = gather(a["ee_ptr"], ents)
+            if len(pos):
+                w = a["ee_w"][pos]
+                # share of each entity's total support, so a heavily linked entity spreads thin
+                share = w / np.bincount(owner, weights=w, minlength=len(ents))[owner]
+                ew += KG_HOP2_DECAY * np.bincount(a["ee_idx"][pos], weights=ew[ents][owner] * share,
+                                                  minlength=n_e)
+        return ew * self.idf
+
+    def chunk_scores(self, seed_ids: Sequence[str], hops: int = KG_HOPS,
+                     entities: Sequence[str] = ()) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (chunk indexes, scores): KG relatedness of every reachable chunk to the seeds and to the
+        entities linked in the question (entity_linker.py), a seed's own mentions excluded.
+        """
+        known = [(self.chunk_index[c], 1.0 / (RRF_K + r + 1)) for r, c in enumerate(seed_ids) if c in self.chunk_index]
+        query_ents = np.array([self.entity_index[e] for e in entities if e in self.entity_index], dtype=np.int64)
+        if not known and not len(query_ents):
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        seeds = np.array([i for i, _ in known], dtype=np.int64)
+        seed_w = np.array([w for _, w in known]) * (RRF_K + 1)          # top seed = 1.0
+        ew = self.entity_weights(seeds, seed_w, hops, query_ents)
+        ents = np.flatnonzero(ew)
+        pos, owner = gather(self.a["ec_ptr"], ents)
+        chunks, w = self.a["ec_idx"][pos], ew[ents][owner]
+        # a seed is not evidence for itself: drop the weight it put on its own entities
+        ce_pos, ce_owner = gather(self.a["ce_ptr"], seeds)
+        self_w = np.bincount(ce_owner, weights=seed_w[ce_owner] * self.idf[self.a["ce_idx"][ce_pos]],
+                             minlength=len(seeds))
+        uniq, inv = np.unique(chunks, return_inverse=True)
+        score = np.bincount(inv, weights=w)
+        for i, s in enumerate(seeds):
+            k = np.searchsorted(uniq, s)
+            if k < len(uniq) and uniq[k] == s:
+                score[k] -= self_w[i]
+        keep = score > 1e-9
+        return uniq[keep], score[keep]
+
+    def rerank(self, seed_ids: Sequence[str], hops: int = KG_HOPS, weight: float = KG_WEIGHT,
+               expand_k: int = KG_EXPAND_K, entities: Sequence[str] = ()) -> List[Tuple[str, float, bool]]:
+        """
+        [(chunk_id, score, added_by_kg)] best first: retrieved chunks keep their RRF rank score
+        plus a KG bonus (up to `weight` x the top rank's score); up to `expand_k` chunks that
+        were not retrieved but are strongly linked through shared (or question) entities join.
+        """
+        fused = {c: 1.0 / (RRF_K + r + 1) for r, c in enumerate(seed_ids)}
+        idx, score = self.chunk_scores(seed_ids, hops, entities)
+        if len(idx):
+            score = score * (weight / (RRF_K + 1) / score.max())
+            seeds = np.array([self.chunk_index.get(c, -1) for c in seed_ids])
+            is_seed = np.isin(idx, seeds)
+            for i, s in zip(idx[is_seed].tolist(), score[is_seed].tolist()):
+                fused[self.chunk_ids[i]] += s
+            # best expand_k of the rest without sorting them all
+            idx, score = idx[~is_seed], score[~is_seed]
+            if len(idx) > expand_k:
+                top = np.argpartition(-score, expand_k)[:expand_k]
+                idx, score = idx[top], score[top]
+            for i, s in zip(idx.tolist(), score.tolist()):
+                fused[self.chunk_ids[i]] = s
+        retrieved = set(seed_ids)
+        return [(c, s, c not in retrieved) for c, s in sorted(fused.items(), key=lambda x: -x[1])]
+
+# ------------------ CLI ------------------
+def build_from_neo4j() -> KGSnapshot:
+    from neo4j import GraphDatabase
+    driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+    try:
+        return KGSnapshot.from_neo4j(driver)
+    finally:
+        driver.close()
+
+def main():
+    ap = argparse.ArgumentParser(description="CSR snapshot of the Neo4j KG for query-time boosting")
+    ap.add_argument("command", choices=["snapshot", "stats", "query"])
+    ap.add_argument("chunk_ids", nargs="*", help="query: retrieved chunk ids, best first")
+    ap.add_argument("--hops", type=int, default=KG_HOPS)
+    args = ap.parse_args()
+    if args.command == "snapshot":
+        t = time.perf_counter()
+        kg = build_from_neo4j()
+        kg.save()
+        print(f"[kg] {kg.stats()} -> {SNAPSHOT_PATH.resolve()} in {time.perf_counter() - t:.1f}s")
+        return
+    if not SNAPSHOT_PATH.exists():
+        sys.exit(f"No snapshot at {SNAPSHOT_PATH}; run `python kg_graph.py snapshot` first.")
+    kg = KGSnapshot.load()
+    if args.command == "stats":
+        print(f"[kg] {kg.stats()} (built {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(kg.built_at))})")
+        return
+    t = time.perf_counter()
+    ranked = kg.rerank(args.chunk_ids, hops=args.hops)
+    print(f"[kg] reranked in {(time.perf_counter() - t) * 1e6:.0f} us")
+    for cid, score, added in ranked:
+        print(f"{score:.5f} {'+kg ' if added else '     '}{cid}")
+
+if __name__ == "__main__":
+    main()
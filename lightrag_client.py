@@ -6,13 +6,15 @@ Created on Thu Sep 18 00:56:00 2025
 """
 
 # lightrag_client.py
-import os, re, asyncio
+import os, re, json, asyncio
 from dotenv import load_dotenv, find_dotenv
 from lightrag import LightRAG, QueryParam
 from lightrag.kg.shared_storage import initialize_pipeline_status
 from lightrag.llm.ollama import ollama_model_complete, ollama_embed
 from lightrag.utils import EmbeddingFunc
 
+from ollama_opts import ollama_options, keep_alive
+
 load_dotenv(find_dotenv(usecwd=True), override=True)
 
 WORKDIR     = os.getenv("LR_WORKDIR", "./lr_storage")
@@ -21,8 +23,38 @@ EMBED_MODEL = os.getenv("EMBED_MODEL", "nomic-embed-text")
 GEN_MODEL   = os.getenv("OLLAMA_GEN_MODEL", "qwen2.5:7b-instruct-q4_K_M")
 MAX_CONTEXT_CHARS = int(os.getenv("MAX_CONTEXT_CHARS", "4000"))
 
+# Concurrency knobs written by tune_lightrag.py; shared by ingestion and the API.
+TUNING_FILE = os.getenv("LR_TUNING_FILE", "./lr_tuning.json")
+TUNING_DEFAULTS = {
+    "embedding_batch_num": 16,
+    "embedding_func_max_async": 4,
+    "llm_model_max_async": 2,
+}
+
+# KV / vector backend: "json" (LightRAG default, loaded fully at startup) or
+# "disk" (SQLite KV + memory-mapped vectors from lr_disk_storage.py, read lazily).
+STORAGE     = os.getenv("LR_STORAGE", "json").lower()
+
 _rag = None
 
+def storage_kwargs() -> dict:
+    """LightRAG(kv_storage=..., vector_storage=...) for LR_STORAGE; empty for the JSON default."""
+    if STORAGE == "disk":
+        import lr_disk_storage  # noqa: F401  (registers the classes with LightRAG)
+        return {"kv_storage": "SQLiteKVStorage", "vector_storage": "MmapVectorStorage"}
+    if STORAGE != "json":
+        raise ValueError(f"LR_STORAGE must be 'json' or 'disk', got {STORAGE!r}")
+    return {}
+
+def load_tuning() -> dict:
+    """TUNING_DEFAULTS overlaid with the best configuration found by tune_lightrag.py, if any."""
+    knobs = dict(TUNING_DEFAULTS)
+    if os.path.exists(TUNING_FILE):
+        with open(TUNING_FILE, "r", encoding="utf-8") as f:
+            best = json.load(f).get("best", {})
+        knobs.update({k: int(v) for k, v in best.items() if k in TUNING_DEFAULTS})
+    return knobs
+
 async def get_rag():
     global _rag
     if _rag is None:
@@ -31,7 +63,8 @@ async def get_rag():
             graph_storage="Neo4JStorage",
             llm_model_func=ollama_model_complete,
             llm_model_name=GEN_MODEL,
-            llm_model_kwargs={"host": OLLAMA_HOST, "options": {"num_ctx": 32768}},
+            # same num_ctx as the API's answers: a different one makes a shared Ollama reload the model
+            llm_model_kwargs={"host": OLLAMA_HOST, "options": ollama_options(), "keep_alive": keep_alive()},
             embedding_func=EmbeddingFunc(
                 embedding_dim=768,
                 max_token_size=8192,
@@ -39,6 +72,8 @@ async def get_rag():
                     texts, embed_model=EMBED_MODEL, host=OLLAMA_HOST
                 ),
             ),
+            **storage_kwargs(),
+            **load_tuning(),
         )
         await _rag.initialize_storages()
         await initialize_pipeline_status()
@@ -0,0 +1,323 @@
+# lr_disk_storage.py
+# Disk-backed LightRAG storages, selected with LR_STORAGE=disk (see lightrag_client.storage_kwargs).
+# - SQLiteKVStorage: one SQLite file per KV namespace; rows are read on demand instead of
+#   parsing kv_store_*.json into memory at initialize_storages()
+# - MmapVectorStorage: unit-normalized float32 rows in vdb_<ns>.f32, memory-mapped read-only
+#   on first query (pages are shared by every process through the OS page cache), plus a
+#   SQLite id index (id -> row, metadata). Deleted rows are zeroed and reused.
+# Both files are opened lazily and tolerate one writer (ingestion) with many readers (API workers).
+
+import os, json, time, asyncio, sqlite3
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, List, final
+
+import numpy as np
+
+from lightrag.base import BaseKVStorage, BaseVectorStorage
+from lightrag.utils import compute_mdhash_id, logger
+
+MODULE = __name__
+
+def _workspace_dir(self) -> str:
+    working_dir = self.global_config["working_dir"]
+    d = os.path.join(working_dir, self.workspace) if self.workspace else working_dir
+    os.makedirs(d, exist_ok=True)
+    return d
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")       # readers never block the ingest writer
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+@contextmanager
+def _tx(conn: sqlite3.Connection):
+    """One write transaction. Connections run in autocommit (reads never hold a snapshot open),
+    so `with conn:` alone would commit statement by statement; BEGIN IMMEDIATE also takes the
+    write lock up front, before upsert() reads the rows it is about to allocate."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+# ------------------ KV ------------------
+@final
+@dataclass
+class SQLiteKVStorage(BaseKVStorage):
+    def __post_init__(self):
+        self._path = os.path.join(_workspace_dir(self), f"kv_store_{self.namespace}.sqlite")
+        self._conn = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = _connect(self._path)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS kv (id TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID")
+        return self._conn
+
+    @staticmethod
+    def _row(id: str, raw: str) -> Dict[str, Any]:
+        d = json.loads(raw)
+        d.setdefault("create_time", 0)
+        d.setdefault("update_time", 0)
+        d["_id"] = id
+        return d
+
+    async def get_by_id(self, id: str) -> Dict[str, Any] | None:
+        r = self.conn.execute("SELECT value FROM kv WHERE id=?", (id,)).fetchone()
+        return self._row(id, r[0]) if r else None
+
+    async def get_by_ids(self, ids: List[str]) -> List[Dict[str, Any]]:
+        ids = list(ids)
+        found: Dict[str, str] = {}
+        for i in range(0, len(ids), 500):
+            part = ids[i:i+500]
+            q = f"SELECT id, value FROM kv WHERE id IN ({','.join('?' * len(part))})"
+            found.update(self.conn.execute(q, part).fetchall())
+        return [self._row(i, found[i]) if i in found else None for i in ids]
+
+    async def get_all(self) -> Dict[str, Any]:
+        return {i: self._row(i, v) for i, v in self.conn.execute("SELECT id, value FROM kv")}
+
+    async def filter_keys(self, keys: set[str]) -> set[str]:
+        keys = list(keys)
+        present = set()
+        for i in range(0, len(keys), 500):
+            part = keys[i:i+500]
+            q = f"SELECT id FROM kv WHERE id IN ({','.join('?' * len(part))})"
+            present.update(r[0] for r in self.conn.execute(q, part))
+        return set(keys) - present
+
+    async def upsert(self, data: Dict[str, Dict[str, Any]]) -> None:
+        if not data:
+            return
+        now = int(time.time())
+        existing = set(data) - await self.filter_keys(set(data))
+        rows = []
+        for k, v in data.items():
+            if self.namespace.endswith("text_chunks"):
+                v.setdefault("llm_cache_list", [])
+            if k not in existing:
+                v["create_time"] = now
+            v["update_time"] = now
+            v["_id"] = k
+            rows.append((k, json.dumps(v, ensure_ascii=False)))
+        with _tx(self.conn):
+            # keep create_time of existing rows
+            self.conn.executemany("""
+            INSERT INTO kv (id, value) VALUES (?, ?)
+            ON CONFLICT(id) DO UPDATE SET value =
+              json_set(excluded.value, '$.create_time', coalesce(json_extract(kv.value, '$.create_time'), 0))
+            """, rows)
+
+    async def delete(self, ids: List[str]) -> None:
+        ids = list(ids)                               # LightRAG passes sets as well as lists
+        with _tx(self.conn):
+            self.conn.executemany("DELETE FROM kv WHERE id=?", [(i,) for i in ids])
+
+    async def index_done_callback(self) -> None:
+        pass                                          # every write is already committed
+
+    async def drop(self) -> Dict[str, str]:
+        try:
+            with _tx(self.conn):
+                self.conn.execute("DELETE FROM kv")
+            return {"status": "success", "message": "data dropped"}
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+    async def finalize(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+# ------------------ Vectors ------------------
+@final
+@dataclass
+class MmapVectorStorage(BaseVectorStorage):
+    def __post_init__(self):
+        kwargs = self.global_config.get("vector_db_storage_cls_kwargs", {})
+        threshold = kwargs.get("cosine_better_than_threshold")
+        if threshold is None:
+            raise ValueError("cosine_better_than_threshold must be specified in vector_db_storage_cls_kwargs")
+        self.cosine_better_than_threshold = threshold
+        d = _workspace_dir(self)
+        self._vec_path = os.path.join(d, f"vdb_{self.namespace}.f32")
+        self._idx_path = os.path.join(d, f"vdb_{self.namespace}.sqlite")
+        self._dim = self.embedding_func.embedding_dim
+        self._max_batch_size = self.global_config["embedding_batch_num"]
+        self._conn = None
+        self._mm = None                               # read-only memmap, (re)opened when the file grows
+
+    # -- lazy handles --
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = _connect(self._idx_path)
+            self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS vec (id TEXT PRIMARY KEY, row INTEGER NOT NULL UNIQUE,
+                                            meta TEXT NOT NULL, created_at INTEGER);
+            CREATE TABLE IF NOT EXISTS free_rows (row INTEGER PRIMARY KEY);
+            """)
+        return self._conn
+
+    def _n_rows(self) -> int:
+        return os.path.getsize(self._vec_path) // (4 * self._dim) if os.path.exists(self._vec_path) else 0
+
+    def _matrix(self):
+        n = self._n_rows()
+        if n == 0:
+            return None
+        if self._mm is None or self._mm.shape[0] != n:
+            self._mm = np.memmap(self._vec_path, dtype=np.float32, mode="r", shape=(n, self._dim))
+        return self._mm
+
+    def _write_rows(self, rows: List[int], vecs: np.ndarray):
+        mode = "r+b" if os.path.exists(self._vec_path) else "w+b"
+        with open(self._vec_path, mode) as f:
+            for r, v in zip(rows, vecs):
+                f.seek(r * 4 * self._dim)
+                f.write(np.ascontiguousarray(v, dtype=np.float32).tobytes())
+
+    def _out(self, id: str, meta: str, created_at, **extra) -> Dict[str, Any]:
+        return {**json.loads(meta), **extra, "id": id, "created_at": created_at}
+
+    # -- writes --
+    async def upsert(self, data: Dict[str, Dict[str, Any]]) -> None:
+        if not data:
+            return
+        contents = [v["content"] for v in data.values()]
+        batches = [contents[i:i+self._max_batch_size] for i in range(0, len(contents), self._max_batch_size)]
+        embeddings = np.concatenate(await asyncio.gather(*(self.embedding_func(b) for b in batches)))
+        if len(embeddings) != len(data):
+            logger.error(f"[{self.workspace}] embedding is not 1-1 with data, {len(embeddings)} != {len(data)}")
+            return
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = (embeddings / np.where(norms == 0, 1, norms)).astype(np.float32)
+
+        now = int(time.time())
+        ids = list(data)
+        with _tx(self.conn):
+            rows_of = dict(self.conn.execute(
+                f"SELECT id, row FROM vec WHERE id IN ({','.join('?' * len(ids))})", ids).fetchall())
+            free = [r for (r,) in self.conn.execute("SELECT row FROM free_rows ORDER BY row")]
+            next_row = self._n_rows()
+            rows = []
+            for k in ids:
+                if k in rows_of:
+                    r = rows_of[k]
+                elif free:
+                    r = free.pop(0)
+                    self.conn.execute("DELETE FROM free_rows WHERE row=?", (r,))
+                else:
+                    r, next_row = next_row, next_row + 1
+                rows.append(r)
+            self._write_rows(rows, embeddings)
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO vec (id, row, meta, created_at) VALUES (?,?,?,?)",
+                [(k, r, json.dumps({f: v for f, v in data[k].items() if f in self.meta_fields},
+                                   ensure_ascii=False), now) for k, r in zip(ids, rows)])
+
+    async def delete(self, ids: List[str]):
+        ids = list(ids)
+        if not ids:
+            return
+        with _tx(self.conn):
+            q = f"SELECT row FROM vec WHERE id IN ({','.join('?' * len(ids))})"
+            rows = [r for (r,) in self.conn.execute(q, ids)]
+            self._write_rows(rows, np.zeros((len(rows), self._dim), dtype=np.float32))
+            self.conn.executemany("DELETE FROM vec WHERE id=?", [(i,) for i in ids])
+            self.conn.executemany("INSERT OR IGNORE INTO free_rows VALUES (?)", [(r,) for r in rows])
+
+    async def delete_entity(self, entity_name: str) -> None:
+        await self.delete([compute_mdhash_id(entity_name, prefix="ent-")])
+
+    async def delete_entity_relation(self, entity_name: str) -> None:
+        ids = [i for (i,) in self.conn.execute(
+            "SELECT id FROM vec WHERE json_extract(meta, '$.src_id') = ? OR json_extract(meta, '$.tgt_id') = ?",
+            (entity_name, entity_name))]
+        await self.delete(ids)
+
+    # -- reads --
+    async def query(self, query: str, top_k: int, query_embedding: List[float] = None) -> List[Dict[str, Any]]:
+        if query_embedding is None:
+            query_embedding = (await self.embedding_func([query], _priority=5))[0]
+        mm = self._matrix()
+        if mm is None:
+            return []
+        q = np.asarray(query_embedding, dtype=np.float32)
+        q = q / (np.linalg.norm(q) or 1.0)
+        scores = mm @ q                               # zeroed (deleted) rows score 0
+        k = min(len(scores), top_k)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        top = [int(r) for r in top if scores[r] > self.cosine_better_than_threshold]
+        if not top:
+            return []
+        q_rows = f"SELECT row, id, meta, created_at FROM vec WHERE row IN ({','.join('?' * len(top))})"
+        by_row = {r: (i, m, c) for r, i, m, c in self.conn.execute(q_rows, top)}
+        return [self._out(by_row[r][0], by_row[r][1], by_row[r][2], distance=float(scores[r]))
+                for r in top if r in by_row]
+
+    async def get_by_id(self, id: str) -> Dict[str, Any] | None:
+        r = self.conn.execute("SELECT id, meta, created_at FROM vec WHERE id=?", (id,)).fetchone()
+        return self._out(*r) if r else None
+
+    async def get_by_ids(self, ids: List[str]) -> List[Dict[str, Any]]:
+        ids = list(ids)
+        if not ids:
+            return []
+        q = f"SELECT id, meta, created_at FROM vec WHERE id IN ({','.join('?' * len(ids))})"
+        found = {r[0]: r for r in self.conn.execute(q, ids)}
+        return [self._out(*found[i]) for i in ids if i in found]
+
+    async def get_vectors_by_ids(self, ids: List[str]) -> Dict[str, List[float]]:
+        ids, mm = list(ids), self._matrix()
+        if not ids or mm is None:
+            return {}
+        q = f"SELECT id, row FROM vec WHERE id IN ({','.join('?' * len(ids))})"
+        return {i: mm[r].tolist() for i, r in self.conn.execute(q, ids) if r < mm.shape[0]}
+
+    @property
+    async def client_storage(self):
+        # Shape expected by lightrag.utils (entity rename): {"data": [meta..., with __id__]}
+        return {"data": [{**json.loads(m), "__id__": i} for i, m in self.conn.execute("SELECT id, meta FROM vec")]}
+
+    async def index_done_callback(self) -> bool:
+        self._mm = None                               # next query re-maps the grown file
+        return True
+
+    async def drop(self) -> Dict[str, str]:
+        try:
+            self._mm = None
+            if os.path.exists(self._vec_path):
+                os.remove(self._vec_path)
+            with _tx(self.conn):
+                self.conn.execute("DELETE FROM vec")
+                self.conn.execute("DELETE FROM free_rows")
+            return {"status": "success", "message": "data dropped"}
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+    async def finalize(self):
+        self._mm = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+# ------------------ Registration ------------------
+def register() -> None:
+    """Make the classes above selectable by name in LightRAG(kv_storage=..., vector_storage=...)."""
+    from lightrag.kg import STORAGES, STORAGE_IMPLEMENTATIONS, STORAGE_ENV_REQUIREMENTS
+    for name, kind in (("SQLiteKVStorage", "KV_STORAGE"), ("MmapVectorStorage", "VECTOR_STORAGE")):
+        STORAGES[name] = MODULE
+        STORAGE_ENV_REQUIREMENTS.setdefault(name, [])
+        impls = STORAGE_IMPLEMENTATIONS[kind]["implementations"]
+        if name not in impls:
+            impls.append(name)
+
+register()
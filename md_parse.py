@@ -0,0 +1,186 @@
+# md_parse.py
+# Markdown parsing shared by extract_qa.py and augment_sections_from_md.py.
+# - parse() tokenizes a page once: each line is matched against the header regex a single
+#   time and headers are linked into a tree with a stack, so every section's end line is
+#   known after one pass (no per-header scan over the remaining headers)
+# - leaf_sections() gives each section only its own text (up to the next chunk header), with
+#   its heading path, so parents no longer repeat their children; split_tokens() bounds
+#   chunk size for the embedding model
+# - map_pages() fans pages out to a process pool and yields results in input order, so the
+#   callers stream JSONL exactly as their sequential loops did. The pool is opt-in (MD_WORKERS)
+#   and only starts from MD_POOL_MIN_PAGES pages: parsing runs at ~200 pages/s on one core, so
+#   worker start-up (a fresh interpreter each on Windows) and pickling pages outweigh the gain
+#   on a crawl of a few hundred pages (4 workers were slower than 1 on 300)
+
+import os, re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+# Match headings: #, ##, ###, ####, etc.
+HDR_RE = re.compile(r"^(#{1,6})\s+(.*\S)\s*$")
+
+WORKERS        = int(os.getenv("MD_WORKERS", "1"))         # >1 for large corpora only, see above
+CHUNK_PAGES    = int(os.getenv("MD_CHUNK_PAGES", "32"))    # pages per task sent to a worker
+POOL_MIN_PAGES = max(int(os.getenv("MD_POOL_MIN_PAGES", "2000")), 2 * CHUNK_PAGES)  # fewer parse inline
+CHARS_PER_TOKEN = float(os.getenv("CHARS_PER_TOKEN", "3.5"))  # same rough estimate as build_kg.py
+CHUNK_TOKENS   = int(os.getenv("CHUNK_TOKENS", "512"))     # per chunk; well inside nomic-embed-text's window
+CHUNK_OVERLAP  = int(os.getenv("CHUNK_OVERLAP", "0"))      # tokens repeated between consecutive pieces
+
+SENT_RE = re.compile(r"(?<=[.!?;:])\s+")
+
+def norm(s: str) -> str:
+    # same result as re.sub(r"\s+", " ", s).strip(): str.split() and \s share one whitespace set
+    return " ".join((s or "").split())
+
+@dataclass
+class Section:
+    line: int                   # line index of the header
+    level: int
+    title: str
+    end: int                    # exclusive: next header of the same or higher importance, else EOF
+    parent: Optional[int] = None
+    children: List[int] = field(default_factory=list)
+
+@dataclass
+class Doc:
+    lines: List[str]
+    sections: List[Section]     # in document order
+    header_at: Dict[int, int]   # line index -> index into sections
+    _normed: Optional[List[str]] = field(default=None, repr=False)
+
+    def body(self, s: Section) -> List[str]:
+        """Lines under the header, children included."""
+        return self.lines[s.line + 1:s.end]
+
+    def body_text(self, s: Section) -> str:
+        """norm("\n".join(body)), normalizing each line only once however deeply sections nest."""
+        if self._normed is None:
+            self._normed = [norm(ln) for ln in self.lines]
+        return " ".join(filter(None, self._normed[s.line + 1:s.end]))
+
+def parse(text: str) -> Doc:
+    lines = text.splitlines()
+    sections: List[Section] = []
+    header_at: Dict[int, int] = {}
+    open_ = []                  # stack of section indexes whose end is not known yet
+    for i, ln in enumerate(lines):
+        ln = ln.strip()
+        m = HDR_RE.match(ln) if ln[:1] == "#" else None
+        if not m:
+            continue
+        level = len(m.group(1))
+        while open_ and sections[open_[-1]].level >= level:
+            sections[open_.pop()].end = i
+        parent = open_[-1] if open_ else None
+        idx = len(sections)
+        sections.append(Section(i, level, norm(m.group(2)), len(lines), parent))
+        if parent is not None:
+            sections[parent].children.append(idx)
+        header_at[i] = idx
+        open_.append(idx)
+    return Doc(lines, sections, header_at)
+
+def leaf_sections(doc: Doc, is_chunk: Callable[[Section], bool]):
+    """
+    Yield (section, heading_path, own_text) for every section accepted by `is_chunk`.
+    Own text runs from the header to the next chunk header, so a parent keeps only its
+    intro and each line belongs to exactly one chunk. Headers of other sections (too deep,
+    too short) stay inside the text as their titles. heading_path lists the titles of the
+    enclosing chunk sections, outermost first, ending with the section's own.
+    """
+    if doc._normed is None:
+        doc._normed = [norm(ln) for ln in doc.lines]
+    chunk_idx = [i for i, s in enumerate(doc.sections) if is_chunk(s)]
+    chunk_set = set(chunk_idx)
+    for k, idx in enumerate(chunk_idx):
+        s = doc.sections[idx]
+        stop = doc.sections[chunk_idx[k + 1]].line if k + 1 < len(chunk_idx) else len(doc.lines)
+        parts = []
+        for i in range(s.line + 1, stop):
+            h = doc.header_at.get(i)
+            t = doc.sections[h].title if h is not None else doc._normed[i]
+            if t:
+                parts.append(t)
+        path, p = [s.title], s.parent
+        while p is not None:
+            if p in chunk_set:
+                path.append(doc.sections[p].title)
+            p = doc.sections[p].parent
+        yield s, path[::-1], " ".join(parts)
+
+def est_tokens(text: str) -> int:
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+def split_tokens(text: str, max_tokens: int, overlap: int = 0) -> List[str]:
+    """
+    Split text into pieces of at most ~max_tokens, breaking after sentences (words when a
+    sentence alone is too long). With overlap > 0, up to that many tokens of trailing
+    sentences are repeated at the start of the next piece.
+    """
+    max_chars = int(max_tokens * CHARS_PER_TOKEN)
+    if len(text) <= max_chars:
+        return [text]
+    overlap_chars = int(min(overlap, max_tokens // 2) * CHARS_PER_TOKEN)
+    units = []
+    for sent in SENT_RE.split(text):
+        while len(sent) > max_chars:
+            cut = sent.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            units.append(sent[:cut])
+            sent = sent[cut:].lstrip()
+        if sent:
+            units.append(sent)
+    pieces, cur, size = [], [], -1                  # size = len(" ".join(cur))
+    for u in units:
+        if cur and size + 1 + len(u) > max_chars:
+            pieces.append(" ".join(cur))
+            keep, kept = [], -1
+            for v in reversed(cur):
+                if kept + 1 + len(v) > overlap_chars or kept + 2 + len(v) + len(u) > max_chars:
+                    break
+                keep.insert(0, v); kept += 1 + len(v)
+            cur, size = keep, kept
+        cur.append(u); size += 1 + len(u)
+    if cur:
+        pieces.append(" ".join(cur))
+    return pieces
+
+# ------------------ Parallel map ------------------
+def _run_chunk(fn: Callable, chunk: list) -> list:
+    return [fn(p) for p in chunk]
+
+def map_pages(fn: Callable, pages: Iterable, workers: int = WORKERS) -> Iterator:
+    """
+    fn(page) for every page, in input order. `fn` must be a module-level function (it is
+    pickled to the workers). At most 2 * workers chunks are in flight, so memory stays
+    bounded however many pages the iterator yields.
+    """
+    pages = iter(pages)
+    head = list(islice(pages, POOL_MIN_PAGES))
+    if workers <= 1 or len(head) < POOL_MIN_PAGES:
+        for p in head:
+            yield fn(p)
+        for p in pages:
+            yield fn(p)
+        return
+
+    def chunks():
+        yield head[:CHUNK_PAGES]
+        yield head[CHUNK_PAGES:]
+        while True:
+            c = list(islice(pages, CHUNK_PAGES))
+            if not c:
+                return
+            yield c
+
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        pending = deque()
+        for c in chunks():
+            pending.append(ex.submit(_run_chunk, fn, c))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
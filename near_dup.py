@@ -0,0 +1,81 @@
+# near_dup.py
+# Near-duplicate detection for kb rows (MinHash + LSH), used by finalize_kb.py.
+# - shingles: word n-grams of the lowercased question + answer, hashed to 32 bits (crc32)
+# - MinHash: NEARDUP_PERM multiply-shift hashes per shingle, min per row (numpy)
+# - LSH: the signature is cut into bands; only rows sharing a band bucket are compared, so
+#   the work grows with rows + candidates rather than with all pairs
+# - candidates are confirmed with the exact Jaccard of their shingle sets; each row joins the
+#   first earlier canonical row it matches (no chaining A~B~C into one cluster)
+
+import os, zlib
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+THRESHOLD = float(os.getenv("NEARDUP_THRESHOLD", "0.8"))   # Jaccard to collapse; <= 0 disables
+NUM_PERM  = int(os.getenv("NEARDUP_PERM", "128"))          # MinHash signature length
+SHINGLE   = int(os.getenv("NEARDUP_SHINGLE", "3"))         # words per shingle
+SEED      = 1
+
+def shingles(text: str, n: int = SHINGLE) -> np.ndarray:
+    words = text.lower().split()
+    grams = {" ".join(words[i:i + n]) for i in range(max(len(words) - n + 1, 1))}
+    return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+
+def choose_bands(threshold: float, num_perm: int = NUM_PERM):
+    """
+    (bands, rows) with bands * rows == num_perm whose S-curve midpoint (1/b)^(1/r) is the
+    highest one still below `threshold`: favours recall, exact Jaccard removes the false hits.
+    """
+    best = (num_perm, 1)
+    for r in range(1, num_perm + 1):
+        if num_perm % r == 0 and (r / num_perm) ** (1 / r) < threshold:
+            best = (num_perm // r, r)
+    return best
+
+class MinHasher:
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = SEED):
+        rng = np.random.default_rng(seed)
+        # odd multipliers: (a * x + b) mod 2^64, top 32 bits kept (multiply-shift hashing)
+        self.a = rng.integers(1, 2**63, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self.b = rng.integers(0, 2**63, size=num_perm, dtype=np.uint64)
+
+    def signature(self, sh: np.ndarray) -> np.ndarray:
+        h = (sh[:, None] * self.a[None, :] + self.b[None, :]) >> np.uint64(32)
+        return h.min(axis=0)
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+def cluster(texts: Sequence[str], groups: Sequence = None, threshold: float = THRESHOLD) -> List[int]:
+    """
+    canon[i] = index of the row that row i collapses into (i itself if it is canonical).
+    Rows are only compared within the same `groups` value (e.g. kb kind).
+    """
+    if threshold <= 0:
+        return list(range(len(texts)))
+    bands, rows = choose_bands(threshold)
+    mh = MinHasher(bands * rows)
+    buckets: Dict[tuple, List[int]] = {}
+    sets: Dict[int, frozenset] = {}                  # shingle sets of canonical rows only
+    canon = []
+    for i, text in enumerate(texts):
+        sh = shingles(text)
+        sig = mh.signature(sh)
+        g = groups[i] if groups is not None else None
+        keys = [(g, k, sig[k * rows:(k + 1) * rows].tobytes()) for k in range(bands)]
+        mine, target = frozenset(sh.tolist()), i
+        tried = set()
+        for key in keys:
+            for j in buckets.get(key, ()):
+                if j in tried:
+                    continue
+                tried.add(j)
+                if jaccard(mine, sets[j]) >= threshold and (target == i or j < target):
+                    target = j
+        canon.append(target)
+        if target == i:
+            sets[i] = mine
+            for key in keys:
+                buckets.setdefault(key, []).append(i)
+    return canon
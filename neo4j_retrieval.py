@@ -0,0 +1,140 @@
+# neo4j_retrieval.py
+# Hybrid retrieval straight from the Neo4j indexes embed_and_load.py builds, as an
+# alternative to LightRAG's mix mode (app.py: AskRequest.retriever = "neo4j").
+# - one Cypher round trip: idx_chunk_embedding (vector) and idx_fulltext_chunk (Lucene) are
+#   queried in a UNION subquery and fused with reciprocal-rank fusion, sum(1 / (RRF_K + rank))
+# - scoped to pages (page_router.py): exact cosine over just those pages' chunks instead of the
+#   vector index, full-text hits filtered to them
+# - async driver with a connection pool, and one pooled httpx client for the query embedding
+#   (same Ollama endpoint / model as embed_and_load.py, so vectors are comparable)
+
+import os, re
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from dotenv import load_dotenv
+from neo4j import AsyncGraphDatabase, RoutingControl
+
+from kb_store import chunk_block
+from ollama_opts import keep_alive
+
+load_dotenv()
+
+NEO4J_URI      = os.getenv("NEO4J_URI", "neo4j://localhost:7687")
+NEO4J_USER     = os.getenv("NEO4J_USER", "neo4j")
+NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "neo4j_password")
+NEO4J_POOL     = int(os.getenv("NEO4J_POOL_SIZE", "32"))      # connections kept by the async driver
+OLLAMA_HOST    = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+EMBED_MODEL    = os.getenv("EMBED_MODEL", "nomic-embed-text")
+TOPK_VECTOR    = int(os.getenv("TOPK_VECTOR", "8"))           # candidates from each index
+TOPK_FULLTEXT  = int(os.getenv("TOPK_FULLTEXT", "10"))
+RRF_K          = int(os.getenv("RRF_K", "60"))                # standard RRF damping constant
+MAX_CONTEXT_CHARS = int(os.getenv("MAX_CONTEXT_CHARS", "4000"))
+
+# ranks are 1-based; each branch returns (node, rrf) for its own top k
+VECTOR_BRANCH = """
+  CALL db.index.vector.queryNodes('idx_chunk_embedding', $k_vec, $embedding) YIELD node, score
+  WITH collect(node) AS nodes
+  UNWIND range(0, size(nodes) - 1) AS i
+  RETURN nodes[i] AS node, 1.0 / ($rrf_k + i + 1) AS rrf
+"""
+# chunks not embedded yet are skipped: their null score would sort first under DESC
+SCOPED_VECTOR_BRANCH = """
+  MATCH (p:Page)<-[:FROM_PAGE]-(c:Chunk) WHERE p.url IN $urls
+  WITH DISTINCT c
+  WHERE c.embedding IS NOT NULL
+  WITH c AS node, vector.similarity.cosine(c.embedding, $embedding) AS score
+  ORDER BY score DESC LIMIT $k_vec
+  WITH collect(node) AS nodes
+  UNWIND range(0, size(nodes) - 1) AS i
+  RETURN nodes[i] AS node, 1.0 / ($rrf_k + i + 1) AS rrf
+"""
+FULLTEXT_BRANCH = """
+  CALL db.index.fulltext.queryNodes('idx_fulltext_chunk', $text) YIELD node, score
+  WITH node, score ORDER BY score DESC LIMIT $k_ft
+  WITH collect(node) AS nodes
+  UNWIND range(0, size(nodes) - 1) AS i
+  RETURN nodes[i] AS node, 1.0 / ($rrf_k + i + 1) AS rrf
+"""
+FUSE = """
+WITH node, sum(rrf) AS score
+ORDER BY score DESC LIMIT $top_k
+RETURN node.id AS id, node.kind AS kind, node.question AS question, node.answer AS answer,
+       node.url AS url, node.section AS section, score
+"""
+SCOPED_FULLTEXT_BRANCH = FULLTEXT_BRANCH.replace(
+    "YIELD node, score\n",
+    "YIELD node, score\n  WHERE EXISTS { (node)-[:FROM_PAGE]->(p:Page) WHERE p.url IN $urls }\n")
+
+def compose(vector: str, fulltext: str = None) -> str:
+    return "CALL {" + vector + ("  UNION ALL" + fulltext if fulltext else "") + "}" + FUSE
+
+HYBRID_QUERY = compose(VECTOR_BRANCH, FULLTEXT_BRANCH)
+VECTOR_QUERY = compose(VECTOR_BRANCH)                         # query has no searchable terms
+SCOPED_QUERY = compose(SCOPED_VECTOR_BRANCH, SCOPED_FULLTEXT_BRANCH)
+SCOPED_VECTOR_QUERY = compose(SCOPED_VECTOR_BRANCH)
+
+LUCENE_SPECIAL = re.compile(r'([+\-!(){}\[\]^"~*?:\\/&|])')
+
+_driver = None
+_http = None
+
+def get_driver():
+    global _driver
+    if _driver is None:
+        _driver = AsyncGraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD),
+                                            max_connection_pool_size=NEO4J_POOL)
+    return _driver
+
+async def close():
+    global _driver, _http
+    if _driver is not None:
+        await _driver.close()
+        _driver = None
+    if _http is not None:
+        await _http.aclose()
+        _http = None
+
+async def embed_query(text: str) -> List[float]:
+    global _http
+    if _http is None:
+        _http = httpx.AsyncClient(timeout=30.0)
+    r = await _http.post(f"{OLLAMA_HOST}/api/embeddings", json={"model": EMBED_MODEL, "prompt": text,
+                                                                   "keep_alive": keep_alive()})
+    r.raise_for_status()
+    vec = r.json().get("embedding")
+    if not vec:
+        raise RuntimeError("Invalid embedding response")
+    return vec
+
+def lucene_query(text: str) -> str:
+    """Terms of the question, escaped, OR-ed by Lucene's default operator; '' if none."""
+    # lowercased so a literal AND / OR / NOT in the question is a term, not an operator
+    return " ".join(LUCENE_SPECIAL.sub(r"\\\1", w) for w in re.findall(r"\w[\w'+&-]*", text.lower()))
+
+async def hybrid_search(query: str, top_k: int = 6, urls: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """Chunks ranked by RRF over the vector and full-text indexes, best first; only `urls`' if given."""
+    embedding = await embed_query(query)
+    text = lucene_query(query)
+    if urls:
+        cypher = SCOPED_QUERY if text else SCOPED_VECTOR_QUERY
+    else:
+        cypher = HYBRID_QUERY if text else VECTOR_QUERY
+    records, _, _ = await get_driver().execute_query(
+        cypher,
+        {"embedding": embedding, "text": text, "urls": urls or [], "k_vec": max(TOPK_VECTOR, top_k),
+         "k_ft": max(TOPK_FULLTEXT, top_k), "rrf_k": RRF_K, "top_k": top_k},
+        routing_=RoutingControl.READ,
+    )
+    return [r.data() for r in records]
+
+async def retrieve_context_with_sources(query: str, top_k: int = 6,
+                                        urls: Optional[List[str]] = None) -> Tuple[str, List[str], List[Dict[str, Any]]]:
+    """(context, urls, hits) in the same shape lightrag_client returns, plus the ranked chunks."""
+    hits = await hybrid_search(query, top_k, urls)
+    blocks, urls = [], []
+    for h in hits:
+        blocks.append(chunk_block(h))
+        if h["url"] not in urls:
+            urls.append(h["url"])
+    return "\n\n".join(blocks)[:MAX_CONTEXT_CHARS], urls, hits
@@ -0,0 +1,32 @@
+# ollama_opts.py
+# Request settings shared by every caller of the local Ollama models (API answers, LightRAG's
+# keyword / extraction calls, build_kg.py, query embeddings), so they never disagree:
+# - num_ctx is a load-time parameter: a request with a different value makes Ollama reload the
+#   model, so one OLLAMA_NUM_CTX serves everyone (8192 fits LightRAG's extraction prompts)
+# - keep_alive (OLLAMA_KEEP_ALIVE: "30m", seconds, or -1 = until Ollama stops) keeps models
+#   resident between bursts instead of Ollama's 5 minute default
+# - num_predict (OLLAMA_NUM_PREDICT) caps answers; it is per request, so callers whose output
+#   is longer (extraction) override it without a reload
+
+import os
+from typing import Any, Dict, Union
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+OLLAMA_NUM_CTX     = int(os.getenv("OLLAMA_NUM_CTX", "8192"))
+OLLAMA_NUM_PREDICT = int(os.getenv("OLLAMA_NUM_PREDICT", "600"))   # same cap as OpenRouter's max_tokens
+OLLAMA_KEEP_ALIVE  = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+def keep_alive(value: str = OLLAMA_KEEP_ALIVE) -> Union[str, int, float]:
+    """keep_alive as Ollama parses it: bare numbers are seconds ("-1" as a string is rejected)."""
+    try:
+        n = float(value)
+    except ValueError:
+        return value
+    return int(n) if n.is_integer() else n
+
+def ollama_options(**overrides: Any) -> Dict[str, Any]:
+    """`options` for /api/chat and /api/generate: the shared num_ctx / num_predict, plus overrides."""
+    return {"num_ctx": OLLAMA_NUM_CTX, "num_predict": OLLAMA_NUM_PREDICT, **overrides}
@@ -0,0 +1,145 @@
+# page_router.py
+# Routes a question to the test page(s) it names ("Food Sensitivity Profile 2", "Candida + IBS
+# Profile") so retrieval searches only their chunks instead of the whole corpus.
+# - names per page, from the KB store: the slug's last segment (embed_and_load.slug_from_url),
+#   the page title (first heading of its sections) and FAQ section names minus "FAQs for (the)"
+# - a page scores the idf-weighted share of its best name's tokens found in the question;
+#   idf is over all page names, so "profile" / "panel" count little and "candida" a lot
+# - confident when the best page reaches ROUTER_MIN_SCORE; pages within ROUTER_MARGIN of it
+#   are kept (at most ROUTER_MAX_PAGES); otherwise the caller searches globally
+# - scoped_search() ranks the routed pages' rows with BM25, for retrievers that cannot be
+#   filtered by page (LightRAG); the Neo4j retriever filters in Cypher instead
+# - scored_search() also returns each row's share of the question's attainable BM25 (every
+#   token matched at saturation = 1.0): a page name alone reaches ~0.2-0.4, an on-topic
+#   question ~0.75, so below ROUTER_MIN_BM25 the caller falls back to the global search
+#
+# Usage: python page_router.py "<question>"
+
+import os, re, sys, math
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Set, Tuple
+
+from embed_and_load import slug_from_url
+
+ROUTER_MIN_SCORE = float(os.getenv("ROUTER_MIN_SCORE", "0.6"))
+ROUTER_MARGIN    = float(os.getenv("ROUTER_MARGIN", "0.15"))
+ROUTER_MAX_PAGES = int(os.getenv("ROUTER_MAX_PAGES", "3"))
+ROUTER_MIN_BM25  = float(os.getenv("ROUTER_MIN_BM25", "0.5"))    # 0 = always trust the routed pages
+BM25_K1, BM25_B  = 1.2, 0.75
+
+FAQ_PREFIX_RE = re.compile(r"^\s*f(?:requently\s+asked\s+questions|aqs?)\s+(?:for|about|on)?\s*(?:the\s+)?", re.I)
+STOP = {"the", "for", "of", "and", "a", "an", "to", "in", "on", "is", "faq", "faqs", "test", "tests",
+        "vibrant", "wellness", "what", "how", "do", "does", "i", "my"}
+
+def tokens(text: str) -> List[str]:
+    out = []
+    for t in re.findall(r"[a-z0-9]+", (text or "").lower()):
+        if t in STOP:
+            continue
+        out.append(t[:-1] if len(t) > 3 and t.endswith("s") and not t.endswith("ss") else t)
+    return out
+
+@dataclass
+class Route:
+    pages: List[Tuple[str, float]] = field(default_factory=list)   # (url, score) best first; [] = global
+    best: float = 0.0                                               # top score, even when not confident
+
+    @property
+    def urls(self) -> List[str]:
+        return [u for u, _ in self.pages]
+
+class PageRouter:
+    def __init__(self, rows: Iterable[Dict]):
+        titles: Dict[str, Counter] = defaultdict(Counter)
+        names: Dict[str, Set[Tuple[str, ...]]] = defaultdict(set)
+        self.rows_by_url: Dict[str, List[Dict]] = defaultdict(list)
+        self.seq: Dict[str, int] = {}                  # row id -> position in the KB (page order)
+        df, n_rows, total_len = Counter(), 0, 0
+        for r in rows:
+            url = r.get("url")
+            if not url:
+                continue
+            self.seq[r["id"]] = len(self.seq)
+            for u in dict.fromkeys(r.get("urls") or [url]):
+                self.rows_by_url[u].append(r)
+            if r.get("heading_path"):
+                titles[url][r["heading_path"][0]] += 1
+            if r.get("kind") == "qa" and r.get("section"):
+                names[url].add(tuple(tokens(FAQ_PREFIX_RE.sub("", r["section"]))))
+            toks = set(tokens(f"{r.get('question', '')} {r.get('answer', '')}"))
+            df.update(toks)
+            n_rows += 1
+            total_len += len(toks)
+        for url in self.rows_by_url:
+            slug = slug_from_url(url).rsplit("/", 1)[-1]
+            names[url].add(tuple(tokens(slug.replace("-", " "))))
+            if titles[url]:
+                names[url].add(tuple(tokens(titles[url].most_common(1)[0][0])))
+        self.names = {u: [n for n in ns if n] for u, ns in names.items()}
+        name_df = Counter(t for ns in self.names.values() for t in {t for n in ns for t in n})
+        n_pages = max(len(self.names), 1)
+        self.name_idf = {t: math.log(1 + n_pages / c) for t, c in name_df.items()}
+        # BM25 statistics over every row (scoped_search scores the routed pages' rows with them)
+        self.row_idf = {t: math.log(1 + (n_rows - c + 0.5) / (c + 0.5)) for t, c in df.items()}
+        self.avg_len = total_len / max(n_rows, 1)
+        # token -> pages with a name containing it, so a question only scores pages it can match
+        self.pages_with: Dict[str, Set[str]] = defaultdict(set)
+        for u, ns in self.names.items():
+            for n in ns:
+                for t in n:
+                    self.pages_with[t].add(u)
+
+    def name_score(self, q: Set[str], name: Tuple[str, ...]) -> float:
+        total = sum(self.name_idf[t] for t in name)
+        return sum(self.name_idf[t] for t in name if t in q) / total if total else 0.0
+
+    def route(self, query: str) -> Route:
+        q = set(tokens(query))
+        candidates = set().union(*(self.pages_with.get(t, ()) for t in q)) if q else set()
+        scored = sorted(((max(self.name_score(q, n) for n in self.names[u]), u) for u in candidates), reverse=True)
+        if not scored:
+            return Route()
+        best = scored[0][0]
+        if best < ROUTER_MIN_SCORE:
+            return Route(best=best)
+        pages = [(u, s) for s, u in scored if s >= best - ROUTER_MARGIN][:ROUTER_MAX_PAGES]
+        return Route(pages=pages, best=best)
+
+    def scoped_search(self, query: str, urls: List[str], top_k: int) -> List[Dict]:
+        """BM25-ranked kb rows of `urls` (near-duplicates merged into them included)."""
+        return [r for _, r in self.scored_search(query, urls, top_k)]
+
+    def scored_search(self, query: str, urls: List[str], top_k: int) -> List[Tuple[float, Dict]]:
+        """scoped_search() as (score, row), score normalized by the question's attainable BM25."""
+        q = set(tokens(query))
+        ideal = sum(self.row_idf.get(t, 0.0) for t in q) * (BM25_K1 + 1)
+        scored, seen = [], set()
+        for u in urls:
+            for r in self.rows_by_url.get(u, ()):
+                if r["id"] in seen:
+                    continue
+                seen.add(r["id"])
+                tf = Counter(tokens(f"{r.get('question', '')} {r.get('answer', '')}"))
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * len(tf) / self.avg_len)
+                s = sum(self.row_idf.get(t, 0.0) * tf[t] * (BM25_K1 + 1) / (tf[t] + norm) for t in q if t in tf)
+                if s > 0:
+                    scored.append((s / ideal, r))
+        scored.sort(key=lambda x: -x[0])
+        return scored[:top_k]
+
+def main():
+    from kb_store import iter_kb
+    if len(sys.argv) < 2:
+        sys.exit('Usage: python page_router.py "<question>"')
+    router = PageRouter(iter_kb())
+    route = router.route(sys.argv[1])
+    if not route.pages:
+        print(f"[route] global search (best page score {route.best:.2f} < {ROUTER_MIN_SCORE})")
+    for u, s in route.pages:
+        print(f"[route] {s:.2f} {u}")
+    for s, r in router.scored_search(sys.argv[1], route.urls, 5) if route.pages else []:
+        print(f"  {s:.2f} {r['question'][:100]}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+# page_store.py
+# Compressed, content-addressed store for crawled pages; replaces data/raw_html, data/md and
+# url_map.tsv as the source of truth (url_map.tsv is still exported for anything reading it).
+# - data/pages/objects/<h[:2]>/<h>.zst: zstd blobs named by sha256 of the content, so the
+#   same HTML / markdown served under several URLs is stored once
+# - data/pages/index.sqlite: url -> uid, current html/md hashes and fetch time; every
+#   replaced or removed version moves to `history`
+# - iter_markdown() streams (uid, url, markdown) one page at a time, and reads the legacy
+#   data/md + url_map.tsv layout when no store has been built yet
+#
+# Usage: python page_store.py import-legacy | report | export-url-map
+
+import os, sys, time, sqlite3, hashlib, pathlib, argparse
+from typing import Iterator, Optional, Tuple
+
+import zstandard
+
+DATA_DIR   = pathlib.Path("data")
+STORE_DIR  = pathlib.Path(os.getenv("PAGE_STORE_DIR", str(DATA_DIR / "pages")))
+ZSTD_LEVEL = int(os.getenv("PAGE_STORE_ZSTD_LEVEL", "10"))
+
+# legacy layout written by crawl_vibrant.py before the store
+LEGACY_RAW_DIR = DATA_DIR / "raw_html"
+LEGACY_MD_DIR  = DATA_DIR / "md"
+URL_MAP_PATH   = DATA_DIR / "url_map.tsv"
+
+class PageStore:
+    def __init__(self, root: pathlib.Path = STORE_DIR):
+        self.root = pathlib.Path(root)
+        self.objects = self.root / "objects"
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.root / "index.sqlite")
+        self.conn.executescript("""
+        PRAGMA journal_mode=WAL;
+        CREATE TABLE IF NOT EXISTS pages (
+            url TEXT PRIMARY KEY, uid TEXT NOT NULL UNIQUE,
+            html_hash TEXT, md_hash TEXT, fetched_at REAL);
+        CREATE TABLE IF NOT EXISTS history (
+            url TEXT NOT NULL, uid TEXT NOT NULL, html_hash TEXT, md_hash TEXT,
+            fetched_at REAL, replaced_at REAL, removed INTEGER DEFAULT 0);
+        CREATE INDEX IF NOT EXISTS history_url ON history(url);
+        """)
+        self._cctx = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+        self._dctx = zstandard.ZstdDecompressor()
+
+    # ------------------ blobs ------------------
+    def _blob_path(self, h: str) -> pathlib.Path:
+        return self.objects / h[:2] / f"{h}.zst"
+
+    def put_blob(self, text: str) -> str:
+        data = (text or "").encode("utf-8")
+        h = hashlib.sha256(data).hexdigest()
+        p = self._blob_path(h)
+        if not p.exists():                            # identical content is written once
+            p.parent.mkdir(exist_ok=True)
+            tmp = p.with_suffix(".tmp")
+            tmp.write_bytes(self._cctx.compress(data))
+            tmp.replace(p)
+        return h
+
+    def get_blob(self, h: Optional[str]) -> str:
+        if not h:
+            return ""
+        return self._dctx.decompress(self._blob_path(h).read_bytes()).decode("utf-8", errors="ignore")
+
+    # ------------------ pages ------------------
+    def put(self, url: str, uid: str, html: str, md: str, fetched_at: Optional[float] = None):
+        """Store the current version of `url`; the version it replaces goes to history."""
+        html_hash, md_hash = self.put_blob(html), self.put_blob(md)
+        now = time.time()
+        with self.conn:
+            prev = self.conn.execute("SELECT uid, html_hash, md_hash, fetched_at FROM pages WHERE url=?",
+                                     (url,)).fetchone()
+            if prev and (prev[1], prev[2]) == (html_hash, md_hash):
+                self.conn.execute("UPDATE pages SET fetched_at=? WHERE url=?", (fetched_at or now, url))
+                return
+            if prev:
+                self.conn.execute("INSERT INTO history VALUES (?,?,?,?,?,?,0)", (url, *prev, now))
+            self.conn.execute("INSERT OR REPLACE INTO pages VALUES (?,?,?,?,?)",
+                              (url, uid, html_hash, md_hash, fetched_at or now))
+
+    def remove(self, url: str):
+        with self.conn:
+            prev = self.conn.execute("SELECT uid, html_hash, md_hash, fetched_at FROM pages WHERE url=?",
+                                     (url,)).fetchone()
+            if prev:
+                self.conn.execute("INSERT INTO history VALUES (?,?,?,?,?,?,1)", (url, *prev, time.time()))
+                self.conn.execute("DELETE FROM pages WHERE url=?", (url,))
+
+    def has(self, uid: str) -> bool:
+        return self.conn.execute("SELECT 1 FROM pages WHERE uid=?", (uid,)).fetchone() is not None
+
+    def get(self, uid: str, kind: str = "md") -> Optional[str]:
+        col = "md_hash" if kind == "md" else "html_hash"
+        r = self.conn.execute(f"SELECT {col} FROM pages WHERE uid=?", (uid,)).fetchone()
+        return self.get_blob(r[0]) if r else None
+
+    def versions(self, url: str):
+        """[(html_hash, md_hash, fetched_at, replaced_at, removed)] oldest first, then the current one."""
+        rows = self.conn.execute("SELECT html_hash, md_hash, fetched_at, replaced_at, removed FROM history "
+                                 "WHERE url=? ORDER BY replaced_at", (url,)).fetchall()
+        cur = self.conn.execute("SELECT html_hash, md_hash, fetched_at FROM pages WHERE url=?", (url,)).fetchone()
+        return rows + ([(*cur, None, 0)] if cur else [])
+
+    def url_map(self) -> dict:
+        return dict(self.conn.execute("SELECT uid, url FROM pages"))
+
+    def iter_pages(self, kind: str = "md") -> Iterator[Tuple[str, str, str]]:
+        """(uid, url, text) in uid order, decompressing one page at a time."""
+        col = "md_hash" if kind == "md" else "html_hash"
+        rows = self.conn.execute(f"SELECT uid, url, {col} FROM pages ORDER BY uid").fetchall()
+        for uid, url, h in rows:
+            yield uid, url, self.get_blob(h)
+
+    def export_url_map(self, path: pathlib.Path = URL_MAP_PATH):
+        with open(path, "w", encoding="utf-8") as f:
+            for uid, url in sorted(self.url_map().items()):
+                f.write(f"{uid}\t{url}\n")
+
+    def disk_usage(self) -> int:
+        return sum(_disk_bytes(p) for p in self.root.rglob("*") if p.is_file())
+
+    def close(self):
+        self.conn.close()
+
+# ------------------ Readers ------------------
+def load_url_map(path: pathlib.Path = URL_MAP_PATH) -> dict:
+    m = {}
+    if path.exists():
+        for ln in path.read_text(encoding="utf-8").splitlines():
+            if "\t" in ln:
+                uid, url = ln.split("\t", 1)
+                m[uid] = url
+    return m
+
+def store_exists(root: pathlib.Path = STORE_DIR) -> bool:
+    return (pathlib.Path(root) / "index.sqlite").exists()
+
+def iter_markdown(root: pathlib.Path = STORE_DIR) -> Iterator[Tuple[str, str, str]]:
+    """(uid, url, markdown) for every current page: from the store, else the legacy files."""
+    if store_exists(root):
+        store = PageStore(root)
+        try:
+            yield from store.iter_pages("md")
+        finally:
+            store.close()
+        return
+    url_map = load_url_map()
+    for p in sorted(LEGACY_MD_DIR.glob("*.md")):
+        yield p.stem, url_map.get(p.stem, ""), p.read_text(encoding="utf-8", errors="ignore")
+
+# ------------------ CLI ------------------
+def _disk_bytes(p: pathlib.Path) -> int:
+    st = p.stat()
+    return getattr(st, "st_blocks", 0) * 512 or st.st_size   # allocated blocks, not just length
+
+def import_legacy(store: PageStore):
+    url_map = load_url_map()
+    n = 0
+    for uid, url in sorted(url_map.items()):
+        html_p, md_p = LEGACY_RAW_DIR / f"{uid}.html", LEGACY_MD_DIR / f"{uid}.md"
+        if not md_p.exists():
+            continue
+        html = html_p.read_text(encoding="utf-8", errors="ignore") if html_p.exists() else ""
+        store.put(url, uid, html, md_p.read_text(encoding="utf-8", errors="ignore"), md_p.stat().st_mtime)
+        n += 1
+    blobs = sum(1 for _ in store.objects.rglob("*.zst"))
+    orphans = sum(1 for p in LEGACY_MD_DIR.glob("*.md") if p.stem not in url_map)
+    print(f"[import] {n} pages from {LEGACY_MD_DIR} / {LEGACY_RAW_DIR} -> {store.root} ({blobs} unique blobs)"
+          + (f"; skipped {orphans} .md files with no url in {URL_MAP_PATH}" if orphans else ""))
+
+def _read_all(it) -> Tuple[int, int, float]:
+    t = time.perf_counter()
+    pages = chars = 0
+    for _, _, text in it:
+        pages += 1
+        chars += len(text)
+    return pages, chars, time.perf_counter() - t
+
+def report(store: PageStore):
+    legacy_files = [p for d in (LEGACY_RAW_DIR, LEGACY_MD_DIR) if d.exists() for p in d.iterdir() if p.is_file()]
+    if URL_MAP_PATH.exists():
+        legacy_files.append(URL_MAP_PATH)
+    legacy = sum(_disk_bytes(p) for p in legacy_files)
+    legacy_len = sum(p.stat().st_size for p in legacy_files)
+    ours = store.disk_usage()
+    print(f"[disk] legacy layout: {legacy / 1e6:.2f} MB on disk ({legacy_len / 1e6:.2f} MB content, {len(legacy_files)} files)")
+    print(f"[disk] page store:    {ours / 1e6:.2f} MB on disk"
+          + (f" ({legacy / ours:.1f}x smaller)" if ours else ""))
+
+    rows = [("store md", lambda: store.iter_pages("md")), ("store html", lambda: store.iter_pages("html"))]
+    if LEGACY_MD_DIR.exists():
+        rows.append(("legacy md", lambda: ((p.stem, "", p.read_text(encoding="utf-8", errors="ignore"))
+                                            for p in sorted(LEGACY_MD_DIR.glob("*.md")))))
+    if LEGACY_RAW_DIR.exists():
+        rows.append(("legacy html", lambda: ((p.stem, "", p.read_text(encoding="utf-8", errors="ignore"))
+                                              for p in sorted(LEGACY_RAW_DIR.glob("*.html")))))
+    for name, make in rows:
+        _read_all(make())                             # warm the page cache; compare decoding, not cold I/O
+        pages, chars, dt = _read_all(make())
+        print(f"[read] {name:12} {pages} pages, {chars / 1e6:.2f} M chars in {dt * 1000:.0f} ms "
+              f"({pages / dt if dt else 0:.0f} pages/s, {chars / 1e6 / dt if dt else 0:.1f} M chars/s)")
+
+def main():
+    ap = argparse.ArgumentParser(description="Compressed, content-addressed page store")
+    ap.add_argument("command", choices=["import-legacy", "report", "export-url-map"])
+    args = ap.parse_args()
+    if args.command != "import-legacy" and not store_exists():
+        sys.exit(f"No page store at {STORE_DIR}; run `python page_store.py import-legacy` or crawl first.")
+    store = PageStore()
+    try:
+        if args.command == "import-legacy":
+            import_legacy(store)
+            store.export_url_map()
+        elif args.command == "report":
+            report(store)
+        else:
+            store.export_url_map()
+            print(f"[done] Wrote URL map -> {URL_MAP_PATH.resolve()}")
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    main()
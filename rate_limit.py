@@ -0,0 +1,28 @@
+# rate_limit.py
+# Async token bucket shared by the callers that pace outbound requests:
+# - build_kg.py: OpenRouter extraction calls (one bucket for all workers)
+# - crawl_vibrant.py: one bucket per crawled host (robots.txt Crawl-delay / Request-rate)
+
+import time, asyncio
+
+class TokenBucket:
+    """Async token bucket: `rate` requests/s, up to `burst` back-to-back; rate <= 0 never waits."""
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:           # waiters are served in arrival order
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
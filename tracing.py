@@ -0,0 +1,259 @@
+# tracing.py
+# Opt-in span trees for single /ask requests: where did the time go?
+# - enabled per request (X-Trace header or ?trace= on /ask) and only when TRACE_ENABLED=1;
+#   otherwise nothing is patched and span() is one ContextVar lookup returning a shared no-op
+# - install() wraps, once at startup: httpx.AsyncClient.send (Ollama / OpenRouter / embeddings,
+#   including LightRAG's ollama client), neo4j AsyncSession.run / transaction run, and
+#   LightRAG's query steps (keywords, vector / KG search, context build)
+# - the trace carries the current span in a ContextVar, so LightRAG's gather()ed sub-tasks and
+#   asyncio.to_thread work nest under the span that started them
+# - "profile" mode also samples the event-loop thread's stacks every TRACE_SAMPLE_MS and emits
+#   them collapsed ("a;b;c count"), ready for flamegraph.pl or speedscope; other requests
+#   running on the loop at the same time show up in it too
+# - finished traces go in the response and, with TRACE_DIR set, to TRACE_DIR/<id>.json (+ .folded)
+#
+# Usage: python tracing.py <trace.json>   (prints the tree)
+
+import os, sys, json, time, uuid, pathlib, functools, threading
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TRACE_ENABLED   = os.getenv("TRACE_ENABLED", "0") == "1"
+TRACE_DIR       = os.getenv("TRACE_DIR", "")                    # "" = only returned in the response
+TRACE_SAMPLE_MS = float(os.getenv("TRACE_SAMPLE_MS", "5"))
+
+LIGHTRAG_STEPS = ["get_keywords_from_query", "_get_vector_context", "_perform_kg_search",
+                  "_get_node_data", "_get_edge_data", "_find_related_text_unit_from_entities",
+                  "_find_related_text_unit_from_relations", "_apply_token_truncation",
+                  "_merge_all_chunks", "_build_llm_context"]
+
+class Span:
+    __slots__ = ("name", "attrs", "t0", "ms", "children")
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.name, self.attrs = name, attrs
+        self.t0, self.ms = time.perf_counter(), None
+        self.children: List["Span"] = []
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def to_dict(self, origin: float) -> Dict[str, Any]:
+        d = {"name": self.name, "start_ms": round((self.t0 - origin) * 1e3, 2),
+             "ms": round(self.ms, 2) if self.ms is not None else None}
+        if self.attrs:
+            d["attrs"] = self.attrs
+        if self.children:
+            d["children"] = [c.to_dict(origin) for c in sorted(self.children, key=lambda c: c.t0)]
+        return d
+
+class _NoSpan:
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NO_SPAN = _NoSpan()
+_current: ContextVar[Optional[Span]] = ContextVar("trace_span", default=None)
+
+def span(name: str, **attrs):
+    """Child of the current span as a context manager; NO_SPAN when no trace is running."""
+    parent = _current.get()
+    return NO_SPAN if parent is None else _open(parent, name, attrs)
+
+def annotate(**attrs):
+    """Attributes on the current span (token counts, sizes, ...), if tracing."""
+    s = _current.get()
+    if s is not None:
+        s.set(**attrs)
+
+@contextmanager
+def _open(parent: Span, name: str, attrs: Dict[str, Any]):
+    s = Span(name, attrs)
+    parent.children.append(s)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.attrs["error"] = type(e).__name__
+        raise
+    finally:
+        s.ms = (time.perf_counter() - s.t0) * 1e3
+        _current.reset(token)
+
+# ------------------ Sampling profiler ------------------
+class Sampler(threading.Thread):
+    """Samples one thread's Python stack at a fixed interval into collapsed-stack counts."""
+
+    def __init__(self, thread_id: int, interval_ms: float = TRACE_SAMPLE_MS):
+        super().__init__(daemon=True)
+        self.target, self.interval = thread_id, interval_ms / 1e3
+        self.stacks: Counter = Counter()
+        self.halt = threading.Event()
+
+    def run(self):
+        while not self.halt.wait(self.interval):
+            frame = sys._current_frames().get(self.target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self) -> str:
+        self.halt.set()
+        self.join()
+        return "\n".join(f"{s} {n}" for s, n in self.stacks.most_common())
+
+# ------------------ Trace ------------------
+class Trace:
+    """Root span for one request; use as `with Trace(...) as t:` around the work to record."""
+
+    def __init__(self, name: str, profile: bool = False, **attrs):
+        self.id = uuid.uuid4().hex[:12]
+        self.root = Span(name, attrs)
+        self.profile = profile
+        self.sampler: Optional[Sampler] = None
+        self.folded = ""
+
+    def __enter__(self):
+        self.token = _current.set(self.root)
+        if self.profile:
+            self.sampler = Sampler(threading.get_ident())
+            self.sampler.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.root.ms = (time.perf_counter() - self.root.t0) * 1e3
+        if self.sampler is not None:
+            self.folded = self.sampler.stop()
+        _current.reset(self.token)
+        return False
+
+    def to_dict(self) -> Dict[str, Any]:
+        d = {"id": self.id, "tree": self.root.to_dict(self.root.t0)}
+        if self.profile:
+            d["samples"] = sum(self.sampler.stacks.values()) if self.sampler else 0
+            d["sample_ms"] = TRACE_SAMPLE_MS
+        return d
+
+    def save(self) -> Optional[str]:
+        """Write <id>.json (and <id>.folded) under TRACE_DIR; returns the JSON path."""
+        if not TRACE_DIR:
+            return None
+        out = pathlib.Path(TRACE_DIR)
+        out.mkdir(parents=True, exist_ok=True)
+        path = out / f"{self.id}.json"
+        path.write_text(json.dumps(self.to_dict(), ensure_ascii=False, indent=1), encoding="utf-8")
+        if self.folded:
+            (out / f"{self.id}.folded").write_text(self.folded + "\n", encoding="utf-8")
+        return str(path)
+
+def requested(flag: Optional[str]) -> Optional[str]:
+    """'span' / 'profile' for an X-Trace header or ?trace= value, None when off or not allowed."""
+    if not TRACE_ENABLED or not flag:
+        return None
+    flag = flag.strip().lower()
+    if flag == "profile":
+        return "profile"
+    return "span" if flag in ("1", "true", "yes", "span") else None
+
+# ------------------ Instrumentation ------------------
+def _wrap_async(owner, attr: str, name_of):
+    orig = getattr(owner, attr, None)
+    if orig is None or getattr(orig, "_traced", False):
+        return
+
+    @functools.wraps(orig)
+    async def traced(*args, **kwargs):
+        if _current.get() is None:
+            return await orig(*args, **kwargs)
+        name, attrs = name_of(args, kwargs)
+        with span(name, **attrs):
+            return await orig(*args, **kwargs)
+    traced._traced = True
+    setattr(owner, attr, traced)
+
+def _neo4j_name(args, kwargs):
+    query = args[1] if len(args) > 1 else kwargs.get("query", "")
+    text = getattr(query, "text", query)
+    return "neo4j", {"cypher": " ".join(str(text).split())[:160]}
+
+def usage_attrs(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Token counts / timings from an Ollama reply (final chunk when streamed) or OpenAI-style usage."""
+    usage = data.get("usage") or {}
+    return {k: v for k, v in {
+        "prompt_tokens": data.get("prompt_eval_count", usage.get("prompt_tokens")),
+        "completion_tokens": data.get("eval_count", usage.get("completion_tokens")),
+        "load_ms": data.get("load_duration") and round(data["load_duration"] / 1e6, 1),
+        "prefill_ms": data.get("prompt_eval_duration") and round(data["prompt_eval_duration"] / 1e6, 1),
+        "decode_ms": data.get("eval_duration") and round(data["eval_duration"] / 1e6, 1),
+    }.items() if v is not None}
+
+def _record_tokens(response):
+    """usage_attrs of a buffered JSON response onto the current span (streamed ones are skipped)."""
+    if not response.is_stream_consumed or "json" not in response.headers.get("content-type", ""):
+        return
+    try:
+        data = response.json()
+    except ValueError:
+        return
+    if isinstance(data, dict):
+        annotate(**usage_attrs(data))
+
+def install():
+    """Patch the outbound clients and LightRAG's query steps; a no-op unless TRACE_ENABLED."""
+    if not TRACE_ENABLED:
+        return
+    import httpx
+    orig_send = httpx.AsyncClient.send
+    if not getattr(orig_send, "_traced", False):
+        @functools.wraps(orig_send)
+        async def send(self, request, *args, **kwargs):
+            if _current.get() is None:
+                return await orig_send(self, request, *args, **kwargs)
+            with span(f"http {request.method} {request.url.host}{request.url.path}") as s:
+                response = await orig_send(self, request, *args, **kwargs)
+                s.set(status=response.status_code)
+                _record_tokens(response)
+                return response
+        send._traced = True
+        httpx.AsyncClient.send = send
+
+    from neo4j import AsyncSession
+    from neo4j._async.work.transaction import AsyncTransactionBase
+    _wrap_async(AsyncSession, "run", _neo4j_name)
+    _wrap_async(AsyncTransactionBase, "run", _neo4j_name)
+
+    from lightrag import operate, lightrag as lr
+    for step in LIGHTRAG_STEPS:
+        _wrap_async(operate, step, lambda a, k, step=step: (f"lightrag.{step.lstrip('_')}", {}))
+    _wrap_async(lr, "kg_query", lambda a, k: ("lightrag.kg_query", {}))
+
+# ------------------ CLI ------------------
+def render(node: Dict[str, Any], depth: int = 0):
+    attrs = " ".join(f"{k}={v}" for k, v in (node.get("attrs") or {}).items())
+    print(f"{'  ' * depth}{node['name']:<{max(48 - 2 * depth, 8)}} {node['ms'] or 0:9.1f} ms  +{node['start_ms']:.1f}  {attrs}")
+    for c in node.get("children", []):
+        render(c, depth + 1)
+
+def main():
+    if len(sys.argv) < 2:
+        sys.exit("Usage: python tracing.py <trace.json>")
+    data = json.loads(pathlib.Path(sys.argv[1]).read_text(encoding="utf-8"))
+    render(data.get("tree", data))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# tune_lightrag.py
+# Find LightRAG concurrency knobs that suit this machine's Ollama.
+# - Runs short ingestion trials on a sample of qa.jsonl into scratch working dirs
+#   (default file-based graph storage, so the Neo4j graph is never touched)
+# - Sweeps llm_model_max_async, then embedding_func_max_async, then embedding_batch_num,
+#   keeping the best value of each (coordinate descent instead of the full grid)
+# - Measures docs/s and Ollama error / timeout rates per trial, after one unscored warm-up trial
+#   (model loads, first-request allocations) so the sweep's first trial is not penalized; the
+#   warm-up uses its own docs, so Ollama's prompt cache does not favour the scored trials
+# - Writes the winner to LR_TUNING_FILE, read by ingest_lightrag.py and lightrag_client.get_rag()
+#
+# Usage: python tune_lightrag.py [--sample 24] [--warmup 4] [--max-error-rate 0.05]
+
+import os, json, time, shutil, asyncio, argparse, logging, random
+from pathlib import Path
+
+from lightrag import LightRAG
+from lightrag.kg.shared_storage import initialize_pipeline_status
+from lightrag.llm.ollama import ollama_model_complete, ollama_embed
+from lightrag.utils import EmbeddingFunc
+
+from ollama_opts import ollama_options, keep_alive
+from ingest_lightrag import render, OLLAMA_HOST, EMBED_MODEL, GEN_MODEL
+from lightrag_client import TUNING_FILE, TUNING_DEFAULTS
+
+QA_FILE     = os.getenv("QA_FILE", "./qa.jsonl")
+SCRATCH_DIR = Path(os.getenv("LR_TUNE_DIR", "./lr_tune_scratch"))
+# Ollama serves OLLAMA_NUM_PARALLEL requests per model at once; more LLM workers only queue.
+OLLAMA_PARALLEL = int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))
+CPUS = os.cpu_count() or 4
+
+SWEEP = [
+    ("llm_model_max_async",      sorted({1, 2, 4, OLLAMA_PARALLEL, 2 * OLLAMA_PARALLEL})),
+    ("embedding_func_max_async", sorted({2, 4, 8, min(16, CPUS)})),
+    ("embedding_batch_num",      [8, 16, 32, 64]),
+]
+
+class CallStats:
+    """Counts calls / errors / timeouts for one wrapped Ollama function."""
+    def __init__(self):
+        self.calls = self.errors = self.timeouts = 0
+
+    def wrap(self, fn):
+        async def inner(*args, **kwargs):
+            self.calls += 1
+            try:
+                return await fn(*args, **kwargs)
+            except Exception as e:
+                self.errors += 1
+                if isinstance(e, asyncio.TimeoutError) or "timeout" in type(e).__name__.lower():
+                    self.timeouts += 1
+                raise
+        return inner
+
+    def rate(self) -> float:
+        return self.errors / self.calls if self.calls else 0.0
+
+def load_sample(n: int, seed: int = 13):
+    docs = []
+    with open(QA_FILE, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                doc = render(json.loads(line))
+                if doc:
+                    docs.append(doc)
+    random.Random(seed).shuffle(docs)
+    return docs[:n]
+
+async def trial(knobs: dict, docs, idx: int) -> dict:
+    workdir = SCRATCH_DIR / f"trial_{idx}"
+    shutil.rmtree(workdir, ignore_errors=True)
+    workdir.mkdir(parents=True)
+    llm, emb = CallStats(), CallStats()
+    rag = LightRAG(
+        working_dir=str(workdir),
+        llm_model_func=llm.wrap(ollama_model_complete),
+        llm_model_name=GEN_MODEL,
+        llm_model_kwargs={"host": OLLAMA_HOST, "options": ollama_options(num_predict=-1), "keep_alive": keep_alive()},
+        embedding_func=EmbeddingFunc(
+            embedding_dim=768,
+            max_token_size=8192,
+            func=emb.wrap(lambda texts: ollama_embed(texts, embed_model=EMBED_MODEL, host=OLLAMA_HOST)),
+        ),
+        **knobs,
+    )
+    await rag.initialize_storages()
+    await initialize_pipeline_status()
+    ids, texts = zip(*docs)
+    t0 = time.perf_counter()
+    try:
+        await rag.ainsert(list(texts), ids=list(ids))
+    finally:
+        elapsed = time.perf_counter() - t0
+        await rag.finalize_storages()
+        shutil.rmtree(workdir, ignore_errors=True)
+    res = {
+        "knobs": dict(knobs),
+        "docs_per_s": len(docs) / elapsed if elapsed else 0.0,
+        "seconds": elapsed,
+        "llm_calls": llm.calls, "llm_error_rate": llm.rate(), "llm_timeouts": llm.timeouts,
+        "embed_calls": emb.calls, "embed_error_rate": emb.rate(), "embed_timeouts": emb.timeouts,
+    }
+    logging.info("trial %d %s -> %.2f docs/s | llm err %.1f%% (%d timeouts) | embed err %.1f%% (%d timeouts)",
+                 idx, knobs, res["docs_per_s"], 100 * res["llm_error_rate"], res["llm_timeouts"],
+                 100 * res["embed_error_rate"], res["embed_timeouts"])
+    return res
+
+async def main():
+    ap = argparse.ArgumentParser(description="Sweep LightRAG ingestion concurrency knobs")
+    ap.add_argument("--sample", type=int, default=24, help="docs per trial")
+    ap.add_argument("--warmup", type=int, default=4, help="docs in the unscored warm-up trial (0 = none)")
+    ap.add_argument("--max-error-rate", type=float, default=0.05,
+                    help="trials with a higher LLM or embedding error rate are disqualified")
+    args = ap.parse_args()
+
+    docs = load_sample(args.sample + args.warmup)
+    warm, docs = docs[:args.warmup], docs[args.warmup:]
+    if not docs:
+        raise SystemExit(f"No QA items found in {QA_FILE}")
+    logging.info("Tuning on %d docs | cpus=%d | OLLAMA_NUM_PARALLEL=%d | scratch=%s",
+                 len(docs), CPUS, OLLAMA_PARALLEL, SCRATCH_DIR)
+    if warm:
+        try:
+            await trial(dict(TUNING_DEFAULTS), warm, 0)     # loads both models; not scored
+        except Exception as e:
+            logging.warning("warm-up trial failed: %s", e)
+
+    best = dict(TUNING_DEFAULTS)
+    best_score = -1.0
+    results, idx = [], 0
+    for knob, values in SWEEP:
+        for v in values:
+            knobs = {**best, knob: v}
+            idx += 1
+            try:
+                res = await trial(knobs, docs, idx)
+            except Exception as e:
+                logging.warning("trial %d %s failed: %s", idx, knobs, e)
+                results.append({"knobs": knobs, "error": str(e)})
+                continue
+            results.append(res)
+            ok = max(res["llm_error_rate"], res["embed_error_rate"]) <= args.max_error_rate
+            if ok and res["docs_per_s"] > best_score:
+                best, best_score = knobs, res["docs_per_s"]
+        logging.info("best after %s sweep: %s (%.2f docs/s)", knob, best, best_score)
+
+    shutil.rmtree(SCRATCH_DIR, ignore_errors=True)
+    out = {"best": best, "docs_per_s": best_score, "sample": len(docs),
+           "cpus": CPUS, "ollama_num_parallel": OLLAMA_PARALLEL,
+           "tuned_at": time.strftime("%Y-%m-%d %H:%M:%S"), "trials": results}
+    Path(TUNING_FILE).write_text(json.dumps(out, indent=2), encoding="utf-8")
+    logging.info("Wrote %s: %s", TUNING_FILE, best)
+
+if __name__ == "__main__":
+    asyncio.run(main())